@@ -0,0 +1,129 @@
+"""
+Cache compartido entre requests de los pacientes accesibles por cada cuidador
+Guarda {patient_id: can_manage_medications} por doctor/familiar y se invalida
+cuando cambian sus relaciones (ver api.signals y UserCreationService).
+
+Cota de desactualización: la invalidación borra la llave en el backend
+configurado. Con un backend compartido (ej. Redis) aplica a todos los procesos
+al instante; con memoria local (LocMemCache) solo al proceso que hizo el
+cambio, y los demás workers pueden conservar un acceso revocado hasta
+ACCESS_CACHE_TIMEOUT (30 segundos por defecto fuera de DJANGO_ENV=local).
+Los cambios hechos con QuerySet.update() no disparan señales y dependen del
+mismo vencimiento.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import BooleanField, Value
+
+from .models import DoctorPatientRelation, FamilyPatientRelation
+
+
+class AccessSetCache:
+    """
+    Conjuntos de acceso cuidador -> pacientes sobre el framework de cache de Django.
+    El backend se configura con settings.ACCESS_CACHE_ALIAS (memoria local por defecto).
+    Los contadores de aciertos/fallos son por proceso.
+    """
+
+    KEY_PREFIX = 'access_set'
+    CAREGIVER_TYPES = ('doctor', 'family')
+
+    def __init__(self, alias=None):
+        self._alias = alias
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @property
+    def cache(self):
+        return caches[self._alias or getattr(settings, 'ACCESS_CACHE_ALIAS', 'default')]
+
+    def make_key(self, user_id):
+        return f'{self.KEY_PREFIX}:{user_id}'
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def relations_queryset(self, user):
+        """(patient_id, can_manage_medications) de las relaciones del cuidador"""
+        if user.user_type == 'doctor':
+            return DoctorPatientRelation.objects.filter(
+                doctor_id=user.pk
+            ).values_list('patient_id', Value(True, output_field=BooleanField()))
+        return FamilyPatientRelation.objects.filter(
+            family_member_id=user.pk
+        ).values_list('patient_id', 'can_manage_medications')
+
+    def load(self, user):
+        """Consultar las relaciones del cuidador en la base de datos"""
+        return dict(self.relations_queryset(user))
+
+    async def aload(self, user):
+        return {patient_id: can_manage async for patient_id, can_manage in self.relations_queryset(user)}
+
+    def get_relations(self, user):
+        """{patient_id: can_manage_medications} del cuidador, desde cache si es posible"""
+        if user.user_type not in self.CAREGIVER_TYPES:
+            return {}
+
+        key = self.make_key(user.pk)
+        relations = self.cache.get(key)
+        if relations is not None:
+            self._count('hits')
+            return relations
+
+        self._count('misses')
+        relations = self.load(user)
+        self.cache.set(key, relations)
+        return relations
+
+    async def aget_relations(self, user):
+        """Versión asíncrona de get_relations (cache y ORM async)"""
+        if user.user_type not in self.CAREGIVER_TYPES:
+            return {}
+
+        key = self.make_key(user.pk)
+        relations = await self.cache.aget(key)
+        if relations is not None:
+            self._count('hits')
+            return relations
+
+        self._count('misses')
+        relations = await self.aload(user)
+        await self.cache.aset(key, relations)
+        return relations
+
+    def invalidate(self, *user_ids):
+        """
+        Descartar los conjuntos de los usuarios indicados.
+        Se repite al confirmar la transacción para que un request concurrente
+        no deje en cache datos previos al cambio.
+        """
+        keys = [self.make_key(user_id) for user_id in user_ids if user_id is not None]
+        if not keys:
+            return
+        self.cache.delete_many(keys)
+        self._count('invalidations', len(keys))
+        transaction.on_commit(lambda: self.cache.delete_many(keys))
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        """Aciertos, fallos e invalidaciones desde el inicio del proceso"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+
+access_cache = AccessSetCache()
@@ -0,0 +1,55 @@
+"""
+Resolución del usuario actuante
+El usuario se resuelve una sola vez por request (header User-ID o usuario
+autenticado por DRF) y se comparte entre vistas y servicios. Las vistas async
+usan aget_acting_user para no consultar la base desde el event loop.
+"""
+from .models import User
+
+
+ACTING_USER_ATTR = '_acting_user'
+
+
+def get_acting_user(request):
+    """
+    Usuario que realiza el request.
+    Con requests DRF se prefiere siempre el usuario autenticado; si no hay, se usa el
+    header User-ID, cuyo usuario se memoiza en el HttpRequest subyacente.
+    """
+    http_request = getattr(request, '_request', request)
+    authenticated = getattr(request, 'user', None) if http_request is not request else None
+    if isinstance(authenticated, User) and authenticated.is_authenticated:
+        return authenticated
+
+    user = getattr(http_request, ACTING_USER_ATTR, None)
+    if user is not None:
+        return user
+
+    user_id = http_request.headers.get('User-ID')
+    if not user_id:
+        raise ValueError("User-ID header requerido")
+    try:
+        user = User.objects.get(id=user_id)
+    except (User.DoesNotExist, ValueError):
+        raise ValueError("Usuario no encontrado")
+
+    setattr(http_request, ACTING_USER_ATTR, user)
+    return user
+
+
+async def aget_acting_user(request):
+    """Versión asíncrona de get_acting_user para vistas async (header User-ID)"""
+    user = getattr(request, ACTING_USER_ATTR, None)
+    if user is not None:
+        return user
+
+    user_id = request.headers.get('User-ID')
+    if not user_id:
+        raise ValueError("User-ID header requerido")
+    try:
+        user = await User.objects.aget(id=user_id)
+    except (User.DoesNotExist, ValueError):
+        raise ValueError("Usuario no encontrado")
+
+    setattr(request, ACTING_USER_ATTR, user)
+    return user
@@ -0,0 +1,370 @@
+"""
+Analítica de adherencia sobre el historial de Intakes
+Adherencia = tomas realizadas / tomas planificadas, por paciente y por
+medicamento en ventanas móviles, calculada con agregados agrupados en la
+base de datos. Las distribuciones de retraso (taken_at - planned_at) y las
+rachas usan NumPy si está instalado y un cálculo equivalente en Python si no.
+
+Los dashboards leen el resumen DailyAdherence (O(días) filas en lugar de
+O(intakes)), mantenido incrementalmente por DailyAdherenceRollup.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailyAdherence, Intake, User
+from utils.timezones import get_zone, local_date, local_midnight
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional
+    np = None
+
+
+DEFAULT_WINDOWS = (7, 30, 90)
+COUNTERS = ('planned', 'taken', 'missed', 'skipped')
+
+# Tramos de retraso en minutos: antes de hora, 0-15, 15-30, 30-60, 60-120, más de 120
+LATENESS_EDGES = (0, 15, 30, 60, 120)
+LATENESS_LABELS = ('early', '0-15', '15-30', '30-60', '60-120', '120+')
+LATENESS_PERCENTILES = (50, 90, 99)
+
+
+def status_counts(condition=None):
+    """Agregados condicionales de planned/taken/missed/skipped sobre Intake"""
+    counts = {'planned': Count('id', filter=condition)}
+    for status in COUNTERS[1:]:
+        status_filter = Q(status=status) if condition is None else condition & Q(status=status)
+        counts[status] = Count('id', filter=status_filter)
+    return counts
+
+
+def rollup_sums(condition=None):
+    """Los mismos agregados sobre DailyAdherence"""
+    return {name: Coalesce(Sum(name, filter=condition), 0) for name in COUNTERS}
+
+
+def adherence_ratio(taken, planned):
+    return round(taken / planned, 4) if planned else None
+
+
+def percentile(sorted_values, q):
+    """Percentil con interpolación lineal (mismo método por defecto que numpy.percentile)"""
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class AdherenceAnalytics:
+    """
+    Métricas de adherencia para uno o varios pacientes.
+
+    Con los intakes solo cuentan los que ya vencieron (ventana [now - days, now)).
+    Con use_rollup=True las métricas por ventana se leen de DailyAdherence y
+    cuentan los días completos [hoy - days, hoy), con hoy en la zona horaria de
+    cada paciente. Los retrasos y las rachas siempre se calculan sobre los intakes.
+    """
+
+    def __init__(self, now=None, use_numpy=None, use_rollup=False):
+        self.now = now or timezone.now()
+        self.use_numpy = np is not None if use_numpy is None else use_numpy and np is not None
+        self.use_rollup = use_rollup
+        self.todays = {}
+
+    def local_todays(self, patient_ids):
+        """{patient_id: fecha local de now} según la zona horaria de cada paciente; una consulta por paciente nuevo"""
+        missing = set(patient_ids) - self.todays.keys()
+        if missing:
+            for patient_id, tz_name in User.objects.filter(id__in=missing).values_list('id', 'tz'):
+                self.todays[patient_id] = local_date(self.now, tz_name)
+        return {patient_id: self.todays[patient_id] for patient_id in patient_ids if patient_id in self.todays}
+
+    def window(self, days):
+        return self.now - timedelta(days=days), self.now
+
+    def intakes(self, patient_ids, days):
+        since, until = self.window(days)
+        return Intake.objects.filter(
+            schedule__user_id__in=patient_ids,
+            planned_at__gte=since,
+            planned_at__lt=until,
+        )
+
+    def daily_rows(self, patient_ids, days):
+        by_today = defaultdict(list)
+        for patient_id, today in self.local_todays(patient_ids).items():
+            by_today[today].append(patient_id)
+        if not by_today:
+            return DailyAdherence.objects.none()
+
+        condition = Q()
+        for today, ids in by_today.items():
+            condition |= Q(patient_id__in=ids, date__gte=today - timedelta(days=days), date__lt=today)
+        return DailyAdherence.objects.filter(condition)
+
+    def source(self, patient_ids, days):
+        """
+        (queryset, agregados, campos de paciente, campos de medicamento) según la fuente.
+        Los campos se expresan como argumentos de values(): (nombres, {alias: expresión}).
+        """
+        if self.use_rollup:
+            return (
+                self.daily_rows(patient_ids, days), rollup_sums,
+                (('patient_id',), {}),
+                (('medication_id',), {'medication_name': F('medication__name')}),
+            )
+        return (
+            self.intakes(patient_ids, days), status_counts,
+            ((), {'patient_id': F('schedule__user_id')}),
+            ((), {'medication_id': F('schedule__medication_id'), 'medication_name': F('schedule__medication__name')}),
+        )
+
+    @staticmethod
+    def summarize(row):
+        """Fila de agregados con su porcentaje de adherencia"""
+        row['adherence'] = adherence_ratio(row['taken'], row['planned'])
+        return row
+
+    def by_patient(self, patient_ids, days=30):
+        """{patient_id: métricas} de varios pacientes en una sola consulta agrupada"""
+        rows, aggregates, (fields, expressions), _ = self.source(patient_ids, days)
+        rows = rows.values(*fields, **expressions).annotate(**aggregates()).order_by()
+        return {row.pop('patient_id'): self.summarize(row) for row in rows}
+
+    def by_medication(self, patient_id, days=30):
+        """Métricas de un paciente por medicamento en una sola consulta agrupada"""
+        rows, aggregates, _, (fields, expressions) = self.source([patient_id], days)
+        rows = rows.values(*fields, **expressions).annotate(**aggregates()).order_by('medication_name')
+        return [self.summarize(row) for row in rows]
+
+    def sliding_windows(self, patient_id, windows=DEFAULT_WINDOWS):
+        """Métricas de varias ventanas móviles en una sola consulta con agregados condicionales"""
+        rows, aggregates, _, _ = self.source([patient_id], max(windows))
+        totals = {}
+        for days in windows:
+            if self.use_rollup:
+                today = self.local_todays([patient_id]).get(patient_id, self.now.date())
+                in_window = Q(date__gte=today - timedelta(days=days))
+            else:
+                in_window = Q(planned_at__gte=self.now - timedelta(days=days))
+            totals.update({
+                f'{name}_{days}': aggregate for name, aggregate in aggregates(in_window).items()
+            })
+        totals = rows.aggregate(**totals)
+
+        return {
+            days: self.summarize({name: totals[f'{name}_{days}'] for name in COUNTERS})
+            for days in windows
+        }
+
+    def lateness_minutes(self, patient_id, days=30):
+        """Retraso en minutos (taken_at - planned_at) de las tomas realizadas, calculado en la base de datos"""
+        delays = self.intakes([patient_id], days).filter(
+            status='taken', taken_at__isnull=False
+        ).annotate(
+            delay=ExpressionWrapper(F('taken_at') - F('planned_at'), output_field=DurationField())
+        ).values_list('delay', flat=True)
+        return [delay.total_seconds() / 60 for delay in delays.iterator()]
+
+    def lateness_distribution(self, minutes):
+        """Percentiles, media y tramos del retraso en minutos"""
+        if not len(minutes):
+            return {'count': 0, 'mean': None, 'percentiles': {}, 'buckets': dict.fromkeys(LATENESS_LABELS, 0)}
+
+        if self.use_numpy:
+            values = np.sort(np.asarray(minutes, dtype=float))
+            mean = float(values.mean())
+            percentiles = [float(value) for value in np.percentile(values, LATENESS_PERCENTILES)]
+            counts = np.bincount(
+                np.searchsorted(LATENESS_EDGES, values, side='right'), minlength=len(LATENESS_LABELS)
+            ).tolist()
+        else:
+            values = sorted(minutes)
+            mean = sum(values) / len(values)
+            percentiles = [percentile(values, q) for q in LATENESS_PERCENTILES]
+            counts = [0] * len(LATENESS_LABELS)
+            for value in values:
+                counts[bisect_right(LATENESS_EDGES, value)] += 1
+
+        return {
+            'count': len(values),
+            'mean': round(mean, 2),
+            'percentiles': {f'p{q}': round(value, 2) for q, value in zip(LATENESS_PERCENTILES, percentiles)},
+            'buckets': dict(zip(LATENESS_LABELS, counts)),
+        }
+
+    def taken_flags(self, patient_id, days=30):
+        """Secuencia taken/no taken de los intakes vencidos en orden de planned_at"""
+        statuses = self.intakes([patient_id], days).order_by('planned_at', 'id').values_list('status', flat=True)
+        return [status == 'taken' for status in statuses.iterator()]
+
+    def streaks(self, flags):
+        """Racha actual y racha más larga de tomas consecutivas realizadas"""
+        if not len(flags):
+            return {'current': 0, 'longest': 0}
+
+        if self.use_numpy:
+            taken = np.concatenate(([False], np.asarray(flags, dtype=bool), [False]))
+            changes = np.flatnonzero(np.diff(taken.astype(np.int8)))
+            runs = changes[1::2] - changes[0::2]
+            longest = int(runs.max()) if len(runs) else 0
+            current = int(runs[-1]) if len(runs) and flags[-1] else 0
+        else:
+            longest = current = 0
+            for flag in flags:
+                current = current + 1 if flag else 0
+                longest = max(longest, current)
+
+        return {'current': current, 'longest': longest}
+
+    def patient_report(self, patient_id, days=30, windows=DEFAULT_WINDOWS):
+        """Reporte completo de adherencia de un paciente"""
+        return {
+            'windows': self.sliding_windows(patient_id, windows),
+            'medications': self.by_medication(patient_id, days),
+            'lateness': self.lateness_distribution(self.lateness_minutes(patient_id, days)),
+            'streaks': self.streaks(self.taken_flags(patient_id, days)),
+        }
+
+
+class DailyAdherenceRollup:
+    """
+    Mantiene DailyAdherence de forma incremental.
+
+    Los productores (materializador, ingesta de eventos, barrido de perdidos)
+    acumulan deltas por (paciente, medicamento, fecha local) y los aplican con
+    flush() dentro de su misma transacción: un upsert por día afectado que
+    suma los deltas a los contadores existentes. 'planned' es el total de
+    tomas programadas; taken/missed/skipped cuentan los intakes en ese estado.
+    """
+
+    STATUS_COUNTERS = COUNTERS[1:]
+
+    def __init__(self):
+        self.deltas = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    def __len__(self):
+        return len(self.deltas)
+
+    @staticmethod
+    def local_date(planned_at, tz_name):
+        """Fecha del intake en la zona horaria del paciente"""
+        return local_date(planned_at, tz_name)
+
+    def add(self, patient_id, medication_id, planned_at, tz_name, **counts):
+        """Sumar deltas a los contadores del día local del intake"""
+        delta = self.deltas[(patient_id, medication_id, self.local_date(planned_at, tz_name))]
+        for name, amount in counts.items():
+            delta[name] += amount
+
+    def subtract(self, intakes, tz_name):
+        """
+        Descontar los intakes que se van a borrar, agrupados por día local en una
+        sola consulta. Todos deben ser de pacientes de la zona tz_name.
+        """
+        daily = intakes.values(
+            patient_id=F('schedule__user_id'),
+            medication_id=F('schedule__medication_id'),
+            date=TruncDate('planned_at', tzinfo=get_zone(tz_name)),
+        ).annotate(**status_counts()).order_by()
+        for row in daily:
+            delta = self.deltas[(row['patient_id'], row['medication_id'], row['date'])]
+            for name in COUNTERS:
+                delta[name] -= row[name]
+
+    def transition(self, patient_id, medication_id, planned_at, tz_name, old_status, new_status):
+        """Registrar el cambio de estado de un intake"""
+        if old_status == new_status:
+            return
+        counts = {}
+        if old_status in self.STATUS_COUNTERS:
+            counts[old_status] = -1
+        if new_status in self.STATUS_COUNTERS:
+            counts[new_status] = 1
+        self.add(patient_id, medication_id, planned_at, tz_name, **counts)
+
+    def upsert_sql(self):
+        quote = connection.ops.quote_name
+        table = quote(DailyAdherence._meta.db_table)
+        counters = [quote(name) for name in COUNTERS]
+        columns = [quote('patient_id'), quote('medication_id'), quote('date')] + counters + [
+            quote('created_at'), quote('updated_at')
+        ]
+        updates = [f'{name} = {table}.{name} + excluded.{name}' for name in counters]
+        updates.append(f"{quote('updated_at')} = excluded.{quote('updated_at')}")
+        return (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({quote('patient_id')}, {quote('medication_id')}, {quote('date')}) "
+            f"DO UPDATE SET {', '.join(updates)}"
+        )
+
+    def flush(self):
+        """Aplicar los deltas acumulados (un upsert por día afectado); retorna las filas tocadas"""
+        rows = [
+            (patient_id, medication_id, day, *(delta[name] for name in COUNTERS))
+            for (patient_id, medication_id, day), delta in self.deltas.items()
+            if any(delta.values())
+        ]
+        self.deltas.clear()
+        if not rows:
+            return 0
+
+        now = timezone.now()
+        params = [
+            (patient_id, medication_id, connection.ops.adapt_datefield_value(day), *counts,
+             connection.ops.adapt_datetimefield_value(now), connection.ops.adapt_datetimefield_value(now))
+            for patient_id, medication_id, day, *counts in rows
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(self.upsert_sql(), params)
+        return len(rows)
+
+    @classmethod
+    def rebuild(cls, patient_ids=None, since=None, until=None, batch_size=1000):
+        """
+        Recalcular DailyAdherence desde los intakes (backfills o correcciones).
+        Agrupa por zona horaria de los pacientes: una consulta agregada por zona
+        con TruncDate en la zona del paciente. since/until son fechas locales
+        (until exclusiva). Retorna el número de filas escritas.
+        """
+        patients = User.objects.filter(user_type='patient')
+        if patient_ids is not None:
+            patients = patients.filter(id__in=patient_ids)
+
+        existing = DailyAdherence.objects.filter(patient__in=patients)
+        if since:
+            existing = existing.filter(date__gte=since)
+        if until:
+            existing = existing.filter(date__lt=until)
+
+        written = 0
+        with transaction.atomic():
+            existing.delete()
+            for tz_name in patients.values_list('tz', flat=True).distinct().order_by():
+                tzinfo = get_zone(tz_name)
+                intakes = Intake.objects.filter(schedule__user__in=patients.filter(tz=tz_name))
+                if since:
+                    intakes = intakes.filter(planned_at__gte=local_midnight(since, tzinfo))
+                if until:
+                    intakes = intakes.filter(planned_at__lt=local_midnight(until, tzinfo))
+
+                daily = intakes.values(
+                    patient_id=F('schedule__user_id'),
+                    medication_id=F('schedule__medication_id'),
+                    date=TruncDate('planned_at', tzinfo=tzinfo),
+                ).annotate(**status_counts()).order_by()
+
+                batch = []
+                for row in daily.iterator(chunk_size=batch_size):
+                    batch.append(DailyAdherence(**row))
+                    if len(batch) >= batch_size:
+                        written += len(DailyAdherence.objects.bulk_create(batch))
+                        batch = []
+                written += len(DailyAdherence.objects.bulk_create(batch))
+        return written
@@ -0,0 +1,128 @@
+"""
+Variantes async de las vistas de lectura más consultadas
+Bajo ASGI se ejecutan en el event loop sin pasar por el adaptador sync_to_async
+de la vista completa: el usuario actuante, los permisos y las consultas usan el
+ORM async (aget, iteración async), así un worker atiende muchas conexiones lentas.
+Las respuestas son idénticas a las de las vistas sync en api.views.
+"""
+import traceback
+
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .models import Schedule
+from .permissions import PermissionMixin
+from .views import serialize_caregiver_patient, serialize_caregivers, serialize_schedule
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPatientCaregiversView(View, PermissionMixin):
+    """Versión async de PatientCaregiversView"""
+
+    async def get(self, request):
+        try:
+            user = await self.aget_user_from_request(request)
+
+            if user.user_type != 'patient':
+                return JsonResponse({
+                    'error': 'Solo los pacientes pueden ver sus cuidadores'
+                }, status=403)
+
+            relations = await user.aget_caregiver_relations()
+
+            return JsonResponse({
+                'success': True,
+                'caregivers': serialize_caregivers(relations)
+            })
+
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPatientSchedulesView(View, PermissionMixin):
+    """Versión async de PatientSchedulesView"""
+
+    async def get(self, request):
+        try:
+            user = await self.aget_user_from_request(request)
+
+            if user.user_type != 'patient':
+                return JsonResponse({
+                    'error': 'Solo los pacientes pueden ver sus programaciones'
+                }, status=403)
+
+            schedules = user.get_my_schedules().select_related('medication')
+
+            return JsonResponse({
+                'success': True,
+                'schedules': [serialize_schedule(schedule) async for schedule in schedules]
+            })
+
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCaregiverPatientsView(View, PermissionMixin):
+    """Versión async de CaregiverPatientsView"""
+
+    async def get(self, request):
+        try:
+            user = await self.aget_user_from_request(request)
+
+            if user.user_type not in ['doctor', 'family']:
+                return JsonResponse({
+                    'error': 'Solo doctores y familiares pueden ver pacientes'
+                }, status=403)
+
+            relations = await user.aget_patient_relations()
+
+            return JsonResponse({
+                'success': True,
+                'patients': [serialize_caregiver_patient(user, relation) for relation in relations]
+            })
+
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPatientSchedulesByCaregiverView(View, PermissionMixin):
+    """Versión async de PatientSchedulesByCaregiverView"""
+
+    async def get(self, request, patient_id):
+        try:
+            user = await self.aget_user_from_request(request)
+            permissions = await self.aget_permission_context(request, user)
+
+            # Verificar permisos (relaciones ya cargadas, sin consultas)
+            if not permissions.can_view_patient_data(patient_id):
+                return JsonResponse({
+                    'error': 'No tienes permisos para ver este paciente'
+                }, status=403)
+
+            schedules = Schedule.objects.filter(user_id=patient_id).select_related('medication')
+
+            return JsonResponse({
+                'success': True,
+                'schedules': [serialize_schedule(schedule) async for schedule in schedules],
+                'can_manage': permissions.can_manage_schedules(patient_id)
+            })
+
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
@@ -0,0 +1,156 @@
+"""
+Calendario de dosis de un paciente
+Expande en el servidor los schedules activos sobre una ventana de fechas locales
+y los combina con el estado de los Intake ya materializados. Todo se procesa
+como streams ordenados por tiempo, sin construir listas de la ventana completa.
+"""
+import heapq
+import json
+from datetime import timedelta
+from itertools import groupby
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+from .models import Intake, Schedule
+from .patterns import compile_pattern
+from utils.timezones import get_zone, local_midnight
+
+# Orden dentro de un mismo (planned_at, schedule): el intake materializado va
+# antes que la ocurrencia calculada, que solo se emite si no hay intake
+INTAKE, OCCURRENCE = 0, 1
+
+
+class DoseCalendar:
+    """
+    Dosis de un paciente entre dos fechas locales (ambas incluidas).
+    - Cada schedule aporta un generador de ocurrencias ya ordenado.
+    - Los intakes de la ventana llegan ordenados desde una sola consulta.
+    - heapq.merge combina los k + 1 streams por (planned_at, schedule_id).
+    """
+
+    MAX_DAYS = 366
+    INTAKE_CHUNK_SIZE = 2000
+    DEFAULT_DAYS = 30
+
+    def __init__(self, patient, start_date, end_date):
+        if end_date < start_date:
+            raise ValueError("end debe ser posterior o igual a start")
+        if (end_date - start_date).days >= self.MAX_DAYS:
+            raise ValueError(f"El rango máximo es de {self.MAX_DAYS} días")
+
+        self.patient = patient
+        self.start_date = start_date
+        self.end_date = end_date
+        self.tz = get_zone(patient.tz)
+        self.window_start = local_midnight(start_date, self.tz)
+        self.window_end = local_midnight(end_date + timedelta(days=1), self.tz)
+        self._schedules = None
+
+    @staticmethod
+    def parse_date(value, name):
+        """Fecha YYYY-MM-DD de un query param (None si no viene)"""
+        if not value:
+            return None
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValueError(f"{name} debe tener formato YYYY-MM-DD")
+        return parsed
+
+    @property
+    def schedules(self):
+        """{schedule_id: Schedule} de los schedules que se solapan con la ventana"""
+        if self._schedules is None:
+            queryset = Schedule.objects.filter(
+                Q(end_date__isnull=True) | Q(end_date__gte=self.start_date),
+                user=self.patient, start_date__lte=self.end_date,
+            ).select_related('medication').order_by('id')
+            self._schedules = {schedule.id: schedule for schedule in queryset}
+        return self._schedules
+
+    def occurrences(self, schedule):
+        """Ocurrencias calculadas del schedule en la ventana, acotadas por su end_date"""
+        try:
+            compiled = compile_pattern(schedule.pattern, self.patient.tz, schedule.start_date)
+        except ValueError:
+            return
+        window_end = self.window_end
+        if schedule.end_date:
+            window_end = min(window_end, local_midnight(schedule.end_date + timedelta(days=1), self.tz))
+        for planned_at in compiled.occurrences_between(self.window_start, window_end):
+            yield planned_at, schedule.id, OCCURRENCE, None, None
+
+    def intakes(self):
+        """Intakes materializados de la ventana, ordenados por (planned_at, schedule_id)"""
+        rows = Intake.objects.filter(
+            schedule_id__in=list(self.schedules),
+            planned_at__gte=self.window_start,
+            planned_at__lt=self.window_end,
+        ).order_by('planned_at', 'schedule_id', 'id').values_list(
+            'planned_at', 'schedule_id', 'id', 'status'
+        )
+        for planned_at, schedule_id, intake_id, status in rows.iterator(chunk_size=self.INTAKE_CHUNK_SIZE):
+            yield planned_at, schedule_id, INTAKE, intake_id, status
+
+    def entries(self):
+        """
+        (planned_at, schedule_id, intake_id, status) en orden cronológico.
+        Las ocurrencias sin intake se emiten con status 'scheduled'.
+        """
+        if not self.schedules:
+            return
+        streams = [self.occurrences(schedule) for schedule in self.schedules.values()]
+        streams.append(self.intakes())
+
+        merged = heapq.merge(*streams)
+        for (planned_at, schedule_id), group in groupby(merged, key=lambda entry: entry[:2]):
+            materialized = False
+            for _, _, kind, intake_id, status in group:
+                if kind == INTAKE:
+                    materialized = True
+                    yield planned_at, schedule_id, intake_id, status
+                elif not materialized:
+                    yield planned_at, schedule_id, None, 'scheduled'
+
+    def doses(self):
+        """Dosis serializables: hora UTC y local del paciente, medicamento y estado"""
+        schedules = self.schedules
+        for planned_at, schedule_id, intake_id, status in self.entries():
+            schedule = schedules[schedule_id]
+            yield {
+                'planned_at': planned_at.isoformat(),
+                'local_time': planned_at.astimezone(self.tz).isoformat(),
+                'schedule_id': str(schedule_id),
+                'intake_id': str(intake_id) if intake_id else None,
+                'status': status,
+                'medication': {
+                    'id': str(schedule.medication.id),
+                    'name': schedule.medication.name,
+                    'form': schedule.medication.form
+                },
+                'dose_amount': schedule.dose_amount
+            }
+
+    def stream_json(self, doses_per_chunk=200):
+        """Respuesta JSON por fragmentos de doses_per_chunk dosis"""
+        header = {
+            'success': True,
+            'patient_id': str(self.patient.id),
+            'timezone': self.patient.tz,
+            'start': self.start_date.isoformat(),
+            'end': self.end_date.isoformat(),
+        }
+        yield json.dumps(header)[:-1] + ', "doses": ['
+        chunk = []
+        first = True
+        for dose in self.doses():
+            chunk.append(json.dumps(dose))
+            if len(chunk) >= doses_per_chunk:
+                yield ('' if first else ', ') + ', '.join(chunk)
+                chunk, first = [], False
+        if chunk:
+            yield ('' if first else ', ') + ', '.join(chunk)
+        yield ']}'
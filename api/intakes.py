@@ -0,0 +1,410 @@
+"""
+Motor de materialización de Intakes
+Expande Schedule.pattern en filas Intake para un horizonte móvil, aplica
+los eventos de toma (taken/missed/skipped) que envían los clientes y marca
+como perdidos los intakes planificados que vencieron.
+"""
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .adherence import DailyAdherenceRollup
+from .models import Schedule, Intake, JobCheckpoint
+from .patterns import compile_pattern
+from utils.timezones import get_zone, local_midnight
+
+
+class IntakeMaterializer:
+    """
+    Genera filas Intake 'planned' para los schedules activos.
+    Es incremental: por cada schedule solo se genera la ventana entre el
+    último planned_at existente y el fin del horizonte.
+    """
+
+    DEFAULT_HORIZON_DAYS = 14
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self, horizon_days=DEFAULT_HORIZON_DAYS, batch_size=DEFAULT_BATCH_SIZE):
+        self.horizon_days = horizon_days
+        self.batch_size = batch_size
+
+    def get_schedule_rows(self, schedules=None, today=None):
+        """Schedules activos con su último planned_at en una sola consulta"""
+        queryset = schedules if schedules is not None else Schedule.objects.all()
+        today = today or timezone.now().date()
+
+        return queryset.filter(
+            Q(end_date__isnull=True) | Q(end_date__gte=today)
+        ).annotate(
+            last_planned_at=Max('intake__planned_at')
+        ).values_list(
+            'id', 'user_id', 'medication_id', 'pattern', 'start_date', 'end_date', 'user__tz', 'last_planned_at'
+        ).order_by('id')
+
+    def materialize(self, schedules=None, now=None):
+        """
+        Materializar intakes hasta now + horizon_days.
+        Retorna estadísticas de la ejecución.
+        """
+        now = now or timezone.now()
+        horizon_end = now + timedelta(days=self.horizon_days)
+
+        pending = []
+        stats = {
+            'schedules_processed': 0,
+            'intakes_created': 0,
+            'invalid_patterns': 0,
+        }
+
+        rows = self.get_schedule_rows(schedules, today=now.date())
+        for (schedule_id, patient_id, medication_id, pattern, start_date, end_date,
+             tz_name, last_planned_at) in rows.iterator(chunk_size=self.batch_size):
+            stats['schedules_processed'] += 1
+
+            # compile_pattern está memoizado: cada patrón se parsea una sola vez
+            try:
+                compiled = compile_pattern(pattern, tz_name, start_date)
+            except ValueError:
+                stats['invalid_patterns'] += 1
+                continue
+            if not compiled.is_schedulable:
+                continue
+
+            # Solo la ventana que falta: desde el último planned_at hasta el fin del horizonte
+            window_start = now
+            if last_planned_at and last_planned_at >= now:
+                window_start = last_planned_at + timedelta(microseconds=1)
+
+            window_end = horizon_end
+            if end_date:
+                schedule_end = local_midnight(end_date + timedelta(days=1), get_zone(tz_name))
+                window_end = min(window_end, schedule_end)
+
+            for planned_at in compiled.occurrences_between(window_start, window_end):
+                pending.append((Intake(schedule_id=schedule_id, planned_at=planned_at),
+                                patient_id, medication_id, tz_name))
+
+            if len(pending) >= self.batch_size:
+                stats['intakes_created'] += self._flush(pending)
+                pending = []
+
+        if pending:
+            stats['intakes_created'] += self._flush(pending)
+
+        return stats
+
+    def _flush(self, pending):
+        """
+        Insertar un lote de (intake, paciente, medicamento, zona) y sumar al
+        resumen diario solo los insertados.
+        Los schedules del lote se bloquean y se descartan los (schedule, planned_at)
+        que ya existen: dos ejecuciones simultáneas (cron solapado, varios nodos)
+        no duplican intakes ni cuentan dos veces 'planned'. Si otro camino inserta
+        alguno de los slots entre la lectura y el insert, el lote se reintenta sin ellos.
+        """
+        schedule_ids = {intake.schedule_id for intake, _, _, _ in pending}
+        with transaction.atomic():
+            list(Schedule.objects.select_for_update().filter(id__in=schedule_ids).values_list('id', flat=True))
+            existing = self.existing_slots(pending)
+            while True:
+                new = [entry for entry in pending if (entry[0].schedule_id, entry[0].planned_at) not in existing]
+                try:
+                    with transaction.atomic():
+                        Intake.objects.bulk_create([intake for intake, _, _, _ in new], batch_size=self.batch_size)
+                    break
+                except IntegrityError:
+                    concurrent = self.existing_slots(pending)
+                    if concurrent <= existing:
+                        raise
+                    existing = concurrent
+                    # El rollback deja el pk asignado en los bloques que alcanzaron a insertarse
+                    for intake, _, _, _ in new:
+                        intake.pk = None
+                        intake._state.adding = True
+
+            rollup = DailyAdherenceRollup()
+            for intake, patient_id, medication_id, tz_name in new:
+                rollup.add(patient_id, medication_id, intake.planned_at, tz_name, planned=1)
+            rollup.flush()
+        return len(new)
+
+    @staticmethod
+    def existing_slots(pending):
+        """(schedule_id, planned_at) del lote que ya existen"""
+        # Filtro acotado por el índice (schedule, planned_at); el par exacto se verifica en memoria
+        return set(Intake.objects.filter(
+            schedule_id__in={intake.schedule_id for intake, _, _, _ in pending},
+            planned_at__in={intake.planned_at for intake, _, _, _ in pending},
+        ).values_list('schedule_id', 'planned_at'))
+
+
+class IntakeEventIngestor:
+    """
+    Aplica lotes de eventos de toma enviados por los clientes (ej: un teléfono
+    que estuvo sin conexión). Cada evento identifica el intake por 'intake_id'
+    o por 'schedule_id' + 'planned_at' e indica 'status' y 'taken_at'.
+
+    - Los intakes del lote se resuelven con una sola consulta.
+    - Los permisos se verifican una vez contra el conjunto de pacientes del usuario.
+    - Es idempotente: si un intake aparece varias veces gana el último evento,
+      y los eventos que no cambian nada no se escriben.
+    - El estado se relee con select_for_update antes de escribir, así la
+      transición de DailyAdherence parte del estado real aunque el sweeper u
+      otro envío del mismo lote lo hayan cambiado entretanto.
+    - Los cambios se aplican con bulk_update por bloques.
+    """
+
+    EVENT_STATUSES = ('taken', 'missed', 'skipped')
+    UPDATE_FIELDS = ['status', 'taken_at', 'updated_by', 'updated_at']
+    DEFAULT_BATCH_SIZE = 500
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+
+    @staticmethod
+    def parse_timestamp(value):
+        """Fecha ISO 8601 como datetime aware (UTC si viene sin zona)"""
+        if not value:
+            return None
+        parsed = parse_datetime(str(value))
+        if parsed is None:
+            raise ValueError(value)
+        if timezone.is_naive(parsed):
+            parsed = parsed.replace(tzinfo=dt_timezone.utc)
+        return parsed
+
+    def parse_event(self, event):
+        """(clave del intake, status, taken_at) de un evento; ValueError si es inválido"""
+        if not isinstance(event, dict):
+            raise ValueError('Datos inválidos')
+
+        status = event.get('status')
+        if status not in self.EVENT_STATUSES:
+            raise ValueError('Estado no válido. Debe ser "taken", "missed" o "skipped"')
+
+        by_id = event.get('intake_id') is not None
+        if not by_id and (event.get('schedule_id') is None or not event.get('planned_at')):
+            raise ValueError('Se requiere intake_id o schedule_id y planned_at')
+
+        try:
+            taken_at = self.parse_timestamp(event.get('taken_at'))
+            if by_id:
+                key = ('id', int(event['intake_id']))
+            else:
+                key = ('planned', int(event['schedule_id']), self.parse_timestamp(event['planned_at']))
+        except (TypeError, ValueError):
+            raise ValueError('Datos inválidos')
+
+        if status == 'taken' and taken_at is None:
+            raise ValueError('taken_at es requerido para el estado "taken"')
+        # taken_at solo aplica a las tomas realizadas
+        return key, status, taken_at if status == 'taken' else None
+
+    def resolve_intakes(self, keys):
+        """
+        Intakes referenciados por el lote, en una sola consulta.
+        Retorna {clave: intake} con el paciente anotado como patient_id.
+        """
+        intake_ids = {key[1] for key in keys if key[0] == 'id'}
+        planned = [key for key in keys if key[0] == 'planned']
+
+        condition = Q(id__in=intake_ids) if intake_ids else Q()
+        if planned:
+            # Filtro acotado por el índice (schedule, planned_at); el par exacto se verifica en memoria
+            condition |= Q(
+                schedule_id__in={key[1] for key in planned},
+                planned_at__in={key[2] for key in planned},
+            )
+        if not condition:
+            return {}
+
+        intakes = Intake.objects.filter(condition).annotate(
+            patient_id=F('schedule__user_id'),
+            medication_id=F('schedule__medication_id'),
+            patient_tz=F('schedule__user__tz'),
+        ).only('id', 'schedule_id', 'planned_at', 'status', 'taken_at')
+
+        resolved = {}
+        for intake in intakes:
+            resolved[('id', intake.id)] = intake
+            resolved[('planned', intake.schedule_id, intake.planned_at)] = intake
+        return resolved
+
+    def ingest(self, user, events, permission_context=None):
+        """
+        Aplicar un lote de eventos en nombre de user.
+        Retorna un resultado por evento: {'index', 'success', 'intake_id', 'updated'} o
+        {'index', 'success': False, 'error'}.
+        """
+        from .permissions import PermissionContext
+
+        results = [None] * len(events)
+        parsed = []
+        for index, event in enumerate(events):
+            try:
+                parsed.append((index,) + self.parse_event(event))
+            except ValueError as e:
+                results[index] = {'index': index, 'success': False, 'error': str(e)}
+
+        intakes = self.resolve_intakes({key for _, key, _, _ in parsed})
+        patient_ids = (permission_context or PermissionContext(user)).patient_ids
+
+        # Último evento válido por intake; los anteriores quedan reemplazados
+        latest = {}
+        for index, key, status, taken_at in parsed:
+            intake = intakes.get(key)
+            if intake is None:
+                results[index] = {'index': index, 'success': False, 'error': 'Intake no encontrado'}
+                continue
+            if intake.patient_id not in patient_ids:
+                results[index] = {
+                    'index': index, 'success': False,
+                    'error': 'No tienes permisos para registrar tomas de este paciente'
+                }
+                continue
+            previous = latest.get(intake.id)
+            if previous is not None:
+                results[previous[0]] = {'index': previous[0], 'success': True, 'intake_id': intake.id, 'updated': False}
+            latest[intake.id] = (index, intake, status, taken_at)
+
+        # Los que no cambian según la lectura sin bloqueo ya están aplicados
+        candidates = []
+        for index, intake, status, taken_at in latest.values():
+            if intake.status != status or intake.taken_at != taken_at:
+                candidates.append((index, intake, status, taken_at))
+            else:
+                results[index] = {'index': index, 'success': True, 'intake_id': intake.id, 'updated': False}
+        if not candidates:
+            return results
+
+        rollup = DailyAdherenceRollup()
+        now = timezone.now()
+        with transaction.atomic():
+            # El estado vigente se relee con bloqueo: el sweeper u otro envío del mismo
+            # lote pudo cambiarlo después de resolve_intakes
+            current = self.lock_intakes([intake.id for _, intake, _, _ in candidates])
+            changed = []
+            for index, intake, status, taken_at in candidates:
+                if intake.id not in current:
+                    results[index] = {'index': index, 'success': False, 'error': 'Intake no encontrado'}
+                    continue
+                intake.status, intake.taken_at = current[intake.id]
+                updated = intake.status != status or intake.taken_at != taken_at
+                if updated:
+                    rollup.transition(
+                        intake.patient_id, intake.medication_id, intake.planned_at, intake.patient_tz,
+                        intake.status, status
+                    )
+                    intake.status = status
+                    intake.taken_at = taken_at
+                    intake.updated_by = user.pk
+                    intake.updated_at = now
+                    changed.append(intake)
+                results[index] = {'index': index, 'success': True, 'intake_id': intake.id, 'updated': updated}
+
+            if changed:
+                Intake.objects.bulk_update(changed, self.UPDATE_FIELDS, batch_size=self.batch_size)
+                rollup.flush()
+        return results
+
+    def lock_intakes(self, intake_ids):
+        """{id: (status, taken_at)} de los intakes, bloqueados hasta el fin de la transacción"""
+        current = {}
+        for start in range(0, len(intake_ids), self.batch_size):
+            rows = Intake.objects.select_for_update().filter(
+                id__in=intake_ids[start:start + self.batch_size]
+            ).values_list('id', 'status', 'taken_at')
+            current.update((intake_id, (status, taken_at)) for intake_id, status, taken_at in rows)
+        return current
+
+
+class MissedIntakeSweeper:
+    """
+    Marca como 'missed' los intakes 'planned' cuyo planned_at pasó hace más
+    de grace_minutes.
+
+    - Recorre el índice (status, planned_at) por bloques de batch_size y
+      actualiza cada bloque con un solo UPDATE (y su delta en DailyAdherence).
+    - Guarda en JobCheckpoint el corte de la última ejecución, así cada
+      ejecución solo revisa la franja de tiempo nueva.
+    - Puede ejecutarse en varios nodos a la vez: cada bloque se bloquea con
+      select_for_update(skip_locked=True) y los nodos no se pisan. Los intakes
+      saltados por estar bloqueados (otro nodo, una ingesta en curso) frenan el
+      checkpoint en el más antiguo, así la próxima ejecución los vuelve a revisar.
+    """
+
+    CHECKPOINT_NAME = 'missed_intake_sweeper'
+    DEFAULT_GRACE_MINUTES = 120
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self, grace_minutes=DEFAULT_GRACE_MINUTES, batch_size=DEFAULT_BATCH_SIZE):
+        self.grace = timedelta(minutes=grace_minutes)
+        self.batch_size = batch_size
+
+    def get_checkpoint(self):
+        checkpoint, _ = JobCheckpoint.objects.get_or_create(name=self.CHECKPOINT_NAME)
+        return checkpoint.position
+
+    def save_checkpoint(self, position):
+        """Avanzar el checkpoint sin retroceder el de otro nodo que haya llegado más lejos"""
+        JobCheckpoint.objects.filter(name=self.CHECKPOINT_NAME).filter(
+            Q(position__isnull=True) | Q(position__lt=position)
+        ).update(position=position, updated_at=timezone.now())
+
+    def overdue(self, since, cutoff):
+        """Intakes 'planned' de la franja [since, cutoff)"""
+        overdue = Intake.objects.filter(status='planned', planned_at__lt=cutoff)
+        if since is not None:
+            overdue = overdue.filter(planned_at__gte=since)
+        return overdue
+
+    def sweep_batch(self, since, cutoff, now):
+        """Marcar un bloque de intakes vencidos; retorna los ids actualizados"""
+        with transaction.atomic():
+            rows = list(
+                self.overdue(since, cutoff).select_for_update(skip_locked=True, of=('self',))
+                .order_by('planned_at')
+                .values_list('id', 'planned_at', 'schedule__user_id', 'schedule__medication_id',
+                             'schedule__user__tz')[:self.batch_size]
+            )
+            intake_ids = [row[0] for row in rows]
+            if intake_ids:
+                Intake.objects.filter(id__in=intake_ids, status='planned').update(
+                    status='missed', updated_at=now
+                )
+                rollup = DailyAdherenceRollup()
+                for _, planned_at, patient_id, medication_id, tz_name in rows:
+                    rollup.add(patient_id, medication_id, planned_at, tz_name, missed=1)
+                rollup.flush()
+        return intake_ids
+
+    def sweep(self, now=None, full=False):
+        """
+        Barrer la franja [checkpoint, now - grace) o todo lo anterior al corte si full=True.
+        Retorna estadísticas de la ejecución.
+        """
+        now = now or timezone.now()
+        cutoff = now - self.grace
+        since = None if full else self.get_checkpoint()
+        stats = {'batches': 0, 'intakes_missed': 0, 'since': since, 'cutoff': cutoff}
+
+        if since is not None and since >= cutoff:
+            return stats
+
+        while True:
+            intake_ids = self.sweep_batch(since, cutoff, now)
+            if not intake_ids:
+                break
+            stats['batches'] += 1
+            stats['intakes_missed'] += len(intake_ids)
+            if len(intake_ids) < self.batch_size:
+                break
+
+        # Los que siguen 'planned' fueron saltados por skip_locked: el checkpoint no los pasa
+        skipped = self.overdue(since, cutoff).order_by('planned_at').values_list('planned_at', flat=True).first()
+        stats['checkpoint'] = skipped or cutoff
+        self.save_checkpoint(stats['checkpoint'])
+        return stats
@@ -0,0 +1,56 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from api.reminders import FileReminderSender, LogReminderSender, ReminderDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Dispara los recordatorios de los Intakes planificados a su hora (queda corriendo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lookahead-minutes', type=int, default=ReminderDispatcher.DEFAULT_LOOKAHEAD_MINUTES,
+            help='Minutos hacia adelante que se mantienen cargados en memoria'
+        )
+        parser.add_argument(
+            '--refill-seconds', type=int, default=ReminderDispatcher.DEFAULT_REFILL_SECONDS,
+            help='Segundos entre recargas de la franja nueva'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=ReminderDispatcher.DEFAULT_BATCH_SIZE,
+            help='Tamaño de lote para lectura'
+        )
+        parser.add_argument(
+            '--output',
+            help='Archivo donde escribir los recordatorios como JSON por línea; por defecto se registran en el log'
+        )
+        parser.add_argument(
+            '--duration', type=int, default=0,
+            help='Segundos a ejecutar; 0 corre indefinidamente'
+        )
+
+    def handle(self, *args, **options):
+        if options['output']:
+            sender = FileReminderSender(options['output'])
+        else:
+            logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+            sender = LogReminderSender()
+
+        dispatcher = ReminderDispatcher(
+            sender,
+            lookahead_minutes=options['lookahead_minutes'],
+            refill_seconds=options['refill_seconds'],
+            batch_size=options['batch_size'],
+        )
+        try:
+            dispatcher.run(duration=options['duration'] or None)
+        except KeyboardInterrupt:
+            pass
+
+        stats = dispatcher.stats
+        self.stdout.write(self.style.SUCCESS(
+            f"Recordatorios enviados: {stats['sent']}, descartados: {stats['discarded']}, "
+            f"fallidos: {stats['failed']}, "
+            f"cargados: {stats['loaded']} en {stats['refills']} recargas"
+        ))
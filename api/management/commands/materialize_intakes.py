@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from api.intakes import IntakeMaterializer
+
+
+class Command(BaseCommand):
+    help = 'Genera los Intakes planificados de los schedules activos para un horizonte móvil'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--horizon-days', type=int, default=IntakeMaterializer.DEFAULT_HORIZON_DAYS,
+            help='Días hacia adelante a materializar'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IntakeMaterializer.DEFAULT_BATCH_SIZE,
+            help='Tamaño de lote para lectura e inserción'
+        )
+
+    def handle(self, *args, **options):
+        materializer = IntakeMaterializer(
+            horizon_days=options['horizon_days'],
+            batch_size=options['batch_size'],
+        )
+        stats = materializer.materialize()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Schedules procesados: {stats['schedules_processed']}, "
+            f"intakes creados: {stats['intakes_created']}, "
+            f"patrones inválidos: {stats['invalid_patterns']}"
+        ))
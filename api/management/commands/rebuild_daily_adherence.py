@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.adherence import DailyAdherenceRollup
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el resumen DailyAdherence desde los Intakes (backfills o correcciones)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Primera fecha local a recalcular (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Fecha local final, exclusiva (YYYY-MM-DD)')
+        parser.add_argument(
+            '--patient', type=int, action='append', dest='patient_ids',
+            help='ID de paciente a recalcular (se puede repetir); por defecto todos'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tamaño de lote para inserción')
+
+    def parse_option(self, options, name):
+        if not options[name]:
+            return None
+        value = parse_date(options[name])
+        if value is None:
+            raise CommandError(f'Fecha inválida para --{name}: {options[name]}')
+        return value
+
+    def handle(self, *args, **options):
+        rows = DailyAdherenceRollup.rebuild(
+            patient_ids=options['patient_ids'],
+            since=self.parse_option(options, 'since'),
+            until=self.parse_option(options, 'until'),
+            batch_size=options['batch_size'],
+        )
+
+        self.stdout.write(self.style.SUCCESS(f'Filas de DailyAdherence escritas: {rows}'))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.intakes import MissedIntakeSweeper
+
+
+class Command(BaseCommand):
+    help = 'Marca como perdidos (missed) los Intakes planificados que vencieron'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-minutes', type=int, default=MissedIntakeSweeper.DEFAULT_GRACE_MINUTES,
+            help='Minutos después de planned_at antes de marcar un intake como perdido'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=MissedIntakeSweeper.DEFAULT_BATCH_SIZE,
+            help='Intakes actualizados por bloque'
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Ignorar el checkpoint y revisar todo lo anterior al corte'
+        )
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Segundos entre ejecuciones; si es mayor que 0 el comando queda corriendo'
+        )
+
+    def handle(self, *args, **options):
+        sweeper = MissedIntakeSweeper(
+            grace_minutes=options['grace_minutes'],
+            batch_size=options['batch_size'],
+        )
+        full = options['full']
+
+        while True:
+            stats = sweeper.sweep(full=full)
+            self.stdout.write(self.style.SUCCESS(
+                f"Intakes marcados como perdidos: {stats['intakes_missed']} "
+                f"en {stats['batches']} bloques (corte: {stats['cutoff'].isoformat()})"
+            ))
+            if options['interval'] <= 0:
+                break
+            full = False
+            time.sleep(options['interval'])
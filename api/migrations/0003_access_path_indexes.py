@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_user_managers_remove_user_password_hash_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctorpatientrelation',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['patient', 'doctor'], name='doctor_rel_active_patient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='familypatientrelation',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['patient', 'family_member'], name='family_rel_active_patient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='intake',
+            index=models.Index(fields=['schedule', 'planned_at'], name='intake_schedule_planned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['user', 'created_at'], name='schedule_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['user', 'medication', 'start_date'], name='schedule_user_med_start_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_by', models.IntegerField(blank=True, null=True)),
+                ('updated_by', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('position', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'JobCheckpoints',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='intake',
+            index=models.Index(fields=['status', 'planned_at'], name='intake_status_planned_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_intake_sweeper'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='intake',
+            name='intake_schedule_planned_idx',
+        ),
+        migrations.AddIndex(
+            model_name='intake',
+            index=models.Index(fields=['schedule', 'planned_at', 'status'], name='intake_sched_plan_status_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_adherence_covering_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAdherence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_by', models.IntegerField(blank=True, null=True)),
+                ('updated_by', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('date', models.DateField()),
+                ('planned', models.IntegerField(default=0)),
+                ('taken', models.IntegerField(default=0)),
+                ('missed', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('medication', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.medication')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_adherence', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'DailyAdherence',
+                'indexes': [models.Index(fields=['patient', 'date'], name='daily_adherence_patient_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'medication', 'date'), name='daily_adherence_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:32
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def rename_duplicate_names(apps, schema_editor):
+    """
+    Nombres repetidos sin distinguir mayúsculas impedirían crear el índice único.
+    Se conserva el más antiguo y los demás reciben el sufijo ' (<id>)';
+    sus schedules no cambian.
+    """
+    Medication = apps.get_model('api', 'Medication')
+    seen = set()
+    for medication in Medication.objects.annotate(name_lower=Lower('name')).order_by('name_lower', 'id'):
+        if medication.name_lower in seen:
+            suffix = f' ({medication.id})'
+            medication.name = medication.name[:150 - len(suffix)] + suffix
+            medication.save(update_fields=['name'])
+        else:
+            seen.add(medication.name_lower)
+
+
+def create_trigram_index(apps, schema_editor):
+    # Solo PostgreSQL; en SQLite la similitud se resuelve con el índice en memoria (api.search)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS medication_name_trgm_idx '
+        'ON "Medications" USING gin (LOWER(name) gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS medication_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_daily_adherence'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_names, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='medication',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='medication_name_ci_unique'),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
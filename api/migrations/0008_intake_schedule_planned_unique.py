@@ -0,0 +1,68 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:45
+
+from collections import Counter
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def local_date(planned_at, tz_name):
+    try:
+        tz = ZoneInfo(tz_name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        tz = ZoneInfo('UTC')
+    return planned_at.astimezone(tz).date()
+
+
+def remove_duplicate_intakes(apps, schema_editor):
+    """
+    Ejecuciones simultáneas del materializador pudieron insertar el mismo
+    (schedule, planned_at) más de una vez. Por ocurrencia se conserva el intake
+    ya registrado (taken/missed/skipped) o el más antiguo, y se descuentan los
+    borrados de DailyAdherence.
+    """
+    Intake = apps.get_model('api', 'Intake')
+    DailyAdherence = apps.get_model('api', 'DailyAdherence')
+
+    duplicated = Intake.objects.values('schedule_id', 'planned_at').annotate(
+        total=Count('id')
+    ).filter(total__gt=1)
+
+    deltas = Counter()
+    for occurrence in duplicated.iterator():
+        rows = list(
+            Intake.objects.filter(schedule_id=occurrence['schedule_id'], planned_at=occurrence['planned_at'])
+            .order_by('id')
+            .values_list('id', 'status', 'schedule__user_id', 'schedule__medication_id', 'schedule__user__tz')
+        )
+        registered = [row for row in rows if row[1] != 'planned']
+        keep = (registered or rows)[0]
+        removed = [row for row in rows if row is not keep]
+
+        Intake.objects.filter(id__in=[row[0] for row in removed]).delete()
+        for _, status, patient_id, medication_id, tz_name in removed:
+            day = local_date(occurrence['planned_at'], tz_name)
+            deltas[(patient_id, medication_id, day, 'planned')] += 1
+            if status != 'planned':
+                deltas[(patient_id, medication_id, day, status)] += 1
+
+    for (patient_id, medication_id, day, counter), amount in deltas.items():
+        DailyAdherence.objects.filter(patient_id=patient_id, medication_id=medication_id, date=day).update(
+            **{counter: F(counter) - amount}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_medication_name_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_intakes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='intake',
+            constraint=models.UniqueConstraint(fields=('schedule', 'planned_at'), name='intake_schedule_planned_unique'),
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.utils import timezone
 from django.db import models
+from django.db.models.functions import Lower
 from api.managers import UserManager
 from config import settings as setting
 
@@ -212,12 +213,44 @@ class User(BaseModel, AbstractBaseUser, PermissionsMixin):
         if self.user_type != 'patient':
             raise PermissionError("Solo los pacientes pueden ver sus cuidadores")
         
-        family_relations = FamilyPatientRelation.objects.filter(patient=self)
-        doctor_relations = DoctorPatientRelation.objects.filter(patient=self)
+        relations = self.get_caregiver_relations()
         
         return {
-            'family_members': [rel.family_member for rel in family_relations],
-            'doctors': [rel.doctor for rel in doctor_relations]
+            'family_members': [rel.family_member for rel in relations['family_relations']],
+            'doctors': [rel.doctor for rel in relations['doctor_relations']]
+        }
+    
+    def get_caregiver_relations(self):
+        """
+        Solo para pacientes: carga el grafo de cuidadores en dos consultas.
+        Retorna las relaciones con el usuario cuidador ya cargado (select_related).
+        """
+        if self.user_type != 'patient':
+            raise PermissionError("Solo los pacientes pueden ver sus cuidadores")
+        
+        return {
+            'family_relations': list(
+                FamilyPatientRelation.objects.filter(patient=self).select_related('family_member')
+            ),
+            'doctor_relations': list(
+                DoctorPatientRelation.objects.filter(patient=self).select_related('doctor')
+            ),
+        }
+
+    async def aget_caregiver_relations(self):
+        """Versión asíncrona de get_caregiver_relations"""
+        if self.user_type != 'patient':
+            raise PermissionError("Solo los pacientes pueden ver sus cuidadores")
+        
+        return {
+            'family_relations': [
+                relation async for relation in
+                FamilyPatientRelation.objects.filter(patient=self).select_related('family_member')
+            ],
+            'doctor_relations': [
+                relation async for relation in
+                DoctorPatientRelation.objects.filter(patient=self).select_related('doctor')
+            ],
         }
     
     def get_my_schedules(self):
@@ -229,14 +262,40 @@ class User(BaseModel, AbstractBaseUser, PermissionsMixin):
     
     def get_my_patients(self):
         """Para doctores y familiares: obtiene su lista de pacientes"""
+        return [rel.patient for rel in self.get_patient_relations()]
+    
+    def get_patient_relations(self):
+        """
+        Para doctores y familiares: relaciones con sus pacientes en una sola consulta
+        (el paciente se carga con select_related)
+        """
+        if self.user_type == 'doctor':
+            return list(DoctorPatientRelation.objects.filter(doctor=self).select_related('patient'))
+        elif self.user_type == 'family':
+            return list(FamilyPatientRelation.objects.filter(family_member=self).select_related('patient'))
+        else:
+            raise PermissionError("Solo doctores y familiares pueden ver pacientes")
+    
+    async def aget_patient_relations(self):
+        """Versión asíncrona de get_patient_relations"""
         if self.user_type == 'doctor':
             relations = DoctorPatientRelation.objects.filter(doctor=self)
-            return [rel.patient for rel in relations]
         elif self.user_type == 'family':
             relations = FamilyPatientRelation.objects.filter(family_member=self)
-            return [rel.patient for rel in relations]
         else:
             raise PermissionError("Solo doctores y familiares pueden ver pacientes")
+        return [relation async for relation in relations.select_related('patient')]
+    
+    def get_my_patients_queryset(self):
+        """Para doctores y familiares: queryset de sus pacientes (para anotar y prefetch)"""
+        if self.user_type == 'doctor':
+            patient_ids = DoctorPatientRelation.objects.filter(doctor=self).values('patient_id')
+        elif self.user_type == 'family':
+            patient_ids = FamilyPatientRelation.objects.filter(family_member=self).values('patient_id')
+        else:
+            raise PermissionError("Solo doctores y familiares pueden ver pacientes")
+        
+        return User.objects.filter(id__in=patient_ids).order_by('id')
     
     def get_patient_schedules(self, patient_id):
         """Para doctores y familiares: obtiene las programaciones de un paciente"""
@@ -288,6 +347,19 @@ class UserCreationService:
         """Permite registrar nuevos tipos de factory dinámicamente"""
         cls._factories[user_type] = factory
     
+    @staticmethod
+    def _get_user(user):
+        """Reutilizar la instancia de User si ya está cargada; si no, consultarla por id"""
+        if isinstance(user, User):
+            return user
+        return User.objects.get(id=user)
+    
+    @staticmethod
+    def _invalidate_access(*caregiver_ids):
+        """Descartar los conjuntos de acceso cacheados de los cuidadores"""
+        from .access_cache import access_cache
+        access_cache.invalidate(*caregiver_ids)
+    
     @classmethod
     def assign_family_to_patient(cls, family_user_id, patient_user_id, 
                                 relationship_type, can_manage_medications=False, 
@@ -298,10 +370,12 @@ class UserCreationService:
             patient_user = User.objects.get(id=patient_user_id, user_type='patient')
             
             family_factory = cls._factories['family']
-            return family_factory.assign_to_patient(
+            relation = family_factory.assign_to_patient(
                 family_user, patient_user, relationship_type,
                 can_manage_medications, emergency_contact
             )
+            cls._invalidate_access(family_user.id)
+            return relation
         except User.DoesNotExist as e:
             raise ValueError(f"Usuario no encontrado: {e}")
     
@@ -314,17 +388,19 @@ class UserCreationService:
             patient_user = User.objects.get(id=patient_user_id, user_type='patient')
             
             doctor_factory = cls._factories['doctor']
-            return doctor_factory.assign_to_patient(
+            relation = doctor_factory.assign_to_patient(
                 doctor_user, patient_user, specialty, notes
             )
+            cls._invalidate_access(doctor_user.id)
+            return relation
         except User.DoesNotExist as e:
             raise ValueError(f"Usuario no encontrado: {e}")
     
     @classmethod
     def get_user_permissions(cls, user_id):
-        """Obtener los permisos y capacidades de un usuario"""
+        """Obtener los permisos y capacidades de un usuario (instancia o id)"""
         try:
-            user = User.objects.get(id=user_id)
+            user = cls._get_user(user_id)
             
             permissions = {
                 'user_type': user.user_type,
@@ -378,6 +454,7 @@ class UserCreationService:
             }
             
             relation.delete()
+            cls._invalidate_access(family_user_id)
             return relation_info
             
         except FamilyPatientRelation.DoesNotExist:
@@ -407,11 +484,217 @@ class UserCreationService:
             }
             
             relation.delete()
+            cls._invalidate_access(doctor_user_id)
             return relation_info
             
         except DoctorPatientRelation.DoesNotExist:
             raise ValueError("No se encontró la relación doctor-paciente especificada")
     
+    BULK_RELATION_BATCH_SIZE = 500
+    
+    @classmethod
+    def _caregiver_relation(cls, caregiver_type):
+        """Modelo de relación y campo del cuidador para el tipo dado"""
+        if caregiver_type == 'family':
+            return FamilyPatientRelation, 'family_member_id'
+        if caregiver_type == 'doctor':
+            return DoctorPatientRelation, 'doctor_id'
+        raise ValueError('Tipo de cuidador no válido. Debe ser "family" o "doctor"')
+    
+    @classmethod
+    def _validate_relation_pairs(cls, caregiver_type, items):
+        """
+        Validar por conjuntos los pares (caregiver_id, patient_id) de un lote.
+        Una sola consulta trae el tipo de todos los usuarios involucrados.
+        Retorna (resultados con los errores ya marcados, [(index, item, caregiver_id, patient_id)]).
+        """
+        results = [None] * len(items)
+        pairs = []
+        for index, item in enumerate(items):
+            try:
+                caregiver_id = int(item['caregiver_id'])
+                patient_id = int(item['patient_id'])
+            except (KeyError, TypeError, ValueError):
+                results[index] = {
+                    'index': index, 'success': False,
+                    'error': 'Los campos caregiver_id y patient_id son requeridos'
+                }
+                continue
+            pairs.append((index, item, caregiver_id, patient_id))
+        
+        user_ids = {pair[2] for pair in pairs} | {pair[3] for pair in pairs}
+        user_types = dict(
+            User.objects.filter(id__in=user_ids).values_list('id', 'user_type')
+        ) if user_ids else {}
+        
+        valid = []
+        for index, item, caregiver_id, patient_id in pairs:
+            error = None
+            if caregiver_id not in user_types:
+                error = f"Usuario no encontrado: {caregiver_id}"
+            elif patient_id not in user_types:
+                error = f"Usuario no encontrado: {patient_id}"
+            elif user_types[caregiver_id] != caregiver_type:
+                error = f"El usuario debe ser de tipo '{caregiver_type}'"
+            elif user_types[patient_id] != 'patient':
+                error = "El paciente debe ser de tipo 'patient'"
+            if error:
+                results[index] = {'index': index, 'success': False, 'error': error}
+            else:
+                valid.append((index, item, caregiver_id, patient_id))
+        return results, valid
+    
+    @classmethod
+    def _existing_relations(cls, model, caregiver_field, pairs):
+        """{(caregiver_id, patient_id): relation_id} de los pares que ya existen"""
+        if not pairs:
+            return {}
+        rows = model.objects.filter(**{
+            f'{caregiver_field}__in': {pair[2] for pair in pairs},
+            'patient_id__in': {pair[3] for pair in pairs},
+        }).values_list(caregiver_field, 'patient_id', 'id')
+        return {(caregiver_id, patient_id): relation_id for caregiver_id, patient_id, relation_id in rows}
+    
+    @classmethod
+    def assign_caregivers_bulk(cls, caregiver_type, assignments, batch_size=None):
+        """
+        Asignar varios pares cuidador-paciente del mismo tipo en pocas consultas:
+        tipos de usuario validados con una consulta, un bulk_create y una
+        invalidación del cache de acceso.
+        Los pares ya existentes no se modifican (igual que get_or_create). Si otro
+        request inserta alguno de los pares entre la lectura y el insert, el lote se
+        reintenta sin ellos y se reportan como ya existentes.
+        Retorna un resultado por ítem: {'index', 'success', 'created' | 'error'}.
+        """
+        from django.db import IntegrityError, transaction
+        
+        model, caregiver_field = cls._caregiver_relation(caregiver_type)
+        results, pairs = cls._validate_relation_pairs(caregiver_type, assignments)
+        existing = cls._existing_relations(model, caregiver_field, pairs)
+        
+        relations = []
+        for index, item, caregiver_id, patient_id in pairs:
+            key = (caregiver_id, patient_id)
+            if key in existing:
+                results[index] = {'index': index, 'success': True, 'created': False}
+                continue
+            if caregiver_type == 'family':
+                relationship_type = item.get('relationship_type')
+                if relationship_type not in dict(FamilyPatientRelation.RELATIONSHIP_CHOICES):
+                    results[index] = {'index': index, 'success': False, 'error': 'Tipo de relación no válido'}
+                    continue
+                relation = FamilyPatientRelation(
+                    family_member_id=caregiver_id,
+                    patient_id=patient_id,
+                    relationship_type=relationship_type,
+                    can_manage_medications=bool(item.get('can_manage_medications', False)),
+                    emergency_contact=bool(item.get('emergency_contact', False)),
+                )
+            else:
+                relation = DoctorPatientRelation(
+                    doctor_id=caregiver_id,
+                    patient_id=patient_id,
+                    specialty=item.get('specialty') or '',
+                    notes=item.get('notes') or '',
+                )
+            # Pares repetidos dentro del lote se insertan una sola vez
+            existing[key] = None
+            relations.append((index, item, caregiver_id, patient_id, relation))
+            results[index] = {'index': index, 'success': True, 'created': True}
+        
+        inserted = []
+        while relations:
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create(
+                        [pair[4] for pair in relations],
+                        batch_size=batch_size or cls.BULK_RELATION_BATCH_SIZE
+                    )
+                inserted = relations
+                break
+            except IntegrityError:
+                concurrent = cls._existing_relations(model, caregiver_field, relations)
+                if not concurrent:
+                    raise
+                remaining = []
+                for index, item, caregiver_id, patient_id, relation in relations:
+                    if (caregiver_id, patient_id) in concurrent:
+                        results[index] = {'index': index, 'success': True, 'created': False}
+                        continue
+                    # El rollback deja el pk asignado en los lotes que alcanzaron a insertarse
+                    relation.pk = None
+                    relation._state.adding = True
+                    remaining.append((index, item, caregiver_id, patient_id, relation))
+                relations = remaining
+        
+        if inserted:
+            # bulk_create no emite post_save
+            cls._invalidate_access(*{caregiver_id for _, _, caregiver_id, _, _ in inserted})
+        return results
+    
+    @classmethod
+    def remove_caregivers_bulk(cls, caregiver_type, relations, batch_size=None):
+        """
+        Remover varios pares cuidador-paciente del mismo tipo con deletes por bloques.
+        Igual que remove_doctor_from_patient, no se remueve al único doctor de un paciente:
+        los doctores restantes se calculan con una consulta agrupada para todo el lote.
+        Retorna un resultado por ítem: {'index', 'success' | 'error'}.
+        """
+        from django.db import transaction
+        from django.db.models import Count
+        
+        model, caregiver_field = cls._caregiver_relation(caregiver_type)
+        results = [None] * len(relations)
+        pairs = []
+        for index, item in enumerate(relations):
+            try:
+                pairs.append((index, item, int(item['caregiver_id']), int(item['patient_id'])))
+            except (KeyError, TypeError, ValueError):
+                results[index] = {
+                    'index': index, 'success': False,
+                    'error': 'Los campos caregiver_id y patient_id son requeridos'
+                }
+        
+        existing = cls._existing_relations(model, caregiver_field, pairs)
+        remaining = {}
+        if caregiver_type == 'doctor' and existing:
+            remaining = dict(
+                DoctorPatientRelation.objects.filter(
+                    patient_id__in={patient_id for _, patient_id in existing}
+                ).values('patient_id').annotate(total=Count('id')).values_list('patient_id', 'total')
+            )
+        
+        relation_ids = []
+        for index, item, caregiver_id, patient_id in pairs:
+            relation_id = existing.pop((caregiver_id, patient_id), None)
+            if relation_id is None:
+                results[index] = {
+                    'index': index, 'success': False,
+                    'error': 'No se encontró la relación especificada'
+                }
+                continue
+            if caregiver_type == 'doctor':
+                if remaining[patient_id] <= 1:
+                    # Se devuelve la relación para que el error se reporte también en repetidos
+                    existing[(caregiver_id, patient_id)] = relation_id
+                    results[index] = {
+                        'index': index, 'success': False,
+                        'error': 'No se puede remover al único doctor asignado al paciente'
+                    }
+                    continue
+                remaining[patient_id] -= 1
+            relation_ids.append((caregiver_id, relation_id))
+            results[index] = {'index': index, 'success': True}
+        
+        if relation_ids:
+            size = batch_size or cls.BULK_RELATION_BATCH_SIZE
+            with transaction.atomic():
+                for start in range(0, len(relation_ids), size):
+                    chunk = [relation_id for _, relation_id in relation_ids[start:start + size]]
+                    model.objects.filter(id__in=chunk).delete()
+            cls._invalidate_access(*{caregiver_id for caregiver_id, _ in relation_ids})
+        return results
+    
     @classmethod
     def get_patient_relations(cls, patient_id):
         """Obtener todas las relaciones de un paciente"""
@@ -441,8 +724,9 @@ class UserCreationService:
             medication = Medication.objects.get(id=medication_id)
             
             # Verificar permisos del usuario que crea el schedule
+            creator = None
             if created_by_user_id:
-                creator = User.objects.get(id=created_by_user_id)
+                creator = cls._get_user(created_by_user_id)
                 if not creator.can_manage_schedules(user_id):
                     raise ValueError("No tienes permisos para crear schedules para este paciente")
 
@@ -456,7 +740,7 @@ class UserCreationService:
                 end_date=end_date,
                 pattern=pattern,
                 dose_amount=dose_amount,
-                created_by=created_by_user_id
+                created_by=creator.pk if creator else None
             )
             
             return schedule
@@ -466,29 +750,151 @@ class UserCreationService:
         except Medication.DoesNotExist:
             raise ValueError("Medicamento no encontrado")
     
+    BULK_SCHEDULE_FIELDS = ('medication_id', 'start_date', 'pattern', 'dose_amount')
+    
+    @classmethod
+    def create_schedules_bulk(cls, user_id, schedules, created_by_user_id=None, permission_context=None):
+        """
+        Crear varios schedules para un paciente con validación por conjuntos:
+        medicamentos con in_bulk, una sola consulta de duplicados sobre
+        (medication_id, start_date) y un bulk_create en una transacción.
+        Los permisos del creador se verifican con permission_context si es el suyo
+        (ej: el del request), sin volver a cargar sus relaciones.
+        Retorna un resultado por ítem: {'index', 'success', 'schedule' | 'error'}.
+        """
+        from django.db import transaction
+        from django.utils.dateparse import parse_date
+        
+        try:
+            patient = User.objects.get(id=user_id, user_type='patient')
+            creator = None
+            if created_by_user_id:
+                creator = cls._get_user(created_by_user_id)
+        except (User.DoesNotExist, ValueError, TypeError):
+            raise ValueError("Usuario no encontrado")
+        
+        # Una sola verificación de permisos para todo el lote
+        if creator is not None:
+            from .permissions import PermissionContext
+            if not isinstance(permission_context, PermissionContext) or permission_context.user.pk != creator.pk:
+                permission_context = PermissionContext(creator)
+            if not permission_context.can_manage_schedules(patient.id):
+                raise ValueError("No tienes permisos para crear schedules para este paciente")
+        
+        results = [None] * len(schedules)
+        candidates = []
+        for index, item in enumerate(schedules):
+            missing = [field for field in cls.BULK_SCHEDULE_FIELDS if not isinstance(item, dict) or field not in item]
+            if missing:
+                results[index] = {'index': index, 'success': False, 'error': f'Campo {missing[0]} es requerido'}
+                continue
+            try:
+                start_date = parse_date(str(item['start_date']))
+                end_date = parse_date(str(item['end_date'])) if item.get('end_date') else None
+                medication_id = int(item['medication_id'])
+            except (TypeError, ValueError):
+                start_date = None
+            if start_date is None or (item.get('end_date') and end_date is None):
+                results[index] = {'index': index, 'success': False, 'error': 'Datos inválidos'}
+                continue
+            candidates.append((index, item, medication_id, start_date, end_date))
+        
+        medications = Medication.objects.in_bulk({candidate[2] for candidate in candidates})
+        
+        # Duplicados existentes: una consulta acotada por el índice (user, medication, start_date)
+        existing = set()
+        if candidates:
+            existing = set(Schedule.objects.filter(
+                user=patient,
+                medication_id__in={candidate[2] for candidate in candidates},
+                start_date__in={candidate[3] for candidate in candidates},
+            ).values_list('medication_id', 'start_date'))
+        
+        new_schedules = []
+        for index, item, medication_id, start_date, end_date in candidates:
+            if medication_id not in medications:
+                results[index] = {'index': index, 'success': False, 'error': 'Medicamento no encontrado'}
+                continue
+            key = (medication_id, start_date)
+            if key in existing:
+                results[index] = {
+                    'index': index, 'success': False,
+                    'error': 'Ya existe un schedule para este paciente y medicamento en la misma fecha'
+                }
+                continue
+            # También evita duplicados dentro del mismo lote
+            existing.add(key)
+            schedule = Schedule(
+                user=patient,
+                medication=medications[medication_id],
+                start_date=start_date,
+                end_date=end_date,
+                pattern=item['pattern'],
+                dose_amount=item['dose_amount'],
+                created_by=creator.pk if creator else None
+            )
+            new_schedules.append((index, schedule))
+        
+        with transaction.atomic():
+            Schedule.objects.bulk_create([schedule for _, schedule in new_schedules])
+        
+        for index, schedule in new_schedules:
+            results[index] = {'index': index, 'success': True, 'schedule': schedule}
+        return results
+    
+    # Campos que cambian qué intakes genera un schedule
+    SCHEDULE_DEFINITION_FIELDS = ('start_date', 'end_date', 'pattern', 'medication_id')
+    
     @classmethod
     def update_schedule(cls, schedule_id, user_id, **update_fields):
-        """Actualizar un schedule existente"""
+        """
+        Actualizar un schedule existente.
+        Si cambia su definición (fechas, patrón o medicamento), los intakes futuros
+        aún 'planned' se borran (y se descuentan de DailyAdherence) y se vuelven a
+        materializar con la definición nueva, en la misma transacción.
+        """
+        from django.db import transaction
+        from .adherence import DailyAdherenceRollup
+        from .intakes import IntakeMaterializer
+        
         try:
-            schedule = Schedule.objects.get(id=schedule_id)
-            user = User.objects.get(id=user_id)
-            
-            # Verificar permisos
-            if not user.can_manage_schedules(schedule.user.id):
-                raise ValueError("No tienes permisos para modificar este schedule")
-            
-            # Actualizar campos permitidos
-            allowed_fields = ['start_date', 'end_date', 'pattern', 'dose_amount', 'medication_id']
-            for field, value in update_fields.items():
-                if field in allowed_fields:
-                    if field == 'medication_id':
-                        medication = Medication.objects.get(id=value)
-                        schedule.medication = medication
-                    else:
-                        setattr(schedule, field, value)
-            
-            schedule.updated_by = user_id
-            schedule.save()
+            with transaction.atomic():
+                schedule = Schedule.objects.select_for_update(of=('self',)).select_related('user').get(id=schedule_id)
+                user = cls._get_user(user_id)
+                
+                # Verificar permisos
+                if not user.can_manage_schedules(schedule.user.id):
+                    raise ValueError("No tienes permisos para modificar este schedule")
+                
+                # Actualizar campos permitidos
+                allowed_fields = ['start_date', 'end_date', 'pattern', 'dose_amount', 'medication_id']
+                previous = {field: getattr(schedule, field) for field in cls.SCHEDULE_DEFINITION_FIELDS}
+                for field, value in update_fields.items():
+                    if field in allowed_fields:
+                        if field == 'medication_id':
+                            medication = Medication.objects.get(id=value)
+                            schedule.medication = medication
+                        else:
+                            setattr(schedule, field, value)
+                redefined = any(
+                    getattr(schedule, field) != previous[field] for field in cls.SCHEDULE_DEFINITION_FIELDS
+                )
+                
+                now = timezone.now()
+                stale = Intake.objects.filter(schedule=schedule, status='planned', planned_at__gte=now)
+                rollup = DailyAdherenceRollup()
+                if redefined:
+                    # Se descuentan con el medicamento anterior, antes de guardar
+                    rollup.subtract(stale, schedule.user.tz)
+                
+                schedule.updated_by = user.pk
+                schedule.save()
+                
+                if redefined:
+                    stale.delete()
+                    rollup.flush()
+                    # Sin intakes futuros el materializador vuelve a generar desde now
+                    IntakeMaterializer().materialize(Schedule.objects.filter(id=schedule.id), now=now)
             
             return schedule
             
@@ -501,24 +907,37 @@ class UserCreationService:
     
     @classmethod
     def delete_schedule(cls, schedule_id, user_id):
-        """Eliminar un schedule"""
+        """
+        Eliminar un schedule.
+        Sus intakes se borran en cascada: antes se descuentan de DailyAdherence
+        en la misma transacción.
+        """
+        from django.db import transaction
+        from .adherence import DailyAdherenceRollup
+        
         try:
-            schedule = Schedule.objects.get(id=schedule_id)
-            user = User.objects.get(id=user_id)
-            
-            # Verificar permisos
-            if not user.can_manage_schedules(schedule.user.id):
-                raise ValueError("No tienes permisos para eliminar este schedule")
-            
-            schedule_info = {
-                'id': str(schedule.id),
-                'patient_name': schedule.user.name,
-                'medication_name': schedule.medication.name,
-                'dose_amount': schedule.dose_amount,
-                'pattern': schedule.pattern
-            }
-            
-            schedule.delete()
+            with transaction.atomic():
+                schedule = Schedule.objects.select_for_update(of=('self',)).select_related(
+                    'user', 'medication'
+                ).get(id=schedule_id)
+                user = cls._get_user(user_id)
+                
+                # Verificar permisos
+                if not user.can_manage_schedules(schedule.user.id):
+                    raise ValueError("No tienes permisos para eliminar este schedule")
+                
+                schedule_info = {
+                    'id': str(schedule.id),
+                    'patient_name': schedule.user.name,
+                    'medication_name': schedule.medication.name,
+                    'dose_amount': schedule.dose_amount,
+                    'pattern': schedule.pattern
+                }
+                
+                rollup = DailyAdherenceRollup()
+                rollup.subtract(Intake.objects.filter(schedule=schedule), schedule.user.tz)
+                schedule.delete()
+                rollup.flush()
             return schedule_info
             
         except Schedule.DoesNotExist:
@@ -531,7 +950,7 @@ class UserCreationService:
         """Obtener detalles de un schedule específico"""
         try:
             schedule = Schedule.objects.get(id=schedule_id)
-            user = User.objects.get(id=user_id)
+            user = cls._get_user(user_id)
             
             # Verificar permisos
             if not user.can_view_patient_data(schedule.user.id):
@@ -564,6 +983,10 @@ class Medication(BaseModel):
     
     class Meta:
         db_table = 'Medications'
+        constraints = [
+            # Unicidad sin distinguir mayúsculas; también sirve a la búsqueda por prefijo
+            models.UniqueConstraint(Lower('name'), name='medication_name_ci_unique'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.form})"
@@ -580,6 +1003,12 @@ class Schedule(BaseModel):
     
     class Meta:
         db_table = 'Schedules'
+        indexes = [
+            # Schedule.objects.filter(user=...) ordenado por created_at
+            models.Index(fields=['user', 'created_at'], name='schedule_user_created_idx'),
+            # Verificación de duplicados en create_schedule
+            models.Index(fields=['user', 'medication', 'start_date'], name='schedule_user_med_start_idx'),
+        ]
     
     def __str__(self):
         return f"{self.medication.name} - {self.user.name}"
@@ -601,6 +1030,16 @@ class Intake(BaseModel):
     
     class Meta:
         db_table = 'Intakes'
+        indexes = [
+            # Búsquedas de intakes por (schedule, planned_at); status lo cubre para la analítica de adherencia
+            models.Index(fields=['schedule', 'planned_at', 'status'], name='intake_sched_plan_status_idx'),
+            # Barrido de intakes 'planned' vencidos (MissedIntakeSweeper)
+            models.Index(fields=['status', 'planned_at'], name='intake_status_planned_idx'),
+        ]
+        constraints = [
+            # Un intake por ocurrencia: el materializador puede correr en paralelo sin duplicar
+            models.UniqueConstraint(fields=['schedule', 'planned_at'], name='intake_schedule_planned_unique'),
+        ]
     
     def __str__(self):
         return f"{self.schedule.medication.name} - {self.status}"
@@ -617,6 +1056,11 @@ class DoctorPatientRelation(BaseModel):
     class Meta:
         db_table = 'DoctorPatientRelations'
         unique_together = ('doctor', 'patient')
+        indexes = [
+            # Relaciones activas de un paciente (serializers de pacientes)
+            models.Index(fields=['patient', 'doctor'], name='doctor_rel_active_patient_idx',
+                         condition=models.Q(is_active=True)),
+        ]
     
     def clean(self):
         from django.core.exceptions import ValidationError
@@ -652,6 +1096,11 @@ class FamilyPatientRelation(BaseModel):
     class Meta:
         db_table = 'FamilyPatientRelations'
         unique_together = ('family_member', 'patient')
+        indexes = [
+            # Relaciones activas de un paciente (serializers de pacientes)
+            models.Index(fields=['patient', 'family_member'], name='family_rel_active_patient_idx',
+                         condition=models.Q(is_active=True)),
+        ]
     
     def clean(self):
         from django.core.exceptions import ValidationError
@@ -662,3 +1111,39 @@ class FamilyPatientRelation(BaseModel):
     
     def __str__(self):
         return f"{self.family_member.name} ({self.relationship_type}) -> {self.patient.name}"
+
+
+# Progreso de tareas periódicas (ej: barrido de intakes vencidos)
+class JobCheckpoint(BaseModel):
+    name = models.CharField(max_length=100, unique=True)
+    position = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'JobCheckpoints'
+    
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+# Resumen diario de adherencia por paciente y medicamento (ver api.adherence.DailyAdherenceRollup)
+class DailyAdherence(BaseModel):
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_adherence')
+    medication = models.ForeignKey(Medication, on_delete=models.CASCADE)
+    date = models.DateField()  # Fecha local del paciente
+    planned = models.IntegerField(default=0)  # Total de tomas programadas del día
+    taken = models.IntegerField(default=0)
+    missed = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'DailyAdherence'
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'medication', 'date'], name='daily_adherence_unique'),
+        ]
+        indexes = [
+            # Ventanas de días de un paciente (dashboards)
+            models.Index(fields=['patient', 'date'], name='daily_adherence_patient_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.patient_id} - {self.medication_id} - {self.date}"
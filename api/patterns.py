@@ -0,0 +1,329 @@
+"""
+Compilador de patrones de recurrencia para Schedule.pattern
+Soporta las formas rrule, cron y "simple" (ej: 'daily_8am', 'every 8h')
+"""
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from functools import lru_cache
+
+from dateutil.relativedelta import relativedelta
+from dateutil.rrule import rrule, rrulestr, YEARLY, MONTHLY, WEEKLY, DAILY, HOURLY, MINUTELY
+
+from utils.timezones import get_zone, local_midnight, to_utc_many
+
+
+# Patrones "simples" documentados en el README -> horas locales del día
+SIMPLE_PATTERNS = {
+    'daily': (time(8, 0),),
+    'daily_morning': (time(8, 0),),
+    'daily_8am': (time(8, 0),),
+    'daily_12pm': (time(12, 0),),
+    'daily_8pm': (time(20, 0),),
+    'twice_daily': (time(8, 0), time(20, 0)),
+    'three_times_daily': (time(8, 0), time(14, 0), time(20, 0)),
+}
+
+# Patrones válidos que no generan ocurrencias programadas
+UNSCHEDULED_PATTERNS = {'as_needed'}
+
+DEFAULT_TIME = time(8, 0)
+PATTERN_CACHE_SIZE = 4096
+
+EVERY_RE = re.compile(r'^every\s+(\d+)\s*(m|min|h|d)$', re.IGNORECASE)
+EVERY_UNITS = {'m': 'minutes', 'min': 'minutes', 'h': 'hours', 'd': 'days'}
+
+# (mínimo, máximo) de cada campo cron: minuto hora día-mes mes día-semana
+CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+RRULE_FREQUENCIES = {
+    'YEARLY': YEARLY, 'MONTHLY': MONTHLY, 'WEEKLY': WEEKLY,
+    'DAILY': DAILY, 'HOURLY': HOURLY, 'MINUTELY': MINUTELY,
+}
+
+# Frecuencias rrule para las que se puede saltar directamente a la ventana
+RRULE_STEPS = {
+    MINUTELY: timedelta(minutes=1),
+    HOURLY: timedelta(hours=1),
+    DAILY: timedelta(days=1),
+    WEEKLY: timedelta(weeks=1),
+}
+
+
+def strictly_increasing(occurrences):
+    """
+    Descartar ocurrencias repetidas o fuera de orden: al correr una hora que cae
+    en un hueco de DST puede coincidir con la siguiente (ej. 'every 1h').
+    """
+    last = None
+    for occurrence in occurrences:
+        if last is None or occurrence > last:
+            last = occurrence
+            yield occurrence
+
+
+def _parse_rrule_params(text):
+    """
+    (freq, interval, count) de una regla de una sola línea, para saltar a la
+    ventana sin leer atributos internos de dateutil. Las reglas con varias
+    líneas (DTSTART, EXDATE, conjuntos) retornan freq None y se recorren completas.
+    """
+    lines = text.split()
+    if len(lines) != 1:
+        return None, 1, None
+    line = lines[0]
+    if line.upper().startswith('RRULE:'):
+        line = line[len('RRULE:'):]
+    params = dict(part.split('=', 1) for part in line.upper().split(';') if '=' in part)
+    count = params.get('COUNT')
+    return RRULE_FREQUENCIES.get(params.get('FREQ')), int(params.get('INTERVAL', 1)), int(count) if count else None
+
+
+def _parse_cron_field(value, minimum, maximum):
+    """Expandir un campo cron ('*/15', '1-5', '8,20') a una tupla ordenada"""
+    values = set()
+    for part in value.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f"Paso cron inválido: '{value}'")
+        if part == '*':
+            start, end = minimum, maximum
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            end = maximum if step > 1 else start
+        if start < minimum or end > maximum or start > end:
+            raise ValueError(f"Campo cron fuera de rango: '{value}'")
+        values.update(range(start, end + 1, step))
+    return tuple(sorted(values))
+
+
+def _parse_cron(expression):
+    """Parsear una expresión cron de 5 campos"""
+    parts = expression.split()
+    if len(parts) != 5:
+        raise ValueError(f"Expresión cron inválida: '{expression}'")
+
+    fields = [
+        _parse_cron_field(part, minimum, maximum)
+        for part, (minimum, maximum) in zip(parts, CRON_RANGES)
+    ]
+    # En cron 0 y 7 son domingo; se normaliza a weekday() de Python (lunes=0)
+    fields[4] = tuple(sorted({(day - 1) % 7 for day in fields[4]}))
+    # Semántica cron: si día-mes y día-semana están restringidos, basta con uno
+    restricted = (parts[2] != '*', parts[4] != '*')
+    return tuple(fields), restricted
+
+
+@dataclass(frozen=True)
+class CompiledPattern:
+    """
+    Patrón de recurrencia compilado, inmutable y hashable.
+    Las ocurrencias se calculan como horas locales del paciente y se convierten
+    a UTC por lotes con utils.timezones (huecos de DST hacia adelante,
+    pliegues en su primera ocurrencia).
+    """
+    pattern: str
+    tz_name: str
+    start_date: date
+    kind: str
+    times: tuple = ()
+    interval: timedelta = None
+    rule_text: str = ''
+    rule_freq: int = None
+    rule_interval: int = 1
+    rule_count: int = None
+    cron_fields: tuple = ()
+    cron_restricted: tuple = ()
+    _rule: object = field(default=None, compare=False, hash=False, repr=False)
+
+    def __post_init__(self):
+        if self.kind == 'rrule':
+            object.__setattr__(self, '_rule', rrulestr(self.rule_text, dtstart=self.rule_dtstart))
+
+    @property
+    def tzinfo(self):
+        return get_zone(self.tz_name)
+
+    @property
+    def rule_dtstart(self):
+        return datetime.combine(self.start_date, DEFAULT_TIME, tzinfo=self.tzinfo)
+
+    @property
+    def anchor(self):
+        """Medianoche local del start_date, en UTC"""
+        return local_midnight(self.start_date, self.tzinfo)
+
+    def _local_days(self, start, end):
+        """Fechas locales que cubren [start, end)"""
+        tz = self.tzinfo
+        day = start.astimezone(tz).date()
+        last_day = end.astimezone(tz).date()
+        while day <= last_day:
+            yield day
+            day += timedelta(days=1)
+
+    @property
+    def is_schedulable(self):
+        """Indica si el patrón genera ocurrencias programadas"""
+        return self.kind != 'none'
+
+    def __iter__(self):
+        """Iterar todas las ocurrencias desde start_date"""
+        if self.kind == 'none':
+            return
+        if self.kind == 'rrule':
+            yield from strictly_increasing(
+                occurrence.astimezone(dt_timezone.utc) for occurrence in self._rule
+            )
+            return
+
+        cursor = self.anchor
+        while True:
+            window_end = cursor + timedelta(days=31)
+            yield from self.occurrences_between(cursor, window_end)
+            cursor = window_end
+
+    def occurrences_between(self, start, end):
+        """
+        Ocurrencias en [start, end) en UTC, en orden cronológico.
+        Salta directamente a la ventana sin iterar desde start_date.
+        """
+        start = max(start, self.anchor)
+        if end <= start or self.kind == 'none':
+            return iter(())
+        return strictly_increasing(getattr(self, f'_between_{self.kind}')(start, end))
+
+    def _between_times(self, start, end):
+        local_times = (
+            datetime.combine(day, local_time)
+            for day in self._local_days(start, end)
+            for local_time in self.times
+        )
+        for occurrence in to_utc_many(local_times, self.tzinfo):
+            if start <= occurrence < end:
+                yield occurrence
+
+    def _between_interval(self, start, end):
+        """Pasos de reloj local desde el ancla: la hora del día se mantiene tras un cambio de DST"""
+        tz = self.tzinfo
+        anchor = datetime.combine(self.start_date, time(0, 0))
+        if self.interval >= timedelta(days=1):
+            anchor = anchor.replace(hour=DEFAULT_TIME.hour, minute=DEFAULT_TIME.minute)
+        # Un paso de margen: el reloj local puede ir una hora detrás del UTC
+        local_start = start.astimezone(tz).replace(tzinfo=None)
+        index = max(-((anchor - local_start) // self.interval) - 1, 0)
+
+        def local_times(index):
+            while True:
+                yield anchor + index * self.interval
+                index += 1
+
+        for occurrence in to_utc_many(local_times(index), tz):
+            if occurrence >= end:
+                break
+            if occurrence >= start:
+                yield occurrence
+
+    def _between_rrule(self, start, end):
+        rule = self._rule
+        freq = self.rule_freq if isinstance(rule, rrule) else None
+        step = RRULE_STEPS.get(freq)
+        dtstart = self.rule_dtstart
+        # Sin COUNT se puede mover dtstart a un múltiplo del periodo cercano a la ventana
+        if step is not None and self.rule_count is None:
+            period = step * self.rule_interval
+            # Un periodo de margen por los cambios de horario (DST)
+            periods = (start - dtstart) // period - 1
+            if periods > 0:
+                rule = rule.replace(dtstart=dtstart + periods * period)
+        elif freq in (YEARLY, MONTHLY) and self.rule_count is None and dtstart.day <= 28:
+            months = relativedelta(start.date(), dtstart.date())
+            months = months.years * 12 + months.months
+            months -= months % (self.rule_interval * (12 if freq == YEARLY else 1))
+            if months > 0:
+                rule = rule.replace(dtstart=dtstart + relativedelta(months=months))
+
+        for occurrence in rule.xafter(start, inc=True):
+            if occurrence >= end:
+                break
+            yield occurrence.astimezone(dt_timezone.utc)
+
+    def _between_cron(self, start, end):
+        minutes, hours, days, months, weekdays = self.cron_fields
+        dom_restricted, dow_restricted = self.cron_restricted
+
+        def local_times():
+            for day in self._local_days(start, end):
+                if day.month not in months:
+                    continue
+                dom_match = day.day in days
+                dow_match = day.weekday() in weekdays
+                if dom_restricted and dow_restricted:
+                    matches = dom_match or dow_match
+                else:
+                    matches = dom_match and dow_match
+                if matches:
+                    for hour in hours:
+                        for minute in minutes:
+                            yield datetime.combine(day, time(hour, minute))
+
+        for occurrence in to_utc_many(local_times(), self.tzinfo):
+            if start <= occurrence < end:
+                yield occurrence
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(pattern, tz_name='UTC', start_date=None):
+    """
+    Compilar un Schedule.pattern a un CompiledPattern.
+    Memoizado por (pattern, tz, start_date): los patrones compartidos por
+    muchos pacientes se parsean una sola vez por proceso.
+    Lanza ValueError si el patrón no es soportado.
+    """
+    raw = (pattern or '').strip()
+    key = raw.lower()
+    start_date = start_date or date(1970, 1, 1)
+    base = {'pattern': pattern, 'tz_name': tz_name, 'start_date': start_date}
+
+    if key in SIMPLE_PATTERNS:
+        return CompiledPattern(kind='times', times=SIMPLE_PATTERNS[key], **base)
+
+    if key == 'weekly':
+        return CompiledPattern(kind='interval', interval=timedelta(weeks=1), **base)
+
+    if key in UNSCHEDULED_PATTERNS:
+        return CompiledPattern(kind='none', **base)
+
+    match = EVERY_RE.match(key)
+    if match:
+        amount = int(match.group(1))
+        if amount <= 0:
+            raise ValueError(f"Patrón inválido: '{pattern}'")
+        interval = timedelta(**{EVERY_UNITS[match.group(2).lower()]: amount})
+        return CompiledPattern(kind='interval', interval=interval, **base)
+
+    if key.startswith('rrule:') or key.startswith('freq='):
+        try:
+            freq, interval, count = _parse_rrule_params(raw)
+            return CompiledPattern(
+                kind='rrule', rule_text=raw, rule_freq=freq, rule_interval=interval, rule_count=count, **base
+            )
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Regla rrule inválida: '{pattern}' ({e})")
+
+    if len(raw.split()) == 5:
+        try:
+            cron_fields, restricted = _parse_cron(raw)
+        except ValueError:
+            raise ValueError(f"Expresión cron inválida: '{pattern}'")
+        return CompiledPattern(
+            kind='cron', cron_fields=cron_fields, cron_restricted=restricted, **base
+        )
+
+    raise ValueError(f"Patrón no soportado: '{pattern}'")
@@ -0,0 +1,114 @@
+"""
+Resolución de permisos por request
+Carga una sola vez las relaciones del usuario actuante con sus pacientes y
+responde todas las verificaciones de permisos desde memoria. Entre requests las
+relaciones se reutilizan desde api.access_cache.
+"""
+from .access_cache import access_cache
+from .acting_user import aget_acting_user, get_acting_user
+
+
+class PermissionContext:
+    """
+    Grafo de relaciones del usuario actuante, memoizado por request.
+    Mantiene la misma semántica que User.can_view_patient_data y
+    User.can_manage_schedules.
+    """
+
+    REQUEST_ATTR = '_permission_context'
+
+    def __init__(self, user):
+        self.user = user
+        self._relations = None
+
+    @classmethod
+    def for_request(cls, request, user):
+        """
+        Obtener (o crear) el contexto del request para el usuario dado.
+        Se guarda en el HttpRequest subyacente para compartirlo entre capas DRF y Django.
+        """
+        target = getattr(request, '_request', request)
+        context = getattr(target, cls.REQUEST_ATTR, None)
+        if context is None or context.user.pk != user.pk:
+            context = cls(user)
+            setattr(target, cls.REQUEST_ATTR, context)
+        return context
+
+    @property
+    def relations(self):
+        """{patient_id: can_manage_medications}, desde el cache compartido o una consulta"""
+        if self._relations is None:
+            self._relations = access_cache.get_relations(self.user)
+        return self._relations
+
+    async def aload(self):
+        """Cargar las relaciones sin bloquear el event loop (vistas async)"""
+        if self._relations is None and self.user.user_type != 'patient':
+            self._relations = await access_cache.aget_relations(self.user)
+        return self
+
+    @property
+    def patient_ids(self):
+        """IDs de los pacientes accesibles por el usuario"""
+        if self.user.user_type == 'patient':
+            return frozenset([self.user.pk])
+        return frozenset(self.relations)
+
+    @staticmethod
+    def _normalize_id(patient_id):
+        try:
+            return int(patient_id)
+        except (TypeError, ValueError):
+            return None
+
+    def can_view_patient_data(self, patient_id):
+        """Determina si el usuario puede ver datos de un paciente específico"""
+        if self.user.user_type == 'patient':
+            return str(self.user.pk) == str(patient_id)
+        if self.user.user_type in ('doctor', 'family'):
+            return self._normalize_id(patient_id) in self.relations
+        return False
+
+    def can_manage_schedules(self, patient_id):
+        """Determina si el usuario puede gestionar horarios de un paciente"""
+        if self.user.user_type == 'doctor':
+            return self.can_view_patient_data(patient_id)
+        elif self.user.user_type == 'family':
+            return bool(self.relations.get(self._normalize_id(patient_id), False))
+        return False
+
+    def invalidate(self):
+        """Descartar las relaciones cargadas (ej: después de modificarlas)"""
+        self._relations = None
+
+
+class PermissionMixin:
+    """Mixin para validar permisos de usuario, compartido por las vistas de api y apirest"""
+
+    def get_user_from_request(self, request):
+        """Usuario actuante, resuelto una sola vez por request"""
+        return get_acting_user(request)
+
+    def get_permission_context(self, request, user):
+        """Permisos del usuario resueltos desde sus relaciones, cargadas una vez por request"""
+        return PermissionContext.for_request(request, user)
+
+    async def aget_user_from_request(self, request):
+        """Usuario actuante para vistas async"""
+        return await aget_acting_user(request)
+
+    async def aget_permission_context(self, request, user):
+        """Permisos con las relaciones ya cargadas; las verificaciones quedan en memoria"""
+        return await PermissionContext.for_request(request, user).aload()
+
+    def check_permission(self, user, action, target_user_id=None, request=None):
+        """Verificar si el usuario tiene permisos para una acción"""
+        permissions = (
+            self.get_permission_context(request, user) if request is not None
+            else PermissionContext(user)
+        )
+        if action == 'view_patient_data' and target_user_id:
+            return permissions.can_view_patient_data(target_user_id)
+        elif action == 'manage_schedules' and target_user_id:
+            return permissions.can_manage_schedules(target_user_id)
+        return False
@@ -0,0 +1,379 @@
+"""
+Recordatorios de tomas
+Carga los Intake 'planned' de los próximos minutos en una rueda de tiempo
+jerárquica y los dispara a su planned_at a través de un sender intercambiable.
+La base de datos no se consulta cada segundo: la rueda se recarga por rangos
+de planned_at cada refill_seconds y, al disparar, los vencidos se revalidan con
+una sola consulta para no recordar intakes registrados, borrados o reprogramados.
+"""
+import json
+import logging
+import math
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Intake, JobCheckpoint
+from utils.timezones import UTC, to_local
+
+logger = logging.getLogger(__name__)
+
+Reminder = namedtuple('Reminder', [
+    'intake_id', 'planned_at', 'local_time', 'patient_id', 'patient_name', 'medication', 'dose_amount'
+])
+
+
+def serialize_reminder(reminder):
+    return {
+        'intake_id': str(reminder.intake_id),
+        'planned_at': reminder.planned_at.isoformat(),
+        'local_time': reminder.local_time.isoformat(),
+        'patient_id': str(reminder.patient_id),
+        'patient_name': reminder.patient_name,
+        'medication': reminder.medication,
+        'dose_amount': reminder.dose_amount
+    }
+
+
+class TimingWheel:
+    """
+    Rueda de tiempo jerárquica con ticks enteros.
+    - El nivel 0 tiene un slot por tick; cada nivel superior agrupa una vuelta
+      completa del anterior (por defecto segundos, minutos y horas: un día).
+    - Agregar y disparar es O(1) por elemento. Cuando un nivel completa una
+      vuelta, el slot que toca del nivel superior se redistribuye en los
+      inferiores (cascada).
+    - Los elementos con tick ya pasado se disparan en el siguiente advance.
+    """
+
+    def __init__(self, current_tick, slots=(60, 60, 24)):
+        self.current_tick = current_tick
+        self.sizes = slots
+        self.units = [math.prod(slots[:level]) for level in range(len(slots))]
+        self.span = self.units[-1] * self.sizes[-1]
+        self.levels = [[[] for _ in range(size)] for size in slots]
+        self.expired = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, tick, item):
+        delta = tick - self.current_tick
+        if delta >= self.span:
+            raise ValueError(f"La rueda solo cubre {self.span} ticks hacia adelante")
+
+        if delta <= 0:
+            self.expired.append(item)
+        else:
+            for level, (unit, size) in enumerate(zip(self.units, self.sizes)):
+                if delta < unit * size:
+                    self.levels[level][(tick // unit) % size].append((tick, item))
+                    break
+        self.count += 1
+
+    def advance(self, tick):
+        """Avanzar hasta tick; retorna los elementos vencidos en orden cronológico"""
+        fired = self.expired
+        self.expired = []
+
+        while self.current_tick < tick:
+            self.current_tick += 1
+            current = self.current_tick
+
+            # Cascada desde el nivel más alto: lo que baja de las horas puede
+            # volver a bajar de los minutos en el mismo tick
+            for level in range(len(self.sizes) - 1, 0, -1):
+                unit = self.units[level]
+                if current % unit:
+                    continue
+                index = (current // unit) % self.sizes[level]
+                slot = self.levels[level][index]
+                if slot:
+                    self.levels[level][index] = []
+                    self.count -= len(slot)
+                    for item_tick, item in slot:
+                        self.add(item_tick, item)
+
+            if self.expired:
+                fired.extend(self.expired)
+                self.expired = []
+
+            index = current % self.sizes[0]
+            slot = self.levels[0][index]
+            if slot:
+                self.levels[0][index] = []
+                fired.extend(item for _, item in slot)
+
+        self.count -= len(fired)
+        return fired
+
+
+class ReminderSender:
+    """
+    Interfaz de envío de recordatorios. Las subclases implementan send; los
+    canales con envío por lotes pueden sobrescribir send_many.
+    """
+
+    def send(self, reminder):
+        raise NotImplementedError
+
+    def send_many(self, reminders):
+        for reminder in reminders:
+            self.send(reminder)
+
+
+class LogReminderSender(ReminderSender):
+    """Registra cada recordatorio en el logger api.reminders"""
+
+    def send(self, reminder):
+        logger.info(
+            'Recordatorio: %s (%s) a las %s para %s [intake %s]',
+            reminder.medication, reminder.dose_amount, reminder.local_time.isoformat(),
+            reminder.patient_name, reminder.intake_id
+        )
+
+
+class FileReminderSender(ReminderSender):
+    """Agrega cada recordatorio como una línea JSON a un archivo (pruebas y desarrollo local)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, reminder):
+        self.send_many([reminder])
+
+    def send_many(self, reminders):
+        with open(self.path, 'a', encoding='utf-8') as output:
+            output.writelines(json.dumps(serialize_reminder(reminder)) + '\n' for reminder in reminders)
+
+
+class ReminderDispatcher:
+    """
+    Dispara recordatorios de los intakes planificados a su planned_at.
+
+    - Cada refill_seconds carga en la rueda la franja nueva de planned_at,
+      (loaded_until, now + lookahead], con una consulta por rango sobre el
+      índice (status, planned_at).
+    - Cada resync_seconds vuelve a leer la ventana ya cargada para sumar los
+      intakes materializados después (ej. un schedule creado hace un momento).
+    - Antes de enviar, los recordatorios vencidos se revalidan con una consulta
+      por lote: se descartan los intakes que ya no están 'planned' (tomados
+      antes de su hora) o que ya no existen (schedule borrado o redefinido).
+    - Si el sender falla, los recordatorios vuelven a la rueda con espera
+      exponencial (retry_seconds, el doble en cada intento) hasta
+      max_send_attempts intentos; mientras esperan, el checkpoint no los pasa.
+    - El checkpoint en JobCheckpoint guarda hasta dónde se despachó; al
+      reiniciar se retoma desde ahí (hasta catch_up_minutes atrás).
+    Pensado para un solo proceso despachador.
+    """
+
+    CHECKPOINT_NAME = 'reminder_dispatcher'
+    DEFAULT_LOOKAHEAD_MINUTES = 10
+    DEFAULT_REFILL_SECONDS = 60
+    DEFAULT_RESYNC_SECONDS = 300
+    DEFAULT_CATCH_UP_MINUTES = 10
+    DEFAULT_BATCH_SIZE = 2000
+    DEFAULT_MAX_SEND_ATTEMPTS = 5
+    DEFAULT_RETRY_SECONDS = 5
+    # Ticks de un segundo; la rueda cubre un día
+    WHEEL_SLOTS = (60, 60, 24)
+
+    def __init__(self, sender, lookahead_minutes=DEFAULT_LOOKAHEAD_MINUTES,
+                 refill_seconds=DEFAULT_REFILL_SECONDS, resync_seconds=DEFAULT_RESYNC_SECONDS,
+                 catch_up_minutes=DEFAULT_CATCH_UP_MINUTES, batch_size=DEFAULT_BATCH_SIZE,
+                 max_send_attempts=DEFAULT_MAX_SEND_ATTEMPTS, retry_seconds=DEFAULT_RETRY_SECONDS):
+        if timedelta(minutes=lookahead_minutes) >= timedelta(seconds=math.prod(self.WHEEL_SLOTS)):
+            raise ValueError("lookahead_minutes debe ser menor a un día")
+        if refill_seconds > lookahead_minutes * 60:
+            raise ValueError("refill_seconds no puede superar el lookahead")
+
+        self.sender = sender
+        self.lookahead = timedelta(minutes=lookahead_minutes)
+        self.refill_interval = timedelta(seconds=refill_seconds)
+        self.resync_interval = timedelta(seconds=resync_seconds)
+        self.catch_up = timedelta(minutes=catch_up_minutes)
+        self.batch_size = batch_size
+        self.max_send_attempts = max_send_attempts
+        self.retry_seconds = retry_seconds
+
+        self.wheel = None
+        self.loaded_until = None
+        self.dispatched_until = None
+        self.next_refill = None
+        self.next_resync = None
+        # Intakes que están en la rueda, para no duplicarlos en el resync
+        self.pending = set()
+        # Intakes cuyo envío falló: {intake_id: (planned_at, intentos)}
+        self.retrying = {}
+        self.stats = {'loaded': 0, 'sent': 0, 'discarded': 0, 'failed': 0, 'refills': 0}
+
+    @staticmethod
+    def to_tick(value):
+        """Tick (segundo) en el que se dispara un planned_at: nunca antes de la hora"""
+        return math.ceil(value.timestamp())
+
+    @staticmethod
+    def from_tick(tick):
+        return datetime.fromtimestamp(tick, tz=UTC)
+
+    def get_checkpoint(self):
+        checkpoint, _ = JobCheckpoint.objects.get_or_create(name=self.CHECKPOINT_NAME)
+        return checkpoint.position
+
+    def save_checkpoint(self, position):
+        JobCheckpoint.objects.filter(name=self.CHECKPOINT_NAME).filter(
+            Q(position__isnull=True) | Q(position__lt=position)
+        ).update(position=position, updated_at=timezone.now())
+
+    def start(self, now=None):
+        """
+        Inicializar la rueda en now y cargar la primera ventana.
+        Si el checkpoint es reciente se incluyen los recordatorios que quedaron
+        sin despachar desde entonces (se disparan en el primer dispatch).
+        """
+        now = now or timezone.now()
+        since = now
+        checkpoint = self.get_checkpoint()
+        if checkpoint is not None and now - self.catch_up <= checkpoint < now:
+            since = checkpoint
+
+        self.wheel = TimingWheel(math.floor(now.timestamp()), self.WHEEL_SLOTS)
+        self.loaded_until = since
+        self.dispatched_until = since
+        self.pending = set()
+        self.retrying = {}
+        self.next_resync = now + self.resync_interval
+        self.refill(now)
+
+    def reminders_between(self, after, until):
+        """Recordatorios de los intakes planificados con planned_at en (after, until]"""
+        rows = Intake.objects.filter(
+            status='planned', planned_at__gt=after, planned_at__lte=until
+        ).order_by('planned_at').values_list(
+            'id', 'planned_at', 'schedule__user_id', 'schedule__user__name', 'schedule__user__tz',
+            'schedule__medication__name', 'schedule__dose_amount'
+        )
+        for intake_id, planned_at, patient_id, name, tz_name, medication, dose_amount in rows.iterator(
+            chunk_size=self.batch_size
+        ):
+            yield Reminder(
+                intake_id, planned_at, to_local(planned_at, tz_name), patient_id, name, medication, dose_amount
+            )
+
+    def load(self, reminders):
+        loaded = 0
+        for reminder in reminders:
+            if reminder.intake_id in self.pending:
+                continue
+            self.wheel.add(self.to_tick(reminder.planned_at), reminder)
+            self.pending.add(reminder.intake_id)
+            loaded += 1
+        self.stats['loaded'] += loaded
+        return loaded
+
+    def refill(self, now=None):
+        """Cargar la franja nueva (loaded_until, now + lookahead] y guardar el checkpoint"""
+        now = now or timezone.now()
+        until = now + self.lookahead
+        loaded = 0
+        if until > self.loaded_until:
+            loaded = self.load(self.reminders_between(self.loaded_until, until))
+            self.loaded_until = until
+        self.next_refill = now + self.refill_interval
+        self.stats['refills'] += 1
+        self.save_checkpoint(self.dispatched_until)
+        return loaded
+
+    def resync(self, now=None):
+        """Sumar los intakes creados después de cargar su franja, en (now, loaded_until]"""
+        now = now or timezone.now()
+        self.next_resync = now + self.resync_interval
+        return self.load(self.reminders_between(now, self.loaded_until))
+
+    def still_planned(self, intake_ids):
+        """Ids que siguen existiendo y 'planned'; una consulta por bloque de batch_size"""
+        planned = set()
+        for start in range(0, len(intake_ids), self.batch_size):
+            planned.update(Intake.objects.filter(
+                id__in=intake_ids[start:start + self.batch_size], status='planned'
+            ).values_list('id', flat=True))
+        return planned
+
+    def dispatch(self, now=None):
+        """Disparar los recordatorios vencidos hasta now; retorna cuántos se enviaron"""
+        now = now or timezone.now()
+        due = self.wheel.advance(math.floor(now.timestamp()))
+        sent = self.send_due(due) if due else 0
+
+        # Todo lo que tiene planned_at <= current_tick ya salió de la rueda, salvo
+        # los que esperan reintento: el checkpoint queda justo antes del más antiguo
+        dispatched_until = self.from_tick(self.wheel.current_tick)
+        if self.retrying:
+            oldest = min(planned_at for planned_at, _ in self.retrying.values())
+            dispatched_until = min(dispatched_until, oldest - timedelta(microseconds=1))
+        self.dispatched_until = max(self.dispatched_until, dispatched_until)
+        return sent
+
+    def send_due(self, due):
+        """Enviar los recordatorios vencidos que siguen 'planned'; si el sender falla, reintentar"""
+        self.pending.difference_update(reminder.intake_id for reminder in due)
+        attempts = {reminder.intake_id: self.retrying.pop(reminder.intake_id, (None, 0))[1] for reminder in due}
+        planned = self.still_planned([reminder.intake_id for reminder in due])
+        reminders = [reminder for reminder in due if reminder.intake_id in planned]
+        self.stats['discarded'] += len(due) - len(reminders)
+        if not reminders:
+            return 0
+
+        try:
+            self.sender.send_many(reminders)
+        except Exception:
+            logger.exception('Error enviando %s recordatorios', len(reminders))
+            for reminder in reminders:
+                self.retry(reminder, attempts[reminder.intake_id] + 1)
+            return 0
+        self.stats['sent'] += len(reminders)
+        return len(reminders)
+
+    def retry(self, reminder, attempt):
+        """Volver a poner en la rueda un recordatorio cuyo envío falló, con espera exponencial"""
+        if attempt >= self.max_send_attempts:
+            logger.error('Recordatorio descartado tras %s intentos [intake %s]', attempt, reminder.intake_id)
+            self.stats['failed'] += 1
+            return
+        delay = min(self.retry_seconds * 2 ** (attempt - 1), self.wheel.span - 1)
+        self.wheel.add(self.wheel.current_tick + delay, reminder)
+        self.pending.add(reminder.intake_id)
+        self.retrying[reminder.intake_id] = (reminder.planned_at, attempt)
+
+    def step(self, now=None):
+        """Un ciclo del despachador: disparar lo vencido y recargar si corresponde"""
+        now = now or timezone.now()
+        if self.wheel is None:
+            self.start(now)
+
+        sent = self.dispatch(now)
+        if now >= self.next_refill:
+            self.refill(now)
+        if now >= self.next_resync:
+            self.resync(now)
+        return sent
+
+    def run(self, duration=None):
+        """
+        Ejecutar un ciclo por segundo; sin duration corre indefinidamente.
+        Un error en un ciclo se registra y el siguiente ciclo lo reintenta.
+        """
+        deadline = time.monotonic() + duration if duration else None
+        while deadline is None or time.monotonic() < deadline:
+            # Descartar conexiones caídas o vencidas (CONN_MAX_AGE) antes de usarlas
+            close_old_connections()
+            try:
+                self.step()
+            except Exception:
+                logger.exception('Error en el ciclo del despachador de recordatorios')
+            time.sleep(1 - time.time() % 1)
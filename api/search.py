@@ -0,0 +1,183 @@
+"""
+Búsqueda de medicamentos para autocompletado
+Primero coincidencias por prefijo y luego por similitud de trigramas.
+En PostgreSQL se resuelve en la base de datos (índice LOWER(name) y GIN pg_trgm);
+en SQLite con un índice en memoria que se reconstruye cuando cambia el formulario.
+"""
+import bisect
+import threading
+import uuid
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+
+from .models import Medication
+
+# Igual al umbral por defecto de pg_trgm (pg_trgm.similarity_threshold)
+SIMILARITY_THRESHOLD = 0.3
+
+
+def normalize(text):
+    """Minúsculas y espacios colapsados, como se compara en LOWER(name)"""
+    return ' '.join(text.lower().split())
+
+
+def trigrams(text):
+    """
+    Trigramas al estilo de pg_trgm: cada palabra (solo alfanuméricos) se
+    rellena con dos espacios al inicio y uno al final.
+    """
+    result = set()
+    for word in ''.join(char if char.isalnum() else ' ' for char in text.lower()).split():
+        padded = f'  {word} '
+        result.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return result
+
+
+def serialize(medication_id, name, form):
+    return {'id': str(medication_id), 'name': name, 'form': form}
+
+
+class MedicationSearchIndex:
+    """
+    Índice en memoria del formulario de medicamentos.
+    - Lista ordenada de (nombre normalizado, id) para prefijos con bisect.
+    - Índice invertido trigrama -> ids para similitud.
+    Cada proceso guarda su copia; la versión en el cache de Django indica
+    cuándo reconstruirla (ver api.signals).
+    """
+
+    VERSION_KEY = 'medication_search_version'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._names = []
+        self._entries = {}
+        self._trigrams = defaultdict(set)
+        self._trigram_counts = {}
+
+    def current_version(self):
+        version = cache.get(self.VERSION_KEY)
+        if version is None:
+            cache.add(self.VERSION_KEY, uuid.uuid4().hex, timeout=None)
+            version = cache.get(self.VERSION_KEY)
+        return version
+
+    def invalidate(self):
+        """
+        Marcar el índice como desactualizado en todos los procesos.
+        Se repite al confirmar la transacción para no quedarse con un índice
+        reconstruido antes del COMMIT.
+        """
+        def bump():
+            cache.set(self.VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+        bump()
+        transaction.on_commit(bump)
+
+    def build(self, rows):
+        """Construir el índice a partir de filas (id, name, form)"""
+        names = []
+        entries = {}
+        index = defaultdict(set)
+        counts = {}
+        for medication_id, name, form in rows:
+            entries[medication_id] = (name, form)
+            names.append((normalize(name), medication_id))
+            grams = trigrams(name)
+            counts[medication_id] = len(grams)
+            for gram in grams:
+                index[gram].add(medication_id)
+        names.sort()
+
+        self._names = names
+        self._entries = entries
+        self._trigrams = index
+        self._trigram_counts = counts
+
+    def ensure_loaded(self):
+        version = self.current_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            self.build(Medication.objects.values_list('id', 'name', 'form').iterator(chunk_size=2000))
+            self._version = version
+
+    def prefix_matches(self, prefix, limit):
+        """Ids cuyo nombre empieza por prefix, en orden alfabético"""
+        start = bisect.bisect_left(self._names, (prefix,))
+        matches = []
+        for name, medication_id in self._names[start:]:
+            if not name.startswith(prefix) or len(matches) >= limit:
+                break
+            matches.append(medication_id)
+        return matches
+
+    def similar_matches(self, query, limit, exclude=()):
+        """Ids ordenados por similitud de trigramas (shared / union), sobre el umbral"""
+        grams = trigrams(query)
+        if not grams:
+            return []
+
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(gram, ()))
+
+        scored = []
+        for medication_id, common in shared.items():
+            if medication_id in exclude:
+                continue
+            similarity = common / (len(grams) + self._trigram_counts[medication_id] - common)
+            if similarity >= SIMILARITY_THRESHOLD:
+                scored.append((-similarity, self._entries[medication_id][0].lower(), medication_id))
+        scored.sort()
+        return [medication_id for _, _, medication_id in scored[:limit]]
+
+    def search(self, query, limit=10):
+        self.ensure_loaded()
+        query = normalize(query)
+        matches = self.prefix_matches(query, limit)
+        if len(matches) < limit:
+            matches += self.similar_matches(query, limit - len(matches), exclude=set(matches))
+        return [serialize(medication_id, *self._entries[medication_id]) for medication_id in matches]
+
+
+def search_database(query, limit=10):
+    """
+    Búsqueda en PostgreSQL: prefijo sobre LOWER(name) y luego el operador %
+    de pg_trgm, ambos respaldados por índices (migración 0007).
+    """
+    query = normalize(query)
+    medications = Medication.objects.annotate(name_lower=Lower('name'))
+
+    rows = list(
+        medications.filter(name_lower__startswith=query)
+        .order_by('name_lower', 'id')
+        .values_list('id', 'name', 'form')[:limit]
+    )
+    if len(rows) < limit:
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        rows += list(
+            medications.filter(name_lower__trigram_similar=query)
+            .exclude(id__in=[row[0] for row in rows])
+            .annotate(similarity=TrigramSimilarity('name_lower', query))
+            .order_by('-similarity', 'name_lower')
+            .values_list('id', 'name', 'form')[:limit - len(rows)]
+        )
+    return [serialize(*row) for row in rows]
+
+
+medication_index = MedicationSearchIndex()
+
+
+def search_medications(query, limit=10):
+    """Autocompletado de medicamentos según el motor de base de datos"""
+    if connection.vendor == 'postgresql':
+        return search_database(query, limit)
+    return medication_index.search(query, limit)
@@ -0,0 +1,26 @@
+"""
+Señales del app api
+Invalidan el cache de conjuntos de acceso cuando cambian las relaciones cuidador-paciente
+y el índice de búsqueda de medicamentos cuando cambia el formulario.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .access_cache import access_cache
+from .models import DoctorPatientRelation, FamilyPatientRelation, Medication
+from .search import medication_index
+
+
+@receiver([post_save, post_delete], sender=DoctorPatientRelation)
+def invalidate_doctor_access(sender, instance, **kwargs):
+    access_cache.invalidate(instance.doctor_id)
+
+
+@receiver([post_save, post_delete], sender=FamilyPatientRelation)
+def invalidate_family_access(sender, instance, **kwargs):
+    access_cache.invalidate(instance.family_member_id)
+
+
+@receiver([post_save, post_delete], sender=Medication)
+def invalidate_medication_search(sender, instance, **kwargs):
+    medication_index.invalidate()
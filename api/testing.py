@@ -0,0 +1,11 @@
+"""
+Utilidades compartidas por los tests de api, apirest y auth0authorization
+"""
+from .models import UserCreationService
+
+
+def make_user(user_type, email, **kwargs):
+    """Crear un usuario de prueba sin hashear contraseña (acelera los tests)"""
+    return UserCreationService.create_user(
+        user_type=user_type, email=email, password=None, **kwargs
+    )
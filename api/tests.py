@@ -1,3 +1,1766 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from dateutil.rrule import DAILY
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models.functions import Lower
+from unittest import mock, skipUnless
+
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.request import Request
+
+from . import adherence
+from .access_cache import access_cache
+from .adherence import AdherenceAnalytics, DailyAdherenceRollup
+from .intakes import IntakeEventIngestor, IntakeMaterializer, MissedIntakeSweeper
+from .acting_user import get_acting_user
+from .patterns import compile_pattern
+from .reminders import FileReminderSender, ReminderDispatcher, ReminderSender, TimingWheel
+from .search import MedicationSearchIndex, medication_index, trigrams
+from .testing import make_user
+from utils.format import Format
+from utils.timezones import get_zone, to_utc, to_utc_many
+from .permissions import PermissionContext
+from .models import (
+    UserCreationService, Medication, Schedule, Intake,
+    DoctorPatientRelation, FamilyPatientRelation, JobCheckpoint, DailyAdherence
+)
+
+
+class PatternCompilerTests(TestCase):
+    """Tests del compilador de patrones de recurrencia"""
+
+    def test_compiled_patterns_are_cached_and_hashable(self):
+        first = compile_pattern('every 8h', 'America/Bogota', date(2025, 1, 1))
+        second = compile_pattern('every 8h', 'America/Bogota', date(2025, 1, 1))
+
+        self.assertIs(first, second)
+        self.assertEqual(len({first, second}), 1)
+
+    def test_supported_forms(self):
+        start = datetime(2025, 1, 6, 0, 0, tzinfo=dt_timezone.utc)
+        end = start + timedelta(days=7)
+        expected = {
+            'three_times_daily': 21,
+            'every 12h': 14,
+            'RRULE:FREQ=WEEKLY;BYDAY=MO,WE,FR': 3,
+            '0 8,20 * * 1-5': 10,
+            'as_needed': 0,
+        }
+        for pattern, count in expected.items():
+            compiled = compile_pattern(pattern, 'UTC', date(2025, 1, 1))
+            self.assertEqual(len(list(compiled.occurrences_between(start, end))), count, pattern)
+
+        with self.assertRaises(ValueError):
+            compile_pattern('cada tanto', 'UTC', date(2025, 1, 1))
+
+    def test_window_matches_full_iteration(self):
+        start = datetime(2025, 3, 1, tzinfo=dt_timezone.utc)
+        end = start + timedelta(days=30)
+        for pattern in (
+            'RRULE:FREQ=DAILY;INTERVAL=3;BYHOUR=8,20',
+            'FREQ=MONTHLY;INTERVAL=2;BYMONTHDAY=5',
+            'RRULE:FREQ=DAILY;COUNT=2000',
+        ):
+            compiled = compile_pattern(pattern, 'America/Bogota', date(2020, 1, 1))
+
+            full = []
+            for occurrence in compiled:
+                if occurrence >= end:
+                    break
+                if occurrence >= start:
+                    full.append(occurrence)
+
+            self.assertEqual(list(compiled.occurrences_between(start, end)), full, pattern)
+
+    def test_rrule_parameters_are_parsed_at_compile_time(self):
+        compiled = compile_pattern('RRULE:FREQ=DAILY;INTERVAL=3;BYHOUR=8,20', 'UTC', date(2020, 1, 1))
+        self.assertEqual((compiled.rule_freq, compiled.rule_interval, compiled.rule_count), (DAILY, 3, None))
+
+        counted = compile_pattern('FREQ=WEEKLY;COUNT=4', 'UTC', date(2020, 1, 1))
+        self.assertEqual((counted.rule_interval, counted.rule_count), (1, 4))
+
+
+class TimezoneServiceTests(SimpleTestCase):
+    """Conversión de horas locales a UTC con zonas cacheadas y cambios de horario"""
+
+    def test_zones_are_cached_per_name(self):
+        self.assertIs(get_zone('America/Bogota'), get_zone('America/Bogota'))
+        self.assertEqual(str(get_zone('No/Existe')), 'UTC')
+        self.assertEqual(str(get_zone('')), 'UTC')
+
+    def test_gaps_move_forward_and_folds_use_first_occurrence(self):
+        new_york = get_zone('America/New_York')
+        self.assertEqual(to_utc(datetime(2025, 3, 9, 2, 30), new_york),
+                         datetime(2025, 3, 9, 7, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(to_utc(datetime(2025, 11, 2, 1, 30), new_york),
+                         datetime(2025, 11, 2, 5, 30, tzinfo=dt_timezone.utc))
+
+    def test_bulk_conversion_matches_scalar(self):
+        new_york = get_zone('America/New_York')
+        hours = [datetime(2025, 1, 1) + timedelta(minutes=30 * step) for step in range(2 * 24 * 365)]
+        self.assertEqual(list(to_utc_many(hours, new_york)), [to_utc(hour, new_york) for hour in hours])
+
+    def test_hourly_pattern_across_dst(self):
+        compiled = compile_pattern('every 1h', 'America/New_York', date(2025, 1, 1))
+        new_york = get_zone('America/New_York')
+
+        for day, hours in ((date(2025, 3, 9), 23), (date(2025, 11, 2), 24)):
+            start = to_utc(datetime.combine(day, datetime.min.time()), new_york)
+            end = to_utc(datetime.combine(day + timedelta(days=1), datetime.min.time()), new_york)
+            occurrences = list(compiled.occurrences_between(start, end))
+            self.assertEqual(len(occurrences), hours, day)
+            self.assertEqual(occurrences, sorted(set(occurrences)))
+
+    def test_datetime_bogota(self):
+        self.assertEqual(Format.datetime_bogota(1755016999).isoformat(), '2025-08-12T11:43:19-05:00')
+        self.assertEqual(
+            Format.datetime_bogota('2025-08-11T15:29:56Z').isoformat(), '2025-08-11T10:29:56-05:00'
+        )
+        self.assertEqual(Format.datetime_bogota().utcoffset(), timedelta(hours=-5))
+
+
+class FormatBatchTests(SimpleTestCase):
+    """Las versiones por lote de Format dan el mismo resultado que las escalares"""
+
+    def test_format_phone_numbers(self):
+        numbers = [
+            "3123456789", "+57 312 345 6789", "whatsapp:+573123456789", "312-345-6789", "12345",
+            "7123456", "+1 2 3123456789", "312+456", "++573123456789", "", None, 3123456789, "٣١٢٣٤٥٦٧٨٩",
+        ]
+        for extension in ("57", "1"):
+            self.assertEqual(
+                Format.format_phone_numbers(numbers, extension),
+                [Format.format_phone_number(number, extension) for number in numbers]
+            )
+        self.assertEqual(Format.format_phone_numbers(iter(["312 345 6789"])), ["573123456789"])
+
+    def test_format_dates(self):
+        dates = [
+            "2025-07-17", "2025-07-17 08:30:00", "2025-7-1", "2025-02-29", "2025-07-17 24:00:00",
+            "0999-01-01", "", None, "texto", date(2025, 1, 2), datetime(2025, 1, 2, 8, 0),
+        ]
+        self.assertEqual(Format.format_dates(dates), [Format.format_date(value) for value in dates])
+
+    def test_format_numbers(self):
+        numbers = [
+            1234567.89, "1234567.5", 1234567, 0, "", None, "-", "1,234", "abc",
+            2.5, 3.5, -0.4, float('nan'), float('inf'), 1e300,
+        ]
+        only_numbers = [value for value in numbers if isinstance(value, (int, float))]
+        for separator in (".", ","):
+            expected = [Format.format_number(value, separator) for value in only_numbers]
+            self.assertEqual(Format.format_numbers(only_numbers, separator), expected)
+            self.assertEqual(Format.format_numbers(only_numbers, separator, use_numpy=False), expected)
+            self.assertEqual(
+                Format.format_numbers(numbers, separator),
+                [Format.format_number(value, separator) for value in numbers]
+            )
+        self.assertEqual(Format.format_numbers([10 ** 400, 1.5]), ["0", "2"])
+
+
+class IntakeMaterializerTests(TestCase):
+    """Tests del motor de materialización de intakes"""
+
+    def setUp(self):
+        self.patient = make_user('patient', 'paciente_intakes@example.com', name='Paciente Intakes', tz='UTC')
+        self.medication = Medication.objects.create(name='Aspirina', form='tablet')
+        self.now = datetime(2025, 1, 1, 0, 0, tzinfo=dt_timezone.utc)
+
+    def create_schedule(self, pattern, **kwargs):
+        return Schedule.objects.create(
+            user=self.patient,
+            medication=self.medication,
+            start_date=kwargs.pop('start_date', date(2025, 1, 1)),
+            pattern=pattern,
+            dose_amount='100mg',
+            **kwargs
+        )
+
+    def test_materializes_horizon(self):
+        schedule = self.create_schedule('twice_daily')
+
+        stats = IntakeMaterializer(horizon_days=14).materialize(now=self.now)
+
+        self.assertEqual(stats['intakes_created'], 28)
+        planned = list(
+            Intake.objects.filter(schedule=schedule).order_by('planned_at')
+            .values_list('planned_at', flat=True)
+        )
+        self.assertEqual(planned[0], datetime(2025, 1, 1, 8, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(planned[1], datetime(2025, 1, 1, 20, 0, tzinfo=dt_timezone.utc))
+
+    def test_incremental_run_only_extends_missing_window(self):
+        schedule = self.create_schedule('every 8h')
+        materializer = IntakeMaterializer(horizon_days=2)
+
+        materializer.materialize(now=self.now)
+        self.assertEqual(Intake.objects.filter(schedule=schedule).count(), 6)
+
+        # Repetir sin avanzar el reloj no crea duplicados
+        stats = materializer.materialize(now=self.now)
+        self.assertEqual(stats['intakes_created'], 0)
+
+        stats = materializer.materialize(now=self.now + timedelta(days=1))
+        self.assertEqual(stats['intakes_created'], 3)
+        self.assertEqual(Intake.objects.filter(schedule=schedule).count(), 9)
+
+    def test_overlapping_runs_do_not_duplicate_intakes(self):
+        schedule = self.create_schedule('every 8h')
+        first = IntakeMaterializer(horizon_days=2)
+        flush = first._flush
+
+        # Otra ejecución inserta la misma ventana entre la lectura del último
+        # planned_at y el INSERT de la primera
+        def interleaved(pending):
+            IntakeMaterializer(horizon_days=2).materialize(now=self.now)
+            return flush(pending)
+
+        first._flush = interleaved
+        stats = first.materialize(now=self.now)
+
+        self.assertEqual(stats['intakes_created'], 0)
+        self.assertEqual(Intake.objects.filter(schedule=schedule).count(), 6)
+        self.assertEqual(sum(DailyAdherence.objects.values_list('planned', flat=True)), 6)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Intake.objects.create(schedule=schedule, planned_at=Intake.objects.first().planned_at)
+
+    def test_slot_inserted_by_another_path_is_not_counted(self):
+        schedule = self.create_schedule('every 8h')
+        materializer = IntakeMaterializer(horizon_days=2)
+        read_slots = materializer.existing_slots
+        calls = []
+
+        def read_then_insert(pending):
+            existing = read_slots(pending)
+            if not calls:
+                # Otro camino (ej: creación manual de un intake) ocupa un slot después de la lectura
+                Intake.objects.create(schedule=schedule, planned_at=pending[0][0].planned_at)
+            calls.append(len(existing))
+            return existing
+
+        materializer.existing_slots = read_then_insert
+        stats = materializer.materialize(now=self.now)
+
+        self.assertEqual(calls, [0, 1])
+        self.assertEqual(stats['intakes_created'], 5)
+        self.assertEqual(Intake.objects.filter(schedule=schedule).count(), 6)
+        self.assertEqual(sum(DailyAdherence.objects.values_list('planned', flat=True)), 5)
+
+    def test_respects_end_date_and_invalid_patterns(self):
+        self.create_schedule('daily_8am', end_date=date(2025, 1, 3))
+        self.create_schedule('as_needed')
+        self.create_schedule('patrón desconocido')
+
+        stats = IntakeMaterializer(horizon_days=14).materialize(now=self.now)
+
+        self.assertEqual(stats['intakes_created'], 3)
+        self.assertEqual(stats['invalid_patterns'], 1)
+
+
+class MissedIntakeSweeperTests(TestCase):
+    """Tests del barrido de intakes vencidos"""
+
+    def setUp(self):
+        patient = make_user('patient', 'paciente_barrido@example.com', name='Paciente Barrido', tz='UTC')
+        medication = Medication.objects.create(name='Losartán', form='tablet')
+        self.schedule = Schedule.objects.create(
+            user=patient, medication=medication, start_date=date(2025, 1, 1),
+            pattern='every 1h', dose_amount='50mg'
+        )
+        self.now = datetime(2025, 1, 2, 0, 0, tzinfo=dt_timezone.utc)
+
+    def create_intakes(self, hours_ago, **kwargs):
+        return Intake.objects.bulk_create([
+            Intake(schedule=self.schedule, planned_at=self.now - timedelta(hours=hours), **kwargs)
+            for hours in hours_ago
+        ])
+
+    def statuses(self):
+        return dict(Intake.objects.values_list('planned_at', 'status'))
+
+    def test_marks_overdue_intakes_after_grace_window(self):
+        self.create_intakes(range(1, 11))
+        self.create_intakes([12], status='taken')
+
+        stats = MissedIntakeSweeper(grace_minutes=120, batch_size=3).sweep(now=self.now)
+
+        # Dentro de la gracia (1 y 2 horas) siguen planificados
+        self.assertEqual(stats['intakes_missed'], 8)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(Intake.objects.filter(status='planned').count(), 2)
+        self.assertEqual(Intake.objects.filter(status='taken').count(), 1)
+
+    def test_query_count_is_per_batch(self):
+        self.create_intakes(range(3, 33))
+        sweeper = MissedIntakeSweeper(grace_minutes=0, batch_size=10)
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = sweeper.sweep(now=self.now)
+
+        self.assertEqual(stats['intakes_missed'], 30)
+        select_updates = [
+            query for query in queries.captured_queries if query['sql'].startswith(('SELECT "Intakes"', 'UPDATE "Intakes"'))
+        ]
+        # Un SELECT y un UPDATE por bloque, el SELECT final vacío y el de intakes saltados
+        self.assertEqual(len(select_updates), 8)
+
+    def test_checkpoint_limits_next_run_to_new_slice(self):
+        sweeper = MissedIntakeSweeper(grace_minutes=60)
+        self.create_intakes([5])
+        sweeper.sweep(now=self.now)
+        self.assertEqual(JobCheckpoint.objects.get().position, self.now - timedelta(hours=1))
+
+        # Un intake anterior al checkpoint queda fuera del siguiente barrido
+        self.create_intakes([10])
+        stats = sweeper.sweep(now=self.now + timedelta(hours=1))
+        self.assertEqual(stats['since'], self.now - timedelta(hours=1))
+        self.assertEqual(stats['intakes_missed'], 0)
+
+        stats = sweeper.sweep(now=self.now + timedelta(hours=1), full=True)
+        self.assertEqual(stats['intakes_missed'], 1)
+
+    def test_checkpoint_stops_at_rows_skipped_as_locked(self):
+        sweeper = MissedIntakeSweeper(grace_minutes=60, batch_size=2)
+        locked, *others = self.create_intakes([8, 6, 4, 3])
+        sweep_batch = sweeper.sweep_batch
+
+        def sweep_batch_skipping_locked(*args):
+            # Otra transacción tiene el intake bloqueado: skip_locked no lo devuelve
+            sweeper.overdue = lambda since, cutoff: MissedIntakeSweeper.overdue(
+                sweeper, since, cutoff
+            ).exclude(id=locked.id)
+            try:
+                return sweep_batch(*args)
+            finally:
+                del sweeper.overdue
+
+        sweeper.sweep_batch = sweep_batch_skipping_locked
+        stats = sweeper.sweep(now=self.now)
+
+        self.assertEqual(stats['intakes_missed'], 3)
+        self.assertEqual(JobCheckpoint.objects.get().position, locked.planned_at)
+
+        del sweeper.sweep_batch
+        stats = sweeper.sweep(now=self.now + timedelta(minutes=5))
+        self.assertEqual(stats['intakes_missed'], 1)
+        self.assertEqual(JobCheckpoint.objects.get().position, self.now + timedelta(minutes=5) - timedelta(hours=1))
+
+    def test_checkpoint_never_moves_backwards(self):
+        sweeper = MissedIntakeSweeper(grace_minutes=0)
+        sweeper.sweep(now=self.now)
+        sweeper.sweep(now=self.now - timedelta(hours=3), full=True)
+
+        self.assertEqual(JobCheckpoint.objects.get().position, self.now)
+
+
+class TimingWheelTests(SimpleTestCase):
+    """Rueda de tiempo jerárquica de los recordatorios"""
+
+    def test_items_fire_at_their_tick_across_levels(self):
+        wheel = TimingWheel(current_tick=3590)
+        ticks = [3591, 3600, 3650, 3590 + 59, 3590 + 60, 7200, 7259, 3590 + 86399]
+        for tick in ticks:
+            wheel.add(tick, tick)
+        self.assertEqual(len(wheel), len(ticks))
+
+        fired = {}
+        for tick in range(3591, 3590 + 86400):
+            for item in wheel.advance(tick):
+                fired[item] = tick
+
+        self.assertEqual(fired, {tick: tick for tick in ticks})
+        self.assertEqual(len(wheel), 0)
+
+    def test_past_items_fire_on_next_advance(self):
+        wheel = TimingWheel(current_tick=100)
+        wheel.add(90, 'tarde')
+        wheel.add(105, 'luego')
+
+        self.assertEqual(wheel.advance(100), ['tarde'])
+        self.assertEqual(wheel.advance(110), ['luego'])
+        with self.assertRaises(ValueError):
+            wheel.add(100 + 86400 + 10, 'lejos')
+
+
+class CollectingSender(ReminderSender):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, reminder):
+        self.sent.append(reminder)
+
+
+class FailingSender(CollectingSender):
+    """Falla las primeras failures llamadas a send_many"""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.calls = 0
+
+    def send_many(self, reminders):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError('canal no disponible')
+        super().send_many(reminders)
+
+
+class ReminderDispatcherTests(TestCase):
+    """Tests del despachador de recordatorios"""
+
+    def setUp(self):
+        patient = make_user('patient', 'paciente_recordatorio@example.com', name='Paciente Recordatorio',
+                            tz='America/Bogota')
+        medication = Medication.objects.create(name='Metformina', form='tablet')
+        self.schedule = Schedule.objects.create(
+            user=patient, medication=medication, start_date=date(2025, 1, 1),
+            pattern='every 1h', dose_amount='850mg'
+        )
+        self.now = datetime(2025, 1, 2, 12, 0, tzinfo=dt_timezone.utc)
+
+    def create_intakes(self, seconds_ahead, **kwargs):
+        return Intake.objects.bulk_create([
+            Intake(schedule=self.schedule, planned_at=self.now + timedelta(seconds=seconds), **kwargs)
+            for seconds in seconds_ahead
+        ])
+
+    def test_fires_at_planned_time_and_refills_by_range(self):
+        self.create_intakes([30, 90, 600, 900])
+        sender = CollectingSender()
+        dispatcher = ReminderDispatcher(sender, lookahead_minutes=10, refill_seconds=60)
+
+        dispatcher.step(self.now)
+        self.assertEqual(len(dispatcher.wheel), 3)
+
+        # Entre recargas no se consulta la base de datos si no hay nada vencido
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(dispatcher.step(self.now + timedelta(seconds=29)), 0)
+        self.assertEqual(len(queries), 0)
+
+        self.assertEqual(dispatcher.step(self.now + timedelta(seconds=30)), 1)
+        reminder = sender.sent[0]
+        self.assertEqual(reminder.planned_at, self.now + timedelta(seconds=30))
+        self.assertEqual(reminder.local_time.isoformat(), '2025-01-02T07:00:30-05:00')
+        self.assertEqual((reminder.medication, reminder.dose_amount), ('Metformina', '850mg'))
+
+        # La recarga trae solo la franja nueva (el intake de +900s)
+        dispatcher.step(self.now + timedelta(seconds=300))
+        for second in range(301, 1000):
+            dispatcher.step(self.now + timedelta(seconds=second))
+        self.assertEqual([item.planned_at for item in sender.sent],
+                         [self.now + timedelta(seconds=seconds) for seconds in (30, 90, 600, 900)])
+        self.assertEqual(dispatcher.stats['loaded'], 4)
+
+    def test_revalidates_fired_batch_before_sending(self):
+        registered, removed, kept = self.create_intakes([90, 91, 92])
+        sender = CollectingSender()
+        dispatcher = ReminderDispatcher(sender, refill_seconds=60)
+        dispatcher.step(self.now)
+        dispatcher.step(self.now + timedelta(seconds=60))
+
+        # Registrado antes de su hora y borrado (schedule redefinido) con la rueda ya cargada
+        Intake.objects.filter(id=registered.id).update(status='taken', taken_at=self.now)
+        Intake.objects.filter(id=removed.id).delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(dispatcher.step(self.now + timedelta(seconds=92)), 1)
+        self.assertEqual(len(queries), 1)
+
+        self.assertEqual([reminder.intake_id for reminder in sender.sent], [kept.id])
+        self.assertEqual(dispatcher.stats['discarded'], 2)
+
+    def test_resync_picks_up_intakes_created_after_loading(self):
+        sender = CollectingSender()
+        dispatcher = ReminderDispatcher(sender, lookahead_minutes=10, resync_seconds=60)
+        dispatcher.step(self.now)
+
+        self.create_intakes([120])
+        dispatcher.step(self.now + timedelta(seconds=60))
+        dispatcher.step(self.now + timedelta(seconds=120))
+
+        self.assertEqual(len(sender.sent), 1)
+
+    def test_resumes_from_checkpoint_with_file_sender(self):
+        self.create_intakes([30, 90])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'reminders.jsonl')
+            first = ReminderDispatcher(FileReminderSender(path))
+            first.step(self.now)
+            first.step(self.now + timedelta(seconds=60))
+            first.refill(self.now + timedelta(seconds=60))
+
+            # Un proceso nuevo retoma desde el checkpoint: envía el de +90s sin repetir el de +30s
+            second = ReminderDispatcher(FileReminderSender(path))
+            second.step(self.now + timedelta(seconds=120))
+
+            with open(path, encoding='utf-8') as output:
+                lines = [json.loads(line) for line in output]
+
+        self.assertEqual([line['planned_at'] for line in lines], [
+            (self.now + timedelta(seconds=30)).isoformat(), (self.now + timedelta(seconds=90)).isoformat()
+        ])
+        self.assertEqual(lines[0]['patient_name'], 'Paciente Recordatorio')
+
+    def test_failed_send_is_retried_and_holds_checkpoint(self):
+        intake, = self.create_intakes([30])
+        sender = FailingSender(failures=1)
+        dispatcher = ReminderDispatcher(sender, refill_seconds=60, retry_seconds=5)
+        dispatcher.step(self.now)
+
+        with self.assertLogs('api.reminders', 'ERROR'):
+            self.assertEqual(dispatcher.step(self.now + timedelta(seconds=30)), 0)
+        dispatcher.refill(self.now + timedelta(seconds=30))
+        # Un reinicio mientras espera el reintento lo vuelve a cargar
+        self.assertLess(JobCheckpoint.objects.get(name=dispatcher.CHECKPOINT_NAME).position, intake.planned_at)
+
+        self.assertEqual(dispatcher.step(self.now + timedelta(seconds=34)), 0)
+        self.assertEqual(dispatcher.step(self.now + timedelta(seconds=35)), 1)
+        self.assertEqual([reminder.intake_id for reminder in sender.sent], [intake.id])
+        self.assertEqual(dispatcher.dispatched_until, self.now + timedelta(seconds=35))
+        self.assertEqual(dispatcher.retrying, {})
+
+    def test_gives_up_after_max_send_attempts(self):
+        self.create_intakes([30])
+        dispatcher = ReminderDispatcher(FailingSender(failures=3), max_send_attempts=3, retry_seconds=1)
+        dispatcher.step(self.now)
+
+        with self.assertLogs('api.reminders', 'ERROR'):
+            for second in range(30, 40):
+                dispatcher.step(self.now + timedelta(seconds=second))
+
+        # Intentos a +30s, +31s y +33s
+        self.assertEqual(dispatcher.sender.calls, 3)
+        self.assertEqual(dispatcher.stats['failed'], 1)
+        self.assertEqual((dispatcher.retrying, len(dispatcher.wheel)), ({}, 0))
+        self.assertEqual(dispatcher.dispatched_until, self.now + timedelta(seconds=39))
+
+    def test_run_survives_step_errors(self):
+        dispatcher = ReminderDispatcher(CollectingSender())
+        clock = mock.Mock()
+        clock.monotonic.side_effect = [0, 0, 0, 10]
+        clock.time.return_value = 0.5
+
+        with mock.patch('api.reminders.time', clock), \
+                mock.patch('api.reminders.close_old_connections') as close_connections, \
+                mock.patch.object(dispatcher, 'step', side_effect=[DatabaseError('conexión perdida'), 0]) as step:
+            with self.assertLogs('api.reminders', 'ERROR'):
+                dispatcher.run(duration=1)
+
+        self.assertEqual(step.call_count, 2)
+        self.assertEqual(close_connections.call_count, 2)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Verifica con EXPLAIN que las rutas de acceso paciente/cuidador usan índices.
+    En PostgreSQL se siembran EXPLAIN_SEED_ROWS filas (1M por defecto) antes de
+    analizar los planes; en SQLite basta con el planificador sobre pocas filas.
+    """
+
+    SEED_ROWS = int(os.getenv('EXPLAIN_SEED_ROWS', 1_000_000))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_user('patient', 'plan_patient@example.com', name='Paciente Plan')
+        cls.doctor = make_user('doctor', 'plan_doctor@example.com', name='Doctor Plan')
+        cls.medication = Medication.objects.create(name='Plan', form='tablet')
+        cls.schedule = Schedule.objects.create(
+            user=cls.patient, medication=cls.medication, start_date=date(2025, 1, 1),
+            pattern='daily', dose_amount='1'
+        )
+        if connection.vendor == 'postgresql':
+            cls._seed_postgresql(cls.SEED_ROWS)
+
+    @classmethod
+    def _seed_postgresql(cls, rows):
+        """Sembrar datos masivos con generate_series (mucho más rápido que el ORM)"""
+        users = max(rows // 10, 1)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                '''INSERT INTO "Users" (password, email, name, user_type, tz, is_active, is_staff,
+                       is_superuser, is_change_password, date_joined, created_at)
+                   SELECT '!', 'seed' || g || '@example.com', 'Seed ' || g,
+                          CASE g % 3 WHEN 0 THEN 'patient' WHEN 1 THEN 'doctor' ELSE 'family' END,
+                          'UTC', true, false, false, false, now(), now()
+                   FROM generate_series(1, %s) g''', [users]
+            )
+            cursor.execute('SELECT min(id) FROM "Users" WHERE email LIKE %s', ['seed%'])
+            first_id = cursor.fetchone()[0]
+            cursor.execute(
+                '''INSERT INTO "Schedules" (medication_id, user_id, start_date, pattern, dose_amount, created_at)
+                   SELECT %s, %s + (g % %s), DATE '2025-01-01', 'daily', '1', now() - g * interval '1 minute'
+                   FROM generate_series(1, %s) g''', [cls.medication.id, first_id, users, rows]
+            )
+            cursor.execute('SELECT min(id) FROM "Schedules"')
+            first_schedule = cursor.fetchone()[0]
+            cursor.execute(
+                '''INSERT INTO "Intakes" (schedule_id, planned_at, status, created_at)
+                   SELECT %s + (g % %s), now() + g * interval '1 minute', 'planned', now()
+                   FROM generate_series(1, %s) g''', [first_schedule, rows, rows]
+            )
+            for table, column in (('DoctorPatientRelations', 'doctor_id'), ('FamilyPatientRelations', 'family_member_id')):
+                extra = ", relationship_type, can_manage_medications, can_view_medical_data, emergency_contact" \
+                    if table == 'FamilyPatientRelations' else ", specialty, notes"
+                values = ", 'other', false, true, false" if table == 'FamilyPatientRelations' else ", '', ''"
+                cursor.execute(
+                    f'''INSERT INTO "{table}" ({column}, patient_id, is_active, created_at{extra})
+                        SELECT %s + (g % %s), %s + ((g * 7) % %s), g % 10 <> 0, now(){values}
+                        FROM generate_series(1, %s) g
+                        ON CONFLICT DO NOTHING''', [first_id, users, first_id, users, rows]
+                )
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan, f"Sequential scan:\n{plan}")
+        else:
+            self.assertNotRegex(plan, r'\bSCAN\b(?! .*USING (COVERING )?INDEX)', f"Full scan:\n{plan}")
+            self.assertNotIn('TEMP B-TREE', plan, f"Sort sin índice:\n{plan}")
+
+    def test_patient_schedules_ordered_by_created_at(self):
+        self.assertUsesIndex(Schedule.objects.filter(user=self.patient).order_by('created_at'))
+
+    def test_schedule_duplicate_probe(self):
+        self.assertUsesIndex(Schedule.objects.filter(
+            user=self.patient, medication=self.medication, start_date=date(2025, 1, 1)
+        ))
+
+    def test_intakes_by_schedule_and_planned_at(self):
+        self.assertUsesIndex(Intake.objects.filter(
+            schedule=self.schedule, planned_at__gte=datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        ).order_by('planned_at'))
+
+    def test_overdue_planned_intakes(self):
+        self.assertUsesIndex(Intake.objects.filter(
+            status='planned', planned_at__lt=datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        ).order_by('planned_at'))
+
+    def test_medication_name_probe(self):
+        self.assertUsesIndex(
+            Medication.objects.annotate(name_lower=Lower('name')).filter(name_lower='plan')
+        )
+
+    def test_medication_pages_by_name(self):
+        self.assertUsesIndex(
+            Medication.objects.annotate(name_lower=Lower('name')).filter(name_lower__gt='p')
+            .order_by('name_lower', 'id')
+        )
+
+    def test_active_relations_by_patient(self):
+        self.assertUsesIndex(DoctorPatientRelation.objects.filter(patient=self.patient, is_active=True))
+        self.assertUsesIndex(FamilyPatientRelation.objects.filter(patient=self.patient, is_active=True))
+
+    def test_relations_by_caregiver(self):
+        self.assertUsesIndex(DoctorPatientRelation.objects.filter(doctor=self.doctor))
+        self.assertUsesIndex(FamilyPatientRelation.objects.filter(family_member=self.doctor))
+
+
+class PatientCaregiversViewTests(TestCase):
+    """El listado de cuidadores no debe crecer en consultas con el equipo de cuidado"""
+
+    def setUp(self):
+        self.patient = make_user('patient', 'cuidado_paciente@example.com', name='Paciente Cuidado')
+        self.created = 0
+
+    def add_caregivers(self, count):
+        for index in range(count):
+            doctor = make_user('doctor', f'cuidado_doctor{self.created}@example.com', name=f'Doctor {index}')
+            family = make_user('family', f'cuidado_familia{self.created}@example.com', name=f'Familiar {index}')
+            self.created += 1
+            UserCreationService.assign_doctor_to_patient(doctor.id, self.patient.id, specialty='General')
+            UserCreationService.assign_family_to_patient(family.id, self.patient.id, 'child')
+
+    def get_caregivers(self):
+        return self.client.get(
+            reverse('api:patient_caregivers'), headers={'User-ID': str(self.patient.id)}
+        )
+
+    def test_query_count_is_constant(self):
+        self.add_caregivers(1)
+        with CaptureQueriesContext(connection) as small_team:
+            response = self.get_caregivers()
+        self.assertEqual(response.status_code, 200)
+
+        self.add_caregivers(10)
+        with CaptureQueriesContext(connection) as large_team:
+            response = self.get_caregivers()
+
+        caregivers = response.json()['caregivers']
+        self.assertEqual(len(caregivers['doctors']), 11)
+        self.assertEqual(len(caregivers['family_members']), 11)
+        self.assertEqual(caregivers['family_members'][0]['relationship'], 'child')
+        self.assertEqual(len(large_team.captured_queries), len(small_team.captured_queries))
+        self.assertEqual(len(large_team.captured_queries), 3)
+
+
+class CaregiverPatientsViewTests(TestCase):
+    """El listado de pacientes de un cuidador no debe crecer en consultas"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor', 'panel_doctor@example.com', name='Doctor Panel')
+        self.created = 0
+
+    def add_patients(self, count):
+        for index in range(count):
+            patient = make_user('patient', f'panel_paciente{self.created}@example.com', name=f'Paciente {index}')
+            self.created += 1
+            UserCreationService.assign_doctor_to_patient(self.doctor.id, patient.id, specialty='General')
+
+    def test_query_count_is_constant(self):
+        self.add_patients(1)
+        with CaptureQueriesContext(connection) as small_panel:
+            self.client.get(reverse('api:caregiver_patients'), headers={'User-ID': str(self.doctor.id)})
+
+        self.add_patients(10)
+        with CaptureQueriesContext(connection) as large_panel:
+            response = self.client.get(
+                reverse('api:caregiver_patients'), headers={'User-ID': str(self.doctor.id)}
+            )
+
+        self.assertEqual(len(response.json()['patients']), 11)
+        self.assertEqual(response.json()['patients'][0]['specialty'], 'General')
+        self.assertEqual(len(large_panel.captured_queries), len(small_panel.captured_queries))
+
+
+class PermissionContextTests(TestCase):
+    """Los permisos se resuelven desde memoria con la misma semántica que User"""
+
+    def setUp(self):
+        access_cache.clear()
+        self.patient = make_user('patient', 'permisos_paciente@example.com', name='Paciente')
+        self.other_patient = make_user('patient', 'permisos_otro@example.com', name='Otro')
+        self.doctor = make_user('doctor', 'permisos_doctor@example.com', name='Doctor')
+        self.family = make_user('family', 'permisos_familia@example.com', name='Familiar')
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.patient.id)
+        UserCreationService.assign_family_to_patient(
+            self.family.id, self.patient.id, 'child', can_manage_medications=False
+        )
+
+    def test_matches_user_permissions(self):
+        for user in (self.patient, self.doctor, self.family):
+            context = PermissionContext(user)
+            for patient_id in (self.patient.id, str(self.other_patient.id)):
+                self.assertEqual(
+                    context.can_view_patient_data(patient_id), bool(user.can_view_patient_data(patient_id))
+                )
+                self.assertEqual(
+                    context.can_manage_schedules(patient_id), bool(user.can_manage_schedules(patient_id))
+                )
+
+    def test_relations_loaded_once(self):
+        context = PermissionContext(self.family)
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(5):
+                context.can_view_patient_data(self.patient.id)
+                context.can_manage_schedules(self.patient.id)
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertEqual(context.patient_ids, frozenset([self.patient.id]))
+
+    def test_caregiver_schedules_view_queries(self):
+        medication = Medication.objects.create(name='Losartán', form='tablet')
+        for _ in range(5):
+            Schedule.objects.create(
+                user=self.patient, medication=medication,
+                start_date=date(2025, 1, 1), pattern='daily', dose_amount='1'
+            )
+
+        url = reverse('api:patient_schedules_by_caregiver', args=[self.patient.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, headers={'User-ID': str(self.doctor.id)})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['schedules']), 5)
+        self.assertTrue(response.json()['can_manage'])
+        # usuario + relaciones + schedules con su medicamento
+        self.assertEqual(len(queries.captured_queries), 3)
+
+
+class AccessSetCacheTests(TestCase):
+    """Los conjuntos de acceso se comparten entre requests y se invalidan al cambiar relaciones"""
+
+    def setUp(self):
+        access_cache.clear()
+        access_cache.reset_stats()
+        self.patient = make_user('patient', 'acceso_paciente@example.com', name='Paciente')
+        self.other_patient = make_user('patient', 'acceso_otro@example.com', name='Otro')
+        self.doctor = make_user('doctor', 'acceso_doctor@example.com', name='Doctor')
+        self.second_doctor = make_user('doctor', 'acceso_doctor2@example.com', name='Doctor 2')
+        self.family = make_user('family', 'acceso_familia@example.com', name='Familiar')
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.patient.id)
+        UserCreationService.assign_doctor_to_patient(self.second_doctor.id, self.patient.id)
+        UserCreationService.assign_family_to_patient(self.family.id, self.patient.id, 'child')
+
+    def test_relations_shared_between_requests(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertTrue(PermissionContext(self.doctor).can_view_patient_data(self.patient.id))
+        with CaptureQueriesContext(connection) as second:
+            self.assertTrue(PermissionContext(self.doctor).can_view_patient_data(self.patient.id))
+
+        self.assertEqual(len(first.captured_queries), 1)
+        self.assertEqual(len(second.captured_queries), 0)
+        stats = access_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_assign_and_remove_invalidate(self):
+        self.assertEqual(set(access_cache.get_relations(self.doctor)), {self.patient.id})
+
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.other_patient.id)
+        self.assertEqual(set(access_cache.get_relations(self.doctor)), {self.patient.id, self.other_patient.id})
+
+        UserCreationService.remove_doctor_from_patient(self.doctor.id, self.patient.id)
+        self.assertEqual(set(access_cache.get_relations(self.doctor)), {self.other_patient.id})
+
+        UserCreationService.remove_family_from_patient(self.family.id, self.patient.id)
+        self.assertEqual(access_cache.get_relations(self.family), {})
+
+    def test_relation_save_updates_manage_flag(self):
+        access_cache.get_relations(self.doctor)
+        self.assertFalse(PermissionContext(self.family).can_manage_schedules(self.patient.id))
+
+        relation = FamilyPatientRelation.objects.get(family_member=self.family)
+        relation.can_manage_medications = True
+        relation.save()
+
+        self.assertTrue(PermissionContext(self.family).can_manage_schedules(self.patient.id))
+        # El conjunto del doctor no se invalida por el cambio del familiar
+        access_cache.get_relations(self.doctor)
+        stats = access_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 3))
+
+
+class ActingUserResolutionTests(TestCase):
+    """El usuario del header User-ID se consulta una sola vez por request"""
+
+    def setUp(self):
+        self.patient = make_user('patient', 'header_paciente@example.com', name='Paciente')
+
+    def test_user_resolved_once(self):
+        request = RequestFactory().get('/', headers={'User-ID': str(self.patient.id)})
+        with CaptureQueriesContext(connection) as queries:
+            first = get_acting_user(request)
+            second = get_acting_user(request)
+
+        self.assertIs(first, second)
+        self.assertEqual(len(queries.captured_queries), 1)
+
+    def test_authenticated_user_wins_over_memoized_header(self):
+        doctor = make_user('doctor', 'header_doctor@example.com', name='Doctor')
+        request = RequestFactory().get('/', headers={'User-ID': str(self.patient.id)})
+        self.assertEqual(get_acting_user(request), self.patient)
+
+        drf_request = Request(request)
+        drf_request.user = doctor
+        self.assertEqual(get_acting_user(drf_request), doctor)
+
+    def test_invalid_header(self):
+        for headers, message in (({}, 'User-ID header requerido'), ({'User-ID': 'abc'}, 'Usuario no encontrado')):
+            with self.assertRaisesMessage(ValueError, message):
+                get_acting_user(RequestFactory().get('/', headers=headers))
+
+    def test_user_permissions_view_single_user_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('api:user_permissions'), headers={'User-ID': str(self.patient.id)}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        user_lookups = [query for query in queries.captured_queries if 'FROM "Users" WHERE' in query['sql']]
+        self.assertEqual(len(user_lookups), 1)
+
+
+class ScheduleBulkCreateTests(TestCase):
+    """La creación en lote valida por conjuntos y reporta resultados por ítem"""
+
+    def setUp(self):
+        access_cache.clear()
+        self.doctor = make_user('doctor', 'lote_doctor@example.com', name='Doctor')
+        self.family = make_user('family', 'lote_familia@example.com', name='Familiar')
+        self.patient = make_user('patient', 'lote_paciente@example.com', name='Paciente')
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.patient.id)
+        UserCreationService.assign_family_to_patient(self.family.id, self.patient.id, 'child')
+        self.medications = [
+            Medication.objects.create(name=f'Medicamento {index}', form='tablet') for index in range(15)
+        ]
+
+    def post_bulk(self, schedules, user=None):
+        return self.client.post(
+            reverse('api:schedule_bulk_create'),
+            data=json.dumps({'patient_id': self.patient.id, 'schedules': schedules}),
+            content_type='application/json',
+            headers={'User-ID': str((user or self.doctor).id)},
+        )
+
+    def make_items(self, medications, start_date='2025-01-01'):
+        return [
+            {'medication_id': medication.id, 'start_date': start_date, 'pattern': 'daily', 'dose_amount': '1'}
+            for medication in medications
+        ]
+
+    def test_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as small_batch:
+            response = self.post_bulk(self.make_items(self.medications[:2]))
+        self.assertEqual(response.status_code, 201)
+
+        access_cache.clear()
+        with CaptureQueriesContext(connection) as large_batch:
+            response = self.post_bulk(self.make_items(self.medications[2:], start_date='2025-02-01'))
+
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (13, 0))
+        self.assertEqual(Schedule.objects.filter(user=self.patient).count(), 15)
+        self.assertEqual(len(large_batch.captured_queries), len(small_batch.captured_queries))
+        # usuario + relaciones + paciente + medicamentos + duplicados + insert (con su savepoint)
+        self.assertLessEqual(len(large_batch.captured_queries), 8)
+
+    def test_invalid_json(self):
+        response = self.client.post(
+            reverse('api:schedule_bulk_create'), data='{no es json', content_type='application/json',
+            headers={'User-ID': str(self.doctor.id)},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'JSON inválido')
+
+    def test_per_item_results(self):
+        first, second, third = self.medications[:3]
+        Schedule.objects.create(
+            user=self.patient, medication=first, start_date=date(2025, 1, 1), pattern='daily', dose_amount='1'
+        )
+        items = self.make_items([first, second, second, third]) + [
+            {'medication_id': 999999, 'start_date': '2025-01-01', 'pattern': 'daily', 'dose_amount': '1'},
+            {'medication_id': third.id, 'start_date': '2025-02-30', 'pattern': 'daily', 'dose_amount': '1'},
+            {'medication_id': third.id, 'pattern': 'daily', 'dose_amount': '1'},
+        ]
+
+        response = self.post_bulk(items)
+
+        results = response.json()['results']
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['success'] for result in results], [False, True, False, True, False, False, False])
+        self.assertIn('Ya existe', results[0]['error'])
+        self.assertIn('Ya existe', results[2]['error'])
+        self.assertEqual(results[4]['error'], 'Medicamento no encontrado')
+        self.assertEqual(results[5]['error'], 'Datos inválidos')
+        self.assertEqual(results[6]['error'], 'Campo start_date es requerido')
+        self.assertEqual(results[1]['schedule']['medication']['name'], second.name)
+        self.assertEqual(Schedule.objects.filter(user=self.patient).count(), 3)
+
+    def test_service_reuses_request_permission_context(self):
+        # La vista ya cargó las relaciones del doctor al verificar permisos
+        permissions = PermissionContext(self.doctor)
+        self.assertTrue(permissions.can_manage_schedules(self.patient.id))
+
+        with mock.patch('api.permissions.access_cache.get_relations') as get_relations:
+            results = UserCreationService.create_schedules_bulk(
+                self.patient.id, self.make_items(self.medications[:1]),
+                created_by_user_id=self.doctor, permission_context=permissions
+            )
+
+        self.assertTrue(results[0]['success'])
+        get_relations.assert_not_called()
+
+    def test_requires_manage_permission(self):
+        response = self.post_bulk(self.make_items(self.medications[:1]), user=self.family)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Schedule.objects.exists())
+
+
+class CaregiverBulkAssignmentTests(TestCase):
+    """Las asignaciones en lote usan un número fijo de consultas y validan tipos por conjuntos"""
+
+    def setUp(self):
+        access_cache.clear()
+        self.doctor = make_user('doctor', 'panel_origen@example.com', name='Doctor origen')
+        self.new_doctor = make_user('doctor', 'panel_destino@example.com', name='Doctor destino')
+        self.family = make_user('family', 'panel_familia@example.com', name='Familiar')
+        self.patients = [
+            make_user('patient', f'panel_paciente{index}@example.com', name=f'Paciente {index}')
+            for index in range(30)
+        ]
+        DoctorPatientRelation.objects.bulk_create([
+            DoctorPatientRelation(doctor=self.doctor, patient=patient) for patient in self.patients
+        ])
+
+    def send(self, method, caregiver_type, items_field, items, user=None):
+        return getattr(self.client, method)(
+            reverse('api:caregiver_bulk_assignment'),
+            data=json.dumps({'caregiver_type': caregiver_type, items_field: items}),
+            content_type='application/json',
+            headers={'User-ID': str((user or self.doctor).id)},
+        )
+
+    def pairs(self, caregiver, patients, **fields):
+        return [{'caregiver_id': caregiver.id, 'patient_id': patient.id, **fields} for patient in patients]
+
+    def test_panel_transfer_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as small_batch:
+            self.send('post', 'doctor', 'assignments', self.pairs(self.new_doctor, self.patients[:2]))
+
+        access_cache.clear()
+        with CaptureQueriesContext(connection) as large_batch:
+            response = self.send('post', 'doctor', 'assignments', self.pairs(self.new_doctor, self.patients[2:]))
+
+        self.assertEqual(response.json()['created'], 28)
+        self.assertEqual(len(large_batch.captured_queries), len(small_batch.captured_queries))
+        self.assertEqual(DoctorPatientRelation.objects.filter(doctor=self.new_doctor).count(), 30)
+
+        access_cache.clear()
+        with CaptureQueriesContext(connection) as removal:
+            response = self.send('delete', 'doctor', 'relations', self.pairs(self.doctor, self.patients))
+
+        self.assertEqual(response.json()['deleted_count'], 30)
+        self.assertFalse(DoctorPatientRelation.objects.filter(doctor=self.doctor).exists())
+        # usuario + relaciones + pares existentes + conteo agrupado + select/delete (con su savepoint)
+        self.assertLessEqual(len(removal.captured_queries), 8)
+
+    def test_type_validation_and_existing_pairs(self):
+        items = self.pairs(self.doctor, self.patients[:1]) + [
+            {'caregiver_id': self.family.id, 'patient_id': self.patients[1].id},
+            {'caregiver_id': self.new_doctor.id, 'patient_id': self.new_doctor.id},
+            {'caregiver_id': 999999, 'patient_id': self.patients[1].id},
+            {'patient_id': self.patients[1].id},
+            {'caregiver_id': self.new_doctor.id, 'patient_id': self.patients[1].id},
+        ]
+
+        results = UserCreationService.assign_caregivers_bulk('doctor', items)
+
+        self.assertEqual([result['success'] for result in results], [True, False, False, False, False, True])
+        self.assertFalse(results[0]['created'])
+        self.assertTrue(results[5]['created'])
+        self.assertEqual(results[1]['error'], "El usuario debe ser de tipo 'doctor'")
+        self.assertEqual(results[2]['error'], "El paciente debe ser de tipo 'patient'")
+        self.assertEqual(results[3]['error'], 'Usuario no encontrado: 999999')
+        self.assertEqual(DoctorPatientRelation.objects.count(), 31)
+
+    def test_concurrent_insert_is_reported_as_existing(self):
+        items = self.pairs(self.new_doctor, self.patients[:2], specialty=None, notes=None)
+        read_existing = UserCreationService._existing_relations
+
+        def existing_then_concurrent_insert(*args):
+            existing = read_existing(*args)
+            if not DoctorPatientRelation.objects.filter(doctor=self.new_doctor).exists():
+                # Otro request asigna el primer par entre la lectura y el insert
+                DoctorPatientRelation.objects.create(doctor=self.new_doctor, patient=self.patients[0])
+            return existing
+
+        with mock.patch.object(UserCreationService, '_existing_relations', side_effect=existing_then_concurrent_insert):
+            results = UserCreationService.assign_caregivers_bulk('doctor', items)
+
+        self.assertEqual([result['created'] for result in results], [False, True])
+        relations = DoctorPatientRelation.objects.filter(doctor=self.new_doctor)
+        self.assertEqual(relations.count(), 2)
+        self.assertEqual(set(relations.values_list('specialty', 'notes')), {('', '')})
+
+    def test_family_assignment_invalidates_access(self):
+        self.assertEqual(PermissionContext(self.family).patient_ids, frozenset())
+
+        response = self.send('post', 'family', 'assignments', self.pairs(
+            self.family, self.patients[:3], relationship_type='child', can_manage_medications=True
+        ))
+
+        self.assertEqual(response.status_code, 200)
+        permissions = PermissionContext(self.family)
+        self.assertEqual(permissions.patient_ids, frozenset(patient.id for patient in self.patients[:3]))
+        self.assertTrue(permissions.can_manage_schedules(self.patients[0].id))
+
+    def test_only_doctor_is_kept(self):
+        results = UserCreationService.remove_caregivers_bulk('doctor', self.pairs(self.doctor, self.patients[:2]))
+
+        self.assertEqual([result['success'] for result in results], [False, False])
+        self.assertIn('único doctor', results[0]['error'])
+        self.assertEqual(DoctorPatientRelation.objects.count(), 30)
+
+    def test_requires_access_to_every_patient(self):
+        other_patient = make_user('patient', 'panel_ajeno@example.com', name='Ajeno')
+
+        response = self.send('post', 'doctor', 'assignments', self.pairs(
+            self.new_doctor, [self.patients[0], other_patient]
+        ))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['forbidden_indexes'], [1])
+        self.assertFalse(DoctorPatientRelation.objects.filter(doctor=self.new_doctor).exists())
+
+
+class IntakeEventIngestionTests(TestCase):
+    """Los eventos de toma se aplican en lote, de forma idempotente y con un número fijo de consultas"""
+
+    def setUp(self):
+        access_cache.clear()
+        self.patient = make_user('patient', 'tomas_paciente@example.com', name='Paciente')
+        self.other_patient = make_user('patient', 'tomas_otro@example.com', name='Otro paciente')
+        self.family = make_user('family', 'tomas_familia@example.com', name='Familiar')
+        UserCreationService.assign_family_to_patient(self.family.id, self.patient.id, 'child')
+        medication = Medication.objects.create(name='Metformina', form='tablet')
+        self.schedule = Schedule.objects.create(
+            user=self.patient, medication=medication, start_date=date(2025, 1, 1),
+            pattern='daily', dose_amount='1'
+        )
+        other_schedule = Schedule.objects.create(
+            user=self.other_patient, medication=medication, start_date=date(2025, 1, 1),
+            pattern='daily', dose_amount='1'
+        )
+        start = datetime(2025, 1, 1, 13, 0, tzinfo=dt_timezone.utc)
+        self.intakes = Intake.objects.bulk_create([
+            Intake(schedule=self.schedule, planned_at=start + timedelta(days=day)) for day in range(40)
+        ])
+        self.other_intake = Intake.objects.create(schedule=other_schedule, planned_at=start)
+
+    def post_events(self, events, user=None):
+        return self.client.post(
+            reverse('api:intake_events'),
+            data=json.dumps({'events': events}),
+            content_type='application/json',
+            headers={'User-ID': str((user or self.patient).id)},
+        )
+
+    def taken(self, intake):
+        return {
+            'intake_id': intake.id, 'status': 'taken',
+            'taken_at': (intake.planned_at + timedelta(minutes=5)).isoformat()
+        }
+
+    def test_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as small_batch:
+            self.post_events([self.taken(intake) for intake in self.intakes[:2]])
+
+        with CaptureQueriesContext(connection) as large_batch:
+            response = self.post_events([self.taken(intake) for intake in self.intakes[2:]])
+
+        self.assertEqual(response.json()['updated'], 38)
+        self.assertEqual(len(large_batch.captured_queries), len(small_batch.captured_queries))
+        self.assertEqual(Intake.objects.filter(status='taken').count(), 40)
+
+    def test_resending_is_idempotent(self):
+        events = [self.taken(intake) for intake in self.intakes[:5]]
+        self.post_events(events)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_events(events)
+
+        body = response.json()
+        self.assertEqual((body['updated'], body['unchanged']), (0, 5))
+        self.assertFalse(any('UPDATE' in query['sql'] for query in queries.captured_queries))
+
+    def test_identifies_by_schedule_and_planned_at(self):
+        first, second = self.intakes[:2]
+        events = [
+            {'schedule_id': self.schedule.id, 'planned_at': first.planned_at.isoformat(), 'status': 'skipped'},
+            {'schedule_id': self.schedule.id, 'planned_at': '2025-01-02T13:00:00', 'status': 'missed'},
+            {'intake_id': second.id, 'status': 'taken', 'taken_at': '2025-01-02T13:05:00Z'},
+        ]
+
+        results = self.post_events(events).json()['results']
+
+        # El último evento de cada intake es el que se aplica
+        self.assertEqual([result['updated'] for result in results], [True, False, True])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, first.taken_at), ('skipped', None))
+        self.assertEqual(second.status, 'taken')
+        self.assertEqual(second.taken_at, datetime(2025, 1, 2, 13, 5, tzinfo=dt_timezone.utc))
+        self.assertEqual(second.updated_by, self.patient.id)
+
+    def test_per_event_errors(self):
+        events = [
+            self.taken(self.other_intake),
+            {'intake_id': 999999, 'status': 'missed'},
+            {'intake_id': self.intakes[0].id, 'status': 'taken'},
+            {'intake_id': self.intakes[0].id, 'status': 'planned'},
+            {'status': 'missed'},
+            {'intake_id': self.intakes[1].id, 'status': 'taken', 'taken_at': 'ayer'},
+            {'intake_id': self.intakes[2].id, 'status': 'missed'},
+        ]
+
+        response = self.post_events(events, user=self.family)
+
+        results = response.json()['results']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['success'] for result in results], [False] * 6 + [True])
+        self.assertIn('No tienes permisos', results[0]['error'])
+        self.assertEqual(results[1]['error'], 'Intake no encontrado')
+        self.assertIn('taken_at es requerido', results[2]['error'])
+        self.assertIn('Estado no válido', results[3]['error'])
+        self.assertIn('Se requiere intake_id', results[4]['error'])
+        self.assertEqual(results[5]['error'], 'Datos inválidos')
+        self.other_intake.refresh_from_db()
+        self.assertEqual(self.other_intake.status, 'planned')
+
+    def test_sweeper_between_read_and_write_keeps_rollup(self):
+        intake = self.intakes[0]
+        ingestor = IntakeEventIngestor()
+        resolve = ingestor.resolve_intakes
+
+        def resolve_then_sweep(keys):
+            resolved = resolve(keys)
+            # El sweeper marca el intake como perdido antes de que la ingesta escriba
+            MissedIntakeSweeper(grace_minutes=60).sweep(now=intake.planned_at + timedelta(minutes=61), full=True)
+            return resolved
+
+        ingestor.resolve_intakes = resolve_then_sweep
+        results = ingestor.ingest(self.patient, [self.taken(intake)])
+
+        self.assertTrue(results[0]['updated'])
+        intake.refresh_from_db()
+        self.assertEqual(intake.status, 'taken')
+        row = DailyAdherence.objects.get(patient=self.patient, date=date(2025, 1, 1))
+        self.assertEqual((row.taken, row.missed), (1, 0))
+
+    def test_concurrent_resend_counts_once(self):
+        events = [self.taken(intake) for intake in self.intakes[:3]]
+        first = IntakeEventIngestor()
+        resolve = first.resolve_intakes
+        retried = []
+
+        def resolve_then_retry(keys):
+            resolved = resolve(keys)
+            # El cliente reenvía el mismo lote y el reintento se aplica primero
+            retried.extend(IntakeEventIngestor().ingest(self.patient, events))
+            return resolved
+
+        first.resolve_intakes = resolve_then_retry
+        results = first.ingest(self.patient, events)
+
+        self.assertEqual([result['updated'] for result in retried], [True] * 3)
+        self.assertEqual([result['updated'] for result in results], [False] * 3)
+        rows = DailyAdherence.objects.filter(patient=self.patient)
+        self.assertEqual(sum(rows.values_list('taken', flat=True)), 3)
+
+
+class AdherenceAnalyticsTests(TestCase):
+    """Métricas de adherencia con agregados agrupados en la base de datos"""
+
+    def setUp(self):
+        self.patient = make_user('patient', 'adherencia_paciente@example.com', name='Paciente')
+        self.other_patient = make_user('patient', 'adherencia_otro@example.com', name='Otro')
+        self.now = datetime(2025, 3, 1, 12, 0, tzinfo=dt_timezone.utc)
+        self.aspirin = Medication.objects.create(name='Aspirina', form='tablet')
+        self.metformin = Medication.objects.create(name='Metformina', form='tablet')
+        aspirin_schedule = self.create_schedule(self.patient, self.aspirin)
+        metformin_schedule = self.create_schedule(self.patient, self.metformin)
+
+        # Aspirina: 10 días (taken x7 con 10 min de retraso, missed x2, skipped x1)
+        statuses = ['taken'] * 3 + ['missed', 'skipped'] + ['taken'] * 4 + ['missed']
+        self.create_intakes(aspirin_schedule, statuses, start_days_ago=10, delay_minutes=10)
+        # Metformina: hace 40 días (fuera de la ventana de 30) y los últimos 3 días tomados a tiempo
+        self.create_intakes(metformin_schedule, ['missed'] * 5, start_days_ago=40)
+        self.create_intakes(metformin_schedule, ['taken'] * 3, start_days_ago=3, delay_minutes=-5)
+        # Intake futuro: no cuenta como planificado
+        self.create_intakes(metformin_schedule, ['planned'], start_days_ago=-1)
+        self.create_intakes(self.create_schedule(self.other_patient, self.aspirin), ['taken', 'missed'], start_days_ago=2,
+                            delay_minutes=0)
+
+    def create_schedule(self, patient, medication):
+        return Schedule.objects.create(
+            user=patient, medication=medication, start_date=date(2025, 1, 1), pattern='daily', dose_amount='1'
+        )
+
+    def create_intakes(self, schedule, statuses, start_days_ago, delay_minutes=0):
+        intakes = []
+        for offset, status in enumerate(statuses):
+            planned_at = self.now - timedelta(days=start_days_ago - offset)
+            taken_at = planned_at + timedelta(minutes=delay_minutes) if status == 'taken' else None
+            intakes.append(Intake(schedule=schedule, planned_at=planned_at, status=status, taken_at=taken_at))
+        Intake.objects.bulk_create(intakes)
+
+    def test_by_patient_in_one_query(self):
+        with self.assertNumQueries(1):
+            metrics = AdherenceAnalytics(now=self.now).by_patient([self.patient.id, self.other_patient.id], days=30)
+
+        self.assertEqual(metrics[self.patient.id], {
+            'planned': 13, 'taken': 10, 'missed': 2, 'skipped': 1, 'adherence': round(10 / 13, 4)
+        })
+        self.assertEqual(metrics[self.other_patient.id]['adherence'], 0.5)
+
+    def test_sliding_windows_in_one_query(self):
+        with self.assertNumQueries(1):
+            windows = AdherenceAnalytics(now=self.now).sliding_windows(self.patient.id, windows=(7, 30, 90))
+
+        self.assertEqual(windows[7]['planned'], 10)
+        self.assertEqual(windows[30]['taken'], 10)
+        self.assertEqual(windows[90]['missed'], 7)
+        self.assertEqual(windows[90]['adherence'], round(10 / 18, 4))
+
+    def test_by_medication(self):
+        rows = AdherenceAnalytics(now=self.now).by_medication(self.patient.id, days=30)
+
+        self.assertEqual([row['medication_name'] for row in rows], ['Aspirina', 'Metformina'])
+        self.assertEqual(rows[0]['adherence'], 0.7)
+        self.assertEqual(rows[1]['adherence'], 1.0)
+
+    def test_lateness_and_streaks(self):
+        report = AdherenceAnalytics(now=self.now, use_numpy=False).patient_report(self.patient.id, days=30)
+
+        lateness = report['lateness']
+        self.assertEqual(lateness['count'], 10)
+        self.assertEqual(lateness['buckets']['early'], 3)
+        self.assertEqual(lateness['buckets']['0-15'], 7)
+        self.assertEqual(lateness['percentiles']['p50'], 10.0)
+        self.assertEqual(lateness['mean'], 5.5)
+        # Las tomas de ambos medicamentos se intercalan por planned_at
+        self.assertEqual(report['streaks'], {'current': 1, 'longest': 6})
+
+
+class AdherenceDistributionTests(SimpleTestCase):
+    """La ruta NumPy y la ruta en Python producen los mismos resultados"""
+
+    MINUTES = [-12.5, 0, 3, 14.99, 15, 29, 45.5, 61, 119.9, 120, 240, 7, 7, 7]
+    FLAGS = [True, True, False, True, True, True, False, False, True, True]
+
+    def test_pure_python_percentiles(self):
+        distribution = AdherenceAnalytics(use_numpy=False).lateness_distribution([10, 20, 30, 40])
+
+        self.assertEqual(distribution['percentiles'], {'p50': 25.0, 'p90': 37.0, 'p99': 39.7})
+        self.assertEqual(distribution['buckets']['15-30'], 1)
+
+    def test_empty_inputs(self):
+        analytics = AdherenceAnalytics(use_numpy=False)
+        self.assertEqual(analytics.lateness_distribution([])['count'], 0)
+        self.assertEqual(analytics.streaks([]), {'current': 0, 'longest': 0})
+        self.assertEqual(analytics.streaks([False, False]), {'current': 0, 'longest': 0})
+
+    @skipUnless(adherence.np is not None, 'NumPy no está instalado')
+    def test_numpy_matches_python(self):
+        python_path = AdherenceAnalytics(use_numpy=False)
+        numpy_path = AdherenceAnalytics(use_numpy=True)
+
+        self.assertEqual(
+            numpy_path.lateness_distribution(self.MINUTES), python_path.lateness_distribution(self.MINUTES)
+        )
+        for flags in (self.FLAGS, self.FLAGS[:-2], [False, True]):
+            self.assertEqual(numpy_path.streaks(flags), python_path.streaks(flags))
+
+
+class DailyAdherenceRollupTests(TestCase):
+    """El resumen diario se mantiene incrementalmente y coincide con una reconstrucción completa"""
+
+    def setUp(self):
+        # 20:00 en Bogotá es 01:00 UTC del día siguiente: la fecha del resumen es la local
+        self.patient = make_user('patient', 'resumen_paciente@example.com', name='Paciente', tz='America/Bogota')
+        self.medication = Medication.objects.create(name='Enalapril', form='tablet')
+        self.schedule = Schedule.objects.create(
+            user=self.patient, medication=self.medication, start_date=date(2025, 1, 1),
+            pattern='twice_daily', dose_amount='10mg'
+        )
+        self.now = datetime(2025, 1, 1, 5, 0, tzinfo=dt_timezone.utc)
+        IntakeMaterializer(horizon_days=3).materialize(now=self.now)
+
+    def daily(self):
+        return list(
+            DailyAdherence.objects.order_by('date')
+            .values_list('date', 'planned', 'taken', 'missed', 'skipped')
+        )
+
+    def test_materializer_counts_planned_by_local_date(self):
+        self.assertEqual(self.daily(), [
+            (date(2025, 1, 1), 2, 0, 0, 0),
+            (date(2025, 1, 2), 2, 0, 0, 0),
+            (date(2025, 1, 3), 2, 0, 0, 0),
+        ])
+
+    def test_ingestion_and_sweeper_update_counters(self):
+        first, second, third = Intake.objects.order_by('planned_at')[:3]
+        sweeper = MissedIntakeSweeper(grace_minutes=60)
+        sweeper.sweep(now=third.planned_at + timedelta(hours=2))
+        self.assertEqual(self.daily()[:2], [(date(2025, 1, 1), 2, 0, 2, 0), (date(2025, 1, 2), 2, 0, 1, 0)])
+
+        ingestor = IntakeEventIngestor()
+        events = [
+            {'intake_id': first.id, 'status': 'taken', 'taken_at': first.planned_at.isoformat()},
+            {'intake_id': second.id, 'status': 'skipped'},
+        ]
+        ingestor.ingest(self.patient, events)
+        # Reenviar el lote no vuelve a contar
+        ingestor.ingest(self.patient, events)
+
+        self.assertEqual(self.daily()[0], (date(2025, 1, 1), 2, 1, 0, 1))
+
+        incremental = self.daily()
+        DailyAdherenceRollup.rebuild()
+        self.assertEqual(self.daily(), incremental)
+
+    def test_rebuild_limited_to_dates(self):
+        DailyAdherence.objects.update(planned=99)
+
+        rows = DailyAdherenceRollup.rebuild(since=date(2025, 1, 2), until=date(2025, 1, 3))
+
+        self.assertEqual(rows, 1)
+        self.assertEqual([row[1] for row in self.daily()], [99, 2, 99])
+
+    def test_dashboard_reads_rollup(self):
+        # Las dos tomas del 1 de enero (hora local)
+        Intake.objects.filter(planned_at__lt=datetime(2025, 1, 2, 12, tzinfo=dt_timezone.utc)).update(status='taken')
+        DailyAdherenceRollup.rebuild()
+        analytics = AdherenceAnalytics(now=datetime(2025, 1, 4, 12, tzinfo=dt_timezone.utc), use_rollup=True)
+
+        # Zona horaria del paciente (una vez por instancia) + agregados
+        with self.assertNumQueries(2):
+            windows = analytics.sliding_windows(self.patient.id, windows=(1, 7))
+        with self.assertNumQueries(1):
+            analytics.sliding_windows(self.patient.id, windows=(1, 7))
+
+        # Días completos: ayer (3 de enero) para la ventana de 1 día; los tres días para la de 7
+        self.assertEqual(windows[1]['planned'], 2)
+        self.assertEqual(windows[1]['taken'], 0)
+        self.assertEqual(windows[7]['planned'], 6)
+        self.assertEqual(windows[7]['adherence'], round(2 / 6, 4))
+        self.assertEqual(analytics.by_patient([self.patient.id], 7)[self.patient.id]['taken'], 2)
+        self.assertEqual(analytics.by_medication(self.patient.id, 7)[0]['medication_name'], 'Enalapril')
+
+    def test_rollup_window_ends_at_patient_local_today(self):
+        DailyAdherenceRollup.rebuild()
+        # 4 de enero 03:00 UTC es todavía 3 de enero en Bogotá: el 3 no es un día completo
+        analytics = AdherenceAnalytics(now=datetime(2025, 1, 4, 3, tzinfo=dt_timezone.utc), use_rollup=True)
+
+        self.assertEqual(analytics.sliding_windows(self.patient.id, windows=(1, 7))[7]['planned'], 4)
+        self.assertEqual(analytics.by_patient([self.patient.id], 7)[self.patient.id]['planned'], 4)
+        self.assertEqual(analytics.by_medication(self.patient.id, 1)[0]['planned'], 2)
+
+
+class ScheduleChangeTests(TestCase):
+    """Editar o borrar un schedule mantiene coherentes sus intakes, recordatorios y DailyAdherence"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor', 'cambio_doctor@example.com', name='Doctor')
+        self.patient = make_user('patient', 'cambio_paciente@example.com', name='Paciente', tz='America/Bogota')
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.patient.id)
+        self.today = timezone.now().date()
+        self.schedule = Schedule.objects.create(
+            user=self.patient, medication=Medication.objects.create(name='Atorvastatina', form='tablet'),
+            start_date=self.today - timedelta(days=5), pattern='daily', dose_amount='20mg'
+        )
+        IntakeMaterializer(horizon_days=14).materialize()
+
+    def daily(self):
+        return list(
+            DailyAdherence.objects.filter(planned__gt=0).order_by('date', 'medication_id')
+            .values_list('date', 'medication_id', 'planned', 'taken', 'missed', 'skipped')
+        )
+
+    def assert_rollup_matches_rebuild(self):
+        incremental = self.daily()
+        DailyAdherenceRollup.rebuild()
+        self.assertEqual(self.daily(), incremental)
+
+    def test_redefined_schedule_replaces_future_intakes(self):
+        self.assertGreater(Intake.objects.filter(schedule=self.schedule).count(), 10)
+        other = Medication.objects.create(name='Rosuvastatina', form='tablet')
+        end_date = self.today + timedelta(days=3)
+
+        UserCreationService.update_schedule(
+            self.schedule.id, self.doctor.id, pattern='twice_daily', end_date=end_date, medication_id=other.id
+        )
+
+        now = timezone.now()
+        future = list(Intake.objects.filter(schedule=self.schedule, planned_at__gte=now).order_by('planned_at'))
+        tz = get_zone('America/Bogota')
+        self.assertTrue(future)
+        self.assertTrue(all(intake.planned_at.astimezone(tz).date() <= end_date for intake in future))
+        self.assertEqual({intake.planned_at.astimezone(tz).hour for intake in future}, {8, 20})
+
+        reminders = list(ReminderDispatcher(CollectingSender()).reminders_between(now, now + timedelta(days=30)))
+        self.assertEqual([reminder.intake_id for reminder in reminders], [intake.id for intake in future])
+        self.assertEqual({reminder.medication for reminder in reminders}, {'Rosuvastatina'})
+        self.assert_rollup_matches_rebuild()
+
+    def test_deleting_schedule_subtracts_its_intakes(self):
+        other = Schedule.objects.create(
+            user=self.patient, medication=Medication.objects.create(name='Aspirina', form='tablet'),
+            start_date=self.today - timedelta(days=5), pattern='daily', dose_amount='100mg'
+        )
+        IntakeMaterializer(horizon_days=14).materialize()
+        first = Intake.objects.filter(schedule=self.schedule).order_by('planned_at')[0]
+        IntakeEventIngestor().ingest(self.patient, [{
+            'intake_id': first.id, 'status': 'taken', 'taken_at': first.planned_at.isoformat()
+        }])
+
+        UserCreationService.delete_schedule(self.schedule.id, self.doctor.id)
+
+        self.assertEqual(
+            {row[1] for row in self.daily()}, {other.medication_id}
+        )
+        self.assertEqual(
+            sum(DailyAdherence.objects.values_list('planned', flat=True)),
+            Intake.objects.filter(schedule=other).count()
+        )
+        self.assertEqual(sum(DailyAdherence.objects.values_list('taken', flat=True)), 0)
+        self.assert_rollup_matches_rebuild()
+
+    def test_dose_change_keeps_intakes(self):
+        intake_ids = set(Intake.objects.filter(schedule=self.schedule).values_list('id', flat=True))
+
+        UserCreationService.update_schedule(self.schedule.id, self.doctor.id, dose_amount='40mg')
+
+        self.assertEqual(set(Intake.objects.filter(schedule=self.schedule).values_list('id', flat=True)), intake_ids)
+
+
+class MedicationManagementViewTests(TestCase):
+    """Listado paginado por cursor y unicidad del nombre sin distinguir mayúsculas"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor', 'formulario_doctor@example.com', name='Doctor')
+        Medication.objects.bulk_create([
+            Medication(name=name, form='tablet')
+            for name in ('ibuprofeno', 'Acetaminofén', 'Losartán', 'amoxicilina', 'Metformina')
+        ])
+
+    def post_medication(self, name):
+        return self.client.post(
+            reverse('api:medication_management'),
+            data=json.dumps({'name': name, 'form': 'capsule'}),
+            content_type='application/json',
+            headers={'User-ID': str(self.doctor.id)},
+        )
+
+    def test_pages_follow_case_insensitive_order(self):
+        url = reverse('api:medication_management')
+        names, cursor = [], None
+        while True:
+            params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+            with CaptureQueriesContext(connection) as queries:
+                body = self.client.get(url, params).json()
+            self.assertLessEqual(body['count'], 2)
+            # El COUNT completo solo en la primera página
+            self.assertEqual(body.get('total'), None if cursor else 5)
+            self.assertEqual(any('COUNT(' in query['sql'] for query in queries.captured_queries), not cursor)
+            names += [medication['name'] for medication in body['medications']]
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(names, ['Acetaminofén', 'amoxicilina', 'ibuprofeno', 'Losartán', 'Metformina'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('api:medication_management'), {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_duplicate_name_ignores_case_and_spaces(self):
+        response = self.post_medication('  IBUPROFENO ')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.post_medication('Ibuprofeno   Forte')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['medication']['name'], 'Ibuprofeno Forte')
+
+    def test_unique_index_rejects_race(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Medication.objects.create(name='METFORMINA', form='tablet')
+
+
+class MedicationSearchTests(TestCase):
+    """Autocompletado por prefijo y similitud con el índice en memoria"""
+
+    def setUp(self):
+        Medication.objects.bulk_create([
+            Medication(name=name, form='tablet')
+            for name in ('Amoxicilina', 'Amlodipino', 'Ambroxol jarabe', 'Losartán', 'Metformina', 'Clavulanato')
+        ])
+        medication_index.invalidate()
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('api:medication_search'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [medication['name'] for medication in response.json()['medications']]
+
+    def test_prefix_matches_in_alphabetical_order(self):
+        self.assertEqual(self.search('am'), ['Ambroxol jarabe', 'Amlodipino', 'Amoxicilina'])
+        self.assertEqual(self.search('AM', limit=2), ['Ambroxol jarabe', 'Amlodipino'])
+
+    def test_typos_fall_back_to_trigram_similarity(self):
+        self.assertEqual(self.search('metformna'), ['Metformina'])
+        self.assertEqual(self.search('jarabe'), ['Ambroxol jarabe'])
+
+    def test_new_medications_are_searchable(self):
+        self.assertEqual(self.search('ibu'), [])
+        Medication.objects.create(name='Ibuprofeno', form='tablet')
+        self.assertEqual(self.search('ibu'), ['Ibuprofeno'])
+
+    def test_query_is_required(self):
+        response = self.client.get(reverse('api:medication_search'), {'q': '  '})
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_without_database(self):
+        index = MedicationSearchIndex()
+        index.build([(1, 'Losartán', 'tablet'), (2, 'Losartán potásico', 'tablet'), (3, 'Lovastatina', 'tablet')])
+
+        self.assertEqual(index.prefix_matches('losartán', 10), [1, 2])
+        self.assertEqual(index.prefix_matches('lo', 1), [1])
+        self.assertEqual(index.similar_matches('lovastatna', 10), [3])
+        self.assertEqual(trigrams('ab'), {'  a', ' ab', 'ab '})
+
+
+class AsyncReadViewsTests(TestCase):
+    """Las variantes async responden igual que las vistas sync"""
+
+    def setUp(self):
+        access_cache.clear()
+        self.patient = make_user('patient', 'async_paciente@example.com', name='Paciente')
+        self.other_patient = make_user('patient', 'async_otro@example.com', name='Otro')
+        self.doctor = make_user('doctor', 'async_doctor@example.com', name='Doctor')
+        self.family = make_user('family', 'async_familia@example.com', name='Familiar')
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.patient.id, specialty='General')
+        UserCreationService.assign_family_to_patient(
+            self.family.id, self.patient.id, 'child', can_manage_medications=True
+        )
+        medication = Medication.objects.create(name='Losartán', form='tablet')
+        for start_day in (1, 2, 3):
+            Schedule.objects.create(
+                user=self.patient, medication=medication,
+                start_date=date(2025, 1, start_day), pattern='daily', dose_amount='1'
+            )
+
+    async def assertSameResponse(self, name, user, args=()):
+        headers = {'User-ID': str(user.id)}
+        sync_response = await sync_to_async(self.client.get)(reverse(f'api:{name}', args=args), headers=headers)
+        async_response = await self.async_client.get(reverse(f'api:async_{name}', args=args), headers=headers)
+
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.json(), sync_response.json())
+        return async_response
+
+    async def test_patient_endpoints(self):
+        response = await self.assertSameResponse('patient_schedules', self.patient)
+        self.assertEqual(len(response.json()['schedules']), 3)
+        response = await self.assertSameResponse('patient_caregivers', self.patient)
+        self.assertEqual(len(response.json()['caregivers']['family_members']), 1)
+        response = await self.assertSameResponse('patient_schedules', self.doctor)
+        self.assertEqual(response.status_code, 403)
+
+    async def test_caregiver_endpoints(self):
+        for caregiver in (self.doctor, self.family):
+            response = await self.assertSameResponse('caregiver_patients', caregiver)
+            self.assertEqual(len(response.json()['patients']), 1)
+            response = await self.assertSameResponse(
+                'patient_schedules_by_caregiver', caregiver, args=[self.patient.id]
+            )
+            self.assertTrue(response.json()['can_manage'])
+
+        response = await self.assertSameResponse(
+            'patient_schedules_by_caregiver', self.doctor, args=[self.other_patient.id]
+        )
+        self.assertEqual(response.status_code, 403)
+
+    async def test_missing_user_header(self):
+        response = await self.async_client.get(reverse('api:async_patient_schedules'))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_permission_context_loads_relations_async(self):
+        access_cache.reset_stats()
+        context = await PermissionContext(self.family).aload()
+        self.assertTrue(context.can_manage_schedules(self.patient.id))
+        self.assertFalse(context.can_view_patient_data(self.other_patient.id))
+        self.assertEqual(access_cache.stats()['misses'], 1)
+
+        await PermissionContext(self.family).aload()
+        self.assertEqual(access_cache.stats()['hits'], 1)
+
+
+class DoseCalendarTests(TestCase):
+    """El calendario expande los schedules en la zona del paciente y combina los intakes"""
+
+    def setUp(self):
+        access_cache.clear()
+        self.patient = make_user('patient', 'calendario_paciente@example.com', name='Paciente', tz='America/Bogota')
+        self.doctor = make_user('doctor', 'calendario_doctor@example.com', name='Doctor')
+        self.outsider = make_user('doctor', 'calendario_otro@example.com', name='Otro')
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.patient.id)
+        self.losartan = Medication.objects.create(name='Losartán', form='tablet')
+        self.metformina = Medication.objects.create(name='Metformina', form='tablet')
+        self.twice = Schedule.objects.create(
+            user=self.patient, medication=self.losartan, start_date=date(2025, 1, 1),
+            pattern='twice_daily', dose_amount='1'
+        )
+        self.noon = Schedule.objects.create(
+            user=self.patient, medication=self.metformina, start_date=date(2025, 1, 1),
+            end_date=date(2025, 1, 2), pattern='daily_12pm', dose_amount='2'
+        )
+
+    def get_calendar(self, user=None, **params):
+        response = self.client.get(
+            reverse('api:patient_dose_calendar', args=[self.patient.id]), params,
+            headers={'User-ID': str((user or self.doctor).id)}
+        )
+        if response.streaming:
+            return response.status_code, json.loads(b''.join(response.streaming_content))
+        return response.status_code, response.json()
+
+    def test_expands_in_patient_timezone_and_merges_intakes(self):
+        taken = Intake.objects.create(
+            schedule=self.twice, planned_at=datetime(2025, 1, 1, 13, tzinfo=dt_timezone.utc),
+            status='taken', taken_at=datetime(2025, 1, 1, 13, 10, tzinfo=dt_timezone.utc)
+        )
+        # Intake de una versión anterior del patrón: se conserva aunque no coincida
+        legacy = Intake.objects.create(
+            schedule=self.twice, planned_at=datetime(2025, 1, 2, 15, tzinfo=dt_timezone.utc), status='missed'
+        )
+
+        status, body = self.get_calendar(start='2025-01-01', end='2025-01-03')
+
+        self.assertEqual(status, 200)
+        doses = body['doses']
+        self.assertEqual(
+            [(dose['local_time'][5:16], dose['medication']['name'], dose['status']) for dose in doses],
+            [
+                ('01-01T08:00', 'Losartán', 'taken'),
+                ('01-01T12:00', 'Metformina', 'scheduled'),
+                ('01-01T20:00', 'Losartán', 'scheduled'),
+                ('01-02T08:00', 'Losartán', 'scheduled'),
+                ('01-02T10:00', 'Losartán', 'missed'),
+                ('01-02T12:00', 'Metformina', 'scheduled'),
+                ('01-02T20:00', 'Losartán', 'scheduled'),
+                ('01-03T08:00', 'Losartán', 'scheduled'),
+                ('01-03T20:00', 'Losartán', 'scheduled'),
+            ]
+        )
+        self.assertEqual(doses[0]['planned_at'], '2025-01-01T13:00:00+00:00')
+        self.assertEqual(doses[0]['intake_id'], str(taken.id))
+        self.assertEqual(doses[4]['intake_id'], str(legacy.id))
+        self.assertIsNone(doses[1]['intake_id'])
+        self.assertEqual(body['timezone'], 'America/Bogota')
+
+    def test_year_range_streams_with_constant_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            status, body = self.get_calendar(start='2025-01-01', end='2025-12-31')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body['doses']), 365 * 2 + 2)
+        planned = [dose['planned_at'] for dose in body['doses']]
+        self.assertEqual(planned, sorted(planned))
+        # Usuario, relaciones, paciente, schedules e intakes
+        self.assertLessEqual(len(queries.captured_queries), 5)
+
+    def test_dst_keeps_local_time(self):
+        self.patient.tz = 'America/New_York'
+        self.patient.save(update_fields=['tz'])
+        self.noon.delete()
+
+        status, body = self.get_calendar(start='2025-03-08', end='2025-03-09')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            [dose['planned_at'] for dose in body['doses'] if dose['local_time'][11:16] == '08:00'],
+            ['2025-03-08T13:00:00+00:00', '2025-03-09T12:00:00+00:00']
+        )
+
+    def test_invalid_ranges(self):
+        for params in ({'start': '2025-01-01', 'end': '2026-01-02'},
+                       {'start': '2025-01-05', 'end': '2025-01-01'},
+                       {'start': '05/01/2025'}):
+            status, _ = self.get_calendar(**params)
+            self.assertEqual(status, 400, params)
+
+    def test_requires_access_to_patient(self):
+        status, _ = self.get_calendar(user=self.outsider, start='2025-01-01', end='2025-01-02')
+        self.assertEqual(status, 403)
+
+        status, body = self.get_calendar(user=self.patient, start='2025-01-01', end='2025-01-01')
+        self.assertEqual((status, len(body['doses'])), (200, 3))
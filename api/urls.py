@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'api'
 
@@ -14,22 +14,37 @@ urlpatterns = [
     
     # Endpoints para cuidadores (doctores y familiares)
     path('caregiver/patients/', views.CaregiverPatientsView.as_view(), name='caregiver_patients'),
+    path('patient/<str:patient_id>/calendar/', views.PatientDoseCalendarView.as_view(), name='patient_dose_calendar'),
     path('caregiver/patient/<str:patient_id>/schedules/', 
          views.PatientSchedulesByCaregiverView.as_view(), 
          name='patient_schedules_by_caregiver'),
     
+    # Variantes async (ASGI) de las lecturas anteriores
+    path('async/patient/caregivers/', async_views.AsyncPatientCaregiversView.as_view(), name='async_patient_caregivers'),
+    path('async/patient/schedules/', async_views.AsyncPatientSchedulesView.as_view(), name='async_patient_schedules'),
+    path('async/caregiver/patients/', async_views.AsyncCaregiverPatientsView.as_view(), name='async_caregiver_patients'),
+    path('async/caregiver/patient/<str:patient_id>/schedules/',
+         async_views.AsyncPatientSchedulesByCaregiverView.as_view(),
+         name='async_patient_schedules_by_caregiver'),
+    
     # Asignación de cuidadores
     path('assign-caregiver/', views.AssignCaregiverView.as_view(), name='assign_caregiver'),
     path('remove-caregiver/', views.RemoveCaregiverView.as_view(), name='remove_caregiver'),
+    path('caregivers/bulk/', views.CaregiverBulkAssignmentView.as_view(), name='caregiver_bulk_assignment'),
     path('patient/<str:patient_id>/relations/', views.ListCaregiverRelationsView.as_view(), name='list_caregiver_relations'),
     
     # Gestión de schedules
     path('schedules/', views.ScheduleManagementView.as_view(), name='schedule_management'),
+    path('schedules/bulk/', views.ScheduleBulkCreateView.as_view(), name='schedule_bulk_create'),
     path('schedules/<str:schedule_id>/', views.ScheduleManagementView.as_view(), name='schedule_update_delete'),
     path('schedule/<str:schedule_id>/detail/', views.ScheduleDetailView.as_view(), name='schedule_detail'),
     
+    # Registro de tomas
+    path('intakes/events/', views.IntakeEventsView.as_view(), name='intake_events'),
+    
     # Gestión de medicamentos
     path('medications/', views.MedicationManagementView.as_view(), name='medication_management'),
+    path('medications/search/', views.MedicationSearchView.as_view(), name='medication_search'),
     
     # Utilidades
     path('demo/create-sample-users/', views.create_sample_users_with_relations, name='create_sample_users'),
@@ -1,41 +1,92 @@
 import traceback
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
 from django.views import View
+from django.utils import timezone
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
 import json
+from datetime import timedelta
 from .models import (
     UserCreationService, User, Medication, Schedule, Intake,
     DoctorPatientRelation, FamilyPatientRelation, authenticate
 )
 
+from .dose_calendar import DoseCalendar
+from .intakes import IntakeEventIngestor
+from .permissions import PermissionMixin
+from .search import search_medications
+
+from apirest.pagination import TextKeysetPagination
 from utils.format import Format
+from utils.timezones import local_date
+
+
+def serialize_schedule(schedule):
+    """Programación con su medicamento (cargado con select_related)"""
+    return {
+        'id': str(schedule.id),
+        'medication': {
+            'id': str(schedule.medication.id),
+            'name': schedule.medication.name,
+            'form': schedule.medication.form
+        },
+        'start_date': Format.safe_isoformat(schedule.start_date),
+        'end_date': Format.safe_isoformat(schedule.end_date) if schedule.end_date else None,
+        'pattern': schedule.pattern,
+        'dose_amount': schedule.dose_amount
+    }
+
+
+def serialize_caregivers(relations):
+    """Cuidadores del paciente a partir de get_caregiver_relations"""
+    return {
+        'family_members': [
+            {
+                'id': str(relation.family_member.id),
+                'name': relation.family_member.name,
+                'email': relation.family_member.email,
+                'relationship': relation.relationship_type,
+                'can_manage_medications': relation.can_manage_medications,
+                'emergency_contact': relation.emergency_contact
+            }
+            for relation in relations['family_relations']
+        ],
+        'doctors': [
+            {
+                'id': str(relation.doctor.id),
+                'name': relation.doctor.name,
+                'email': relation.doctor.email,
+                'specialty': relation.specialty
+            }
+            for relation in relations['doctor_relations']
+        ]
+    }
 
 
-class PermissionMixin:
-    """Mixin para validar permisos de usuario"""
+def serialize_caregiver_patient(user, relation):
+    """Paciente de un cuidador con la información específica de la relación"""
+    patient = relation.patient
+    patient_data = {
+        'id': str(patient.id),
+        'name': patient.name,
+        'email': patient.email,
+        'timezone': patient.tz,
+        'created_at': patient.created_at.isoformat()
+    }
     
-    def get_user_from_request(self, request):
-        """Obtener usuario autenticado (simulado por ahora)"""
-        # En una implementación real, esto vendría de la autenticación
-        user_id = request.headers.get('User-ID')
-        if not user_id:
-            raise ValueError("User-ID header requerido")
-        
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            raise ValueError("Usuario no encontrado")
+    if user.user_type == 'doctor':
+        patient_data['specialty'] = relation.specialty
+        patient_data['notes'] = relation.notes
+    elif user.user_type == 'family':
+        patient_data['relationship_type'] = relation.relationship_type
+        patient_data['can_manage_medications'] = relation.can_manage_medications
+        patient_data['emergency_contact'] = relation.emergency_contact
     
-    def check_permission(self, user, action, target_user_id=None):
-        """Verificar si el usuario tiene permisos para una acción"""
-        if action == 'view_patient_data' and target_user_id:
-            return user.can_view_patient_data(target_user_id)
-        elif action == 'manage_schedules' and target_user_id:
-            return user.can_manage_schedules(target_user_id)
-        return False
+    return patient_data
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -99,7 +150,7 @@ class UserPermissionsView(View, PermissionMixin):
     def get(self, request):
         try:
             user = self.get_user_from_request(request)
-            permissions = UserCreationService.get_user_permissions(user.id)
+            permissions = UserCreationService.get_user_permissions(user)
             
             return JsonResponse({
                 'success': True,
@@ -125,42 +176,11 @@ class PatientCaregiversView(View, PermissionMixin):
                     'error': 'Solo los pacientes pueden ver sus cuidadores'
                 }, status=403)
             
-            caregivers = user.get_my_caregivers()
-            
-            response_data = {
-                'family_members': [
-                    {
-                        'id': str(fm.id),
-                        'name': fm.name,
-                        'email': fm.email,
-                        'relationship': FamilyPatientRelation.objects.get(
-                            family_member=fm, patient=user
-                        ).relationship_type,
-                        'can_manage_medications': FamilyPatientRelation.objects.get(
-                            family_member=fm, patient=user
-                        ).can_manage_medications,
-                        'emergency_contact': FamilyPatientRelation.objects.get(
-                            family_member=fm, patient=user
-                        ).emergency_contact
-                    }
-                    for fm in caregivers['family_members']
-                ],
-                'doctors': [
-                    {
-                        'id': str(d.id),
-                        'name': d.name,
-                        'email': d.email,
-                        'specialty': DoctorPatientRelation.objects.get(
-                            doctor=d, patient=user
-                        ).specialty
-                    }
-                    for d in caregivers['doctors']
-                ]
-            }
+            relations = user.get_caregiver_relations()
             
             return JsonResponse({
                 'success': True,
-                'caregivers': response_data
+                'caregivers': serialize_caregivers(relations)
             })
             
         except ValueError as e:
@@ -182,22 +202,9 @@ class PatientSchedulesView(View, PermissionMixin):
                     'error': 'Solo los pacientes pueden ver sus programaciones'
                 }, status=403)
             
-            schedules = user.get_my_schedules()
+            schedules = user.get_my_schedules().select_related('medication')
             
-            schedules_data = []
-            for schedule in schedules:
-                schedules_data.append({
-                    'id': str(schedule.id),
-                    'medication': {
-                        'id': str(schedule.medication.id),
-                        'name': schedule.medication.name,
-                        'form': schedule.medication.form
-                    },
-                    'start_date': Format.safe_isoformat(schedule.start_date),
-                    'end_date': Format.safe_isoformat(schedule.end_date) if schedule.end_date else None,
-                    'pattern': schedule.pattern,
-                    'dose_amount': schedule.dose_amount
-                })
+            schedules_data = [serialize_schedule(schedule) for schedule in schedules]
             
             return JsonResponse({
                 'success': True,
@@ -223,34 +230,9 @@ class CaregiverPatientsView(View, PermissionMixin):
                     'error': 'Solo doctores y familiares pueden ver pacientes'
                 }, status=403)
             
-            patients = user.get_my_patients()
+            relations = user.get_patient_relations()
             
-            patients_data = []
-            for patient in patients:
-                patient_data = {
-                    'id': str(patient.id),
-                    'name': patient.name,
-                    'email': patient.email,
-                    'timezone': patient.tz,
-                    'created_at': patient.created_at.isoformat()
-                }
-                
-                # Agregar información específica de la relación
-                if user.user_type == 'doctor':
-                    relation = DoctorPatientRelation.objects.get(
-                        doctor=user, patient=patient
-                    )
-                    patient_data['specialty'] = relation.specialty
-                    patient_data['notes'] = relation.notes
-                elif user.user_type == 'family':
-                    relation = FamilyPatientRelation.objects.get(
-                        family_member=user, patient=patient
-                    )
-                    patient_data['relationship_type'] = relation.relationship_type
-                    patient_data['can_manage_medications'] = relation.can_manage_medications
-                    patient_data['emergency_contact'] = relation.emergency_contact
-                
-                patients_data.append(patient_data)
+            patients_data = [serialize_caregiver_patient(user, relation) for relation in relations]
             
             return JsonResponse({
                 'success': True,
@@ -272,34 +254,22 @@ class PatientSchedulesByCaregiverView(View, PermissionMixin):
     def get(self, request, patient_id):
         try:
             user = self.get_user_from_request(request)
+            permissions = self.get_permission_context(request, user)
             
             # Verificar permisos
-            if not user.can_view_patient_data(patient_id):
+            if not permissions.can_view_patient_data(patient_id):
                 return JsonResponse({
                     'error': 'No tienes permisos para ver este paciente'
                 }, status=403)
             
-            schedules = user.get_patient_schedules(patient_id)
+            schedules = Schedule.objects.filter(user_id=patient_id).select_related('medication')
             
-            schedules_data = []
-            for schedule in schedules:
-                schedules_data.append({
-                    'id': str(schedule.id),
-                    'medication': {
-                        'id': str(schedule.medication.id),
-                        'name': schedule.medication.name,
-                        'form': schedule.medication.form
-                    },
-                    'start_date': Format.safe_isoformat(schedule.start_date),
-                    'end_date': Format.safe_isoformat(schedule.end_date) if schedule.end_date else None,
-                    'pattern': schedule.pattern,
-                    'dose_amount': schedule.dose_amount
-                })
+            schedules_data = [serialize_schedule(schedule) for schedule in schedules]
             
             return JsonResponse({
                 'success': True,
                 'schedules': schedules_data,
-                'can_manage': user.can_manage_schedules(patient_id)
+                'can_manage': permissions.can_manage_schedules(patient_id)
             })
             
         except ValueError as e:
@@ -308,6 +278,44 @@ class PatientSchedulesByCaregiverView(View, PermissionMixin):
             return JsonResponse({'error': 'Error interno del servidor'}, status=500)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class PatientDoseCalendarView(View, PermissionMixin):
+    """Calendario de dosis de un paciente, expandido en el servidor"""
+    
+    def get(self, request, patient_id):
+        """
+        Dosis entre dos fechas locales del paciente (incluidas, máximo 366 días)
+        Query params: start y end (YYYY-MM-DD); por defecto hoy y 30 días después
+        """
+        try:
+            user = self.get_user_from_request(request)
+            
+            if not self.get_permission_context(request, user).can_view_patient_data(patient_id):
+                return JsonResponse({
+                    'error': 'No tienes permisos para ver este paciente'
+                }, status=403)
+            
+            patient = User.objects.filter(id=patient_id, user_type='patient').first()
+            if not patient:
+                return JsonResponse({'error': 'Paciente no encontrado'}, status=404)
+            
+            start_date = DoseCalendar.parse_date(request.GET.get('start'), 'start')
+            if start_date is None:
+                start_date = local_date(timezone.now(), patient.tz)
+            end_date = DoseCalendar.parse_date(request.GET.get('end'), 'end')
+            if end_date is None:
+                end_date = start_date + timedelta(days=DoseCalendar.DEFAULT_DAYS - 1)
+            
+            calendar = DoseCalendar(patient, start_date, end_date)
+            return StreamingHttpResponse(calendar.stream_json(), content_type='application/json')
+            
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class AssignCaregiverView(View, PermissionMixin):
     """Vista para asignar cuidadores a pacientes"""
@@ -385,7 +393,7 @@ class RemoveCaregiverView(View, PermissionMixin):
                 }, status=400)
             
             # Verificar que el doctor tenga permisos sobre el paciente
-            if not user.can_view_patient_data(patient_id):
+            if not self.get_permission_context(request, user).can_view_patient_data(patient_id):
                 return JsonResponse({
                     'error': 'No tienes permisos para gestionar este paciente'
                 }, status=403)
@@ -466,6 +474,103 @@ class RemoveCaregiverView(View, PermissionMixin):
             return JsonResponse({'error': 'Error interno del servidor'}, status=500)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class CaregiverBulkAssignmentView(View, PermissionMixin):
+    """Vista para asignar o remover cuidadores de muchos pacientes en una sola operación"""
+    
+    MAX_RELATIONS = 1000
+    
+    def _parse_batch(self, request, items_field):
+        """Validar el lote y los permisos del doctor sobre todos sus pacientes"""
+        data = json.loads(request.body)
+        user = self.get_user_from_request(request)
+        
+        # Solo los doctores pueden gestionar cuidadores por ahora
+        if user.user_type != 'doctor':
+            return None, None, JsonResponse({
+                'error': 'Solo los doctores pueden gestionar cuidadores'
+            }, status=403)
+        
+        caregiver_type = data.get('caregiver_type')
+        items = data.get(items_field)
+        if caregiver_type not in ('family', 'doctor') or not isinstance(items, list) or not items:
+            return None, None, JsonResponse({
+                'error': f'caregiver_type ("family" o "doctor") y una lista no vacía de {items_field} son requeridos'
+            }, status=400)
+        if len(items) > self.MAX_RELATIONS:
+            return None, None, JsonResponse({
+                'error': f'Máximo {self.MAX_RELATIONS} relaciones por solicitud'
+            }, status=400)
+        if not all(isinstance(item, dict) for item in items):
+            return None, None, JsonResponse({'error': 'Datos inválidos'}, status=400)
+        
+        # Una sola verificación de permisos contra el conjunto de pacientes del doctor
+        permissions = self.get_permission_context(request, user)
+        forbidden = [
+            index for index, item in enumerate(items)
+            if not permissions.can_view_patient_data(item.get('patient_id'))
+        ]
+        if forbidden:
+            return None, None, JsonResponse({
+                'error': 'No tienes permisos para gestionar estos pacientes',
+                'forbidden_indexes': forbidden
+            }, status=403)
+        return caregiver_type, items, None
+    
+    @staticmethod
+    def _summary(results, **counts):
+        succeeded = sum(1 for result in results if result['success'])
+        return JsonResponse({
+            'success': succeeded == len(results),
+            **counts,
+            'failed': len(results) - succeeded,
+            'results': results
+        }, status=200 if succeeded else 400)
+    
+    def post(self, request):
+        """Asignar cuidadores en lote; los pares ya existentes no se modifican"""
+        try:
+            caregiver_type, assignments, error = self._parse_batch(request, 'assignments')
+            if error:
+                return error
+            
+            results = UserCreationService.assign_caregivers_bulk(caregiver_type, assignments)
+            return self._summary(
+                results,
+                created=sum(1 for result in results if result.get('created')),
+                existing=sum(1 for result in results if result['success'] and not result['created'])
+            )
+            
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'JSON inválido'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+    
+    def delete(self, request):
+        """Remover cuidadores en lote"""
+        try:
+            caregiver_type, relations, error = self._parse_batch(request, 'relations')
+            if error:
+                return error
+            
+            results = UserCreationService.remove_caregivers_bulk(caregiver_type, relations)
+            return self._summary(
+                results,
+                deleted_count=sum(1 for result in results if result['success'])
+            )
+            
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'JSON inválido'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class ListCaregiverRelationsView(View, PermissionMixin):
     """Vista para listar todas las relaciones de un paciente"""
@@ -475,7 +580,7 @@ class ListCaregiverRelationsView(View, PermissionMixin):
             user = self.get_user_from_request(request)
             
             # Verificar permisos
-            if not user.can_view_patient_data(patient_id):
+            if not self.get_permission_context(request, user).can_view_patient_data(patient_id):
                 return JsonResponse({
                     'error': 'No tienes permisos para ver este paciente'
                 }, status=403)
@@ -635,7 +740,7 @@ class ScheduleManagementView(View, PermissionMixin):
                     }, status=400)
             
             # Verificar permisos
-            if not user.can_manage_schedules(data['patient_id']):
+            if not self.get_permission_context(request, user).can_manage_schedules(data['patient_id']):
                 return JsonResponse({
                     'error': 'No tienes permisos para crear schedules para este paciente'
                 }, status=403)
@@ -648,7 +753,7 @@ class ScheduleManagementView(View, PermissionMixin):
                 end_date=data.get('end_date'),
                 pattern=data['pattern'],
                 dose_amount=data['dose_amount'],
-                created_by_user_id=user.id
+                created_by_user_id=user
             )
             
             return JsonResponse({
@@ -689,7 +794,7 @@ class ScheduleManagementView(View, PermissionMixin):
             # Actualizar schedule
             schedule = UserCreationService.update_schedule(
                 schedule_id=schedule_id,
-                user_id=user.id,
+                user_id=user,
                 **data
             )
             
@@ -730,7 +835,7 @@ class ScheduleManagementView(View, PermissionMixin):
             
             schedule_info = UserCreationService.delete_schedule(
                 schedule_id=schedule_id,
-                user_id=user.id
+                user_id=user
             )
             
             return JsonResponse({
@@ -746,6 +851,116 @@ class ScheduleManagementView(View, PermissionMixin):
             return JsonResponse({'error': 'Error interno del servidor'}, status=500)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class ScheduleBulkCreateView(View, PermissionMixin):
+    """Vista para crear varios schedules de un paciente en una sola operación"""
+    
+    MAX_SCHEDULES = 500
+    
+    def post(self, request):
+        """Crear schedules en lote con resultado por ítem"""
+        try:
+            data = json.loads(request.body)
+            user = self.get_user_from_request(request)
+            
+            patient_id = data.get('patient_id')
+            schedules = data.get('schedules')
+            if not patient_id or not isinstance(schedules, list) or not schedules:
+                return JsonResponse({
+                    'error': 'patient_id y una lista no vacía de schedules son requeridos'
+                }, status=400)
+            if len(schedules) > self.MAX_SCHEDULES:
+                return JsonResponse({
+                    'error': f'Máximo {self.MAX_SCHEDULES} schedules por solicitud'
+                }, status=400)
+            
+            # Verificar permisos una sola vez para todo el lote; el servicio reutiliza el contexto
+            permissions = self.get_permission_context(request, user)
+            if not permissions.can_manage_schedules(patient_id):
+                return JsonResponse({
+                    'error': 'No tienes permisos para crear schedules para este paciente'
+                }, status=403)
+            
+            results = UserCreationService.create_schedules_bulk(
+                user_id=patient_id,
+                schedules=schedules,
+                created_by_user_id=user,
+                permission_context=permissions
+            )
+            
+            items = []
+            for result in results:
+                if result['success']:
+                    items.append({
+                        'index': result['index'],
+                        'success': True,
+                        'schedule': serialize_schedule(result['schedule'])
+                    })
+                else:
+                    items.append(result)
+            
+            created = sum(1 for item in items if item['success'])
+            return JsonResponse({
+                'success': created == len(items),
+                'created': created,
+                'failed': len(items) - created,
+                'results': items
+            }, status=201 if created else 400)
+            
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'JSON inválido'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class IntakeEventsView(View, PermissionMixin):
+    """Vista para registrar en lote tomas realizadas, perdidas o saltadas"""
+    
+    MAX_EVENTS = 1000
+    
+    def post(self, request):
+        """Aplicar eventos de toma con resultado por evento (reenviar el lote es idempotente)"""
+        try:
+            data = json.loads(request.body)
+            user = self.get_user_from_request(request)
+            
+            events = data.get('events')
+            if not isinstance(events, list) or not events:
+                return JsonResponse({
+                    'error': 'Se requiere una lista no vacía de events'
+                }, status=400)
+            if len(events) > self.MAX_EVENTS:
+                return JsonResponse({
+                    'error': f'Máximo {self.MAX_EVENTS} eventos por solicitud'
+                }, status=400)
+            
+            results = IntakeEventIngestor().ingest(
+                user, events, permission_context=self.get_permission_context(request, user)
+            )
+            
+            succeeded = [result for result in results if result['success']]
+            updated = sum(1 for result in succeeded if result['updated'])
+            return JsonResponse({
+                'success': len(succeeded) == len(results),
+                'updated': updated,
+                'unchanged': len(succeeded) - updated,
+                'failed': len(results) - len(succeeded),
+                'results': results
+            }, status=200 if succeeded else 400)
+            
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'JSON inválido'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class ScheduleDetailView(View, PermissionMixin):
     """Vista para obtener detalles de un schedule específico"""
@@ -756,7 +971,7 @@ class ScheduleDetailView(View, PermissionMixin):
             
             result = UserCreationService.get_schedule_details(
                 schedule_id=schedule_id,
-                user_id=user.id
+                user_id=user
             )
             
             schedule: Schedule = result['schedule']
@@ -795,27 +1010,44 @@ class ScheduleDetailView(View, PermissionMixin):
 @method_decorator(csrf_exempt, name='dispatch')
 class MedicationManagementView(View, PermissionMixin):
     """Vista para gestionar medicamentos"""
-    
+
+    PAGE_SIZE = 50
+
+    @staticmethod
+    def serialize_medication(med):
+        return {
+            'id': str(med.id),
+            'name': med.name,
+            'form': med.form,
+            'created_at': med.created_at.isoformat() if med.created_at else None
+        }
+
     def get(self, request):
-        """Listar todos los medicamentos"""
+        """
+        Listar medicamentos en orden alfabético, paginado por cursor
+        Query params: cursor (opcional), page_size (opcional, máx. 500)
+        El total solo se calcula en la primera página (sin cursor).
+        """
         try:
-            medications = Medication.objects.all()
-            
-            medications_data = []
-            for med in medications:
-                medications_data.append({
-                    'id': str(med.id),
-                    'name': med.name,
-                    'form': med.form,
-                    'created_at': med.created_at.isoformat() if med.created_at else None
-                })
-            
-            return JsonResponse({
+            pagination = TextKeysetPagination(ordering_field='name_lower', page_size=self.PAGE_SIZE)
+            medications, next_cursor = pagination.paginate_queryset(
+                Medication.objects.annotate(name_lower=Lower('name')), request
+            )
+
+            medications_data = [self.serialize_medication(med) for med in medications]
+
+            response = {
                 'success': True,
                 'medications': medications_data,
-                'total': len(medications_data)
-            })
-            
+                'count': len(medications_data),
+                'next_cursor': next_cursor,
+            }
+            if not request.GET.get(pagination.cursor_query_param):
+                response['total'] = Medication.objects.count()
+            return JsonResponse(response)
+
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Exception as e:
             traceback.print_exc()
             return JsonResponse({'error': 'Error interno del servidor'}, status=500)
@@ -833,32 +1065,33 @@ class MedicationManagementView(View, PermissionMixin):
                 }, status=403)
             
             # Validar campos requeridos
-            if 'name' not in data:
+            name = ' '.join(str(data.get('name') or '').split())
+            if not name:
                 return JsonResponse({
                     'error': 'El campo name es requerido'
                 }, status=400)
             
-            # Verificar si ya existe
-            existing = Medication.objects.filter(name=data['name']).first()
-            if existing:
-                return JsonResponse({
-                    'error': 'Ya existe un medicamento con ese nombre'
-                }, status=400)
+            # Verificar si ya existe (sin distinguir mayúsculas, usa el índice LOWER(name))
+            duplicate_error = JsonResponse({
+                'error': 'Ya existe un medicamento con ese nombre'
+            }, status=400)
+            if Medication.objects.annotate(name_lower=Lower('name')).filter(name_lower=name.lower()).exists():
+                return duplicate_error
             
-            medication = Medication.objects.create(
-                name=data['name'],
-                form=data.get('form', 'tablet'),
-                created_by=user.id
-            )
+            try:
+                with transaction.atomic():
+                    medication = Medication.objects.create(
+                        name=name,
+                        form=data.get('form', 'tablet'),
+                        created_by=user.id
+                    )
+            except IntegrityError:
+                # Otro request creó el mismo nombre entre la verificación y el INSERT
+                return duplicate_error
             
             return JsonResponse({
                 'success': True,
-                'medication': {
-                    'id': str(medication.id),
-                    'name': medication.name,
-                    'form': medication.form,
-                    'created_at': medication.created_at.isoformat() if medication.created_at else None
-                }
+                'medication': self.serialize_medication(medication)
             }, status=201)
             
         except ValueError as e:
@@ -869,7 +1102,45 @@ class MedicationManagementView(View, PermissionMixin):
             traceback.print_exc()
             return JsonResponse({'error': 'Error interno del servidor'}, status=500)
 
+
 @method_decorator(csrf_exempt, name='dispatch')
+class MedicationSearchView(View):
+    """Autocompletado de medicamentos por prefijo y similitud"""
+
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 50
+
+    def get(self, request):
+        """
+        Buscar medicamentos
+        Query params: q (requerido), limit (opcional, máx. 50)
+        """
+        try:
+            query = request.GET.get('q', '').strip()
+            if not query:
+                return JsonResponse({'error': 'El parámetro q es requerido'}, status=400)
+
+            try:
+                limit = int(request.GET.get('limit', self.DEFAULT_LIMIT))
+            except ValueError:
+                return JsonResponse({'error': 'limit debe ser un entero'}, status=400)
+            if limit <= 0:
+                return JsonResponse({'error': 'limit debe ser mayor que cero'}, status=400)
+
+            medications = search_medications(query, min(limit, self.MAX_LIMIT))
+
+            return JsonResponse({
+                'success': True,
+                'query': query,
+                'medications': medications,
+                'count': len(medications)
+            })
+
+        except Exception as e:
+            traceback.print_exc()
+            return JsonResponse({'error': 'Error interno del servidor'}, status=500)
+
+
 class LoginView(View):
     """Vista para autenticar usuarios"""
     
@@ -892,7 +1163,7 @@ class LoginView(View):
                     'success': True,
                     'message': 'Login exitoso',
                     'user': user.get_login_info(),
-                    'permissions': UserCreationService.get_user_permissions(user.id)
+                    'permissions': UserCreationService.get_user_permissions(user)
                 })
             else:
                 return JsonResponse({
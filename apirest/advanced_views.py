@@ -1,17 +1,24 @@
 """
 Vistas DRF que utilizan la nueva Factory
 """
+import json
 import traceback
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
 from django.db import transaction
+from django.db.models import Count, Prefetch, Q
+from django.http import StreamingHttpResponse
 from django.core.exceptions import PermissionDenied
 from django.utils import timezone
 
+from api.adherence import AdherenceAnalytics
+from api.permissions import PermissionMixin
 from .factories import UserServiceFactory
+from .pagination import KeysetPagination
 from .serializers import (
     UserRegistrationSerializer,
     UserSerializer,
@@ -19,29 +26,12 @@ from .serializers import (
     CaregiverRemovalSerializer,
     UserPermissionsSerializer,
     PatientScheduleRequestSerializer,
+    PatientAdherenceRequestSerializer,
     UserServiceMethodSerializer,
     UserAdminSerializer,
 )
 
 
-class PermissionMixin:
-    """Mixin para validar permisos de usuario"""
-    
-    def get_user_from_request(self, request):
-        """Obtener usuario autenticado desde header"""
-        if request.user and request.user.is_authenticated:
-            return request.user
-        user_id = request.META.get('HTTP_USER_ID')
-        if not user_id:
-            raise ValueError("User-ID header requerido")
-        
-        try:
-            from api.models import User
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            raise ValueError("Usuario no encontrado")
-
-
 class UserRegistrationViewV2(APIView):
     """Vista para registro usando la nueva factory"""
     permission_classes = [AllowAny]
@@ -65,7 +55,7 @@ class UserRegistrationViewV2(APIView):
                     
                     # Obtener permisos usando el servicio específico
                     service = UserServiceFactory.get_service(user.user_type)
-                    permissions = service.get_user_permissions(user.id)
+                    permissions = service.get_user_permissions(user)
                     
                     user_data = UserSerializer(user).data
                     
@@ -102,8 +92,8 @@ class UserPermissionsViewV2(APIView, PermissionMixin):
             user = self.get_user_from_request(request)
             
             # Usar el servicio específico del usuario
-            service = UserServiceFactory.get_service(user.user_type)
-            permissions = service.get_user_permissions(user.id)
+            service = UserServiceFactory.for_user(user, self.get_permission_context(request, user))
+            permissions = service.get_user_permissions()
             
             serializer = UserPermissionsSerializer(permissions)
             
@@ -135,10 +125,9 @@ class CaregiverManagementViewV2(APIView, PermissionMixin):
             
             if serializer.is_valid():
                 # Usar el servicio específico del usuario
-                service = UserServiceFactory.get_service(user.user_type)
+                service = UserServiceFactory.for_user(user, self.get_permission_context(request, user))
                 
                 result = service.assign_caregiver(
-                    user_id=user.id,
                     caregiver_id=serializer.validated_data['caregiver_id'],
                     caregiver_type=serializer.validated_data['caregiver_type'],
                     **{k: v for k, v in serializer.validated_data.items() 
@@ -179,10 +168,9 @@ class CaregiverManagementViewV2(APIView, PermissionMixin):
             
             if serializer.is_valid():
                 # Usar el servicio específico del usuario
-                service = UserServiceFactory.get_service(user.user_type)
+                service = UserServiceFactory.for_user(user, self.get_permission_context(request, user))
                 
                 result = service.remove_caregiver(
-                    user_id=user.id,
                     patient_id=serializer.validated_data['patient_id'],
                     caregiver_id=serializer.validated_data['caregiver_id']
                 )
@@ -227,9 +215,8 @@ class PatientSchedulesViewV2(APIView, PermissionMixin):
                 patient_id = serializer.validated_data['patient_id']
                 
                 # Usar el servicio específico del usuario
-                service = UserServiceFactory.get_service(user.user_type)
-                
-                schedules = service.get_patient_schedules(user.id, patient_id)
+                service = UserServiceFactory.for_user(user, self.get_permission_context(request, user))
+                schedules = service.get_patient_schedules(patient_id)
                 
                 # Serializar los schedules (necesitarías crear un ScheduleSerializer)
                 schedules_data = [
@@ -250,7 +237,7 @@ class PatientSchedulesViewV2(APIView, PermissionMixin):
                     'schedules': schedules_data,
                     'patient_id': patient_id,
                     'total_schedules': len(schedules),
-                    'can_manage': service.can_manage_schedules(user.id, patient_id)
+                    'can_manage': service.can_manage_schedules(patient_id)
                 }, status=status.HTTP_200_OK)
             
             return Response({
@@ -280,6 +267,67 @@ class PatientSchedulesViewV2(APIView, PermissionMixin):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class PatientAdherenceViewV2(APIView, PermissionMixin):
+    """Vista para obtener métricas de adherencia de pacientes"""
+    
+    def post(self, request):
+        """
+        Con patient_id: reporte completo del paciente (ventanas móviles, medicamentos,
+        retrasos y rachas). Sin patient_id: resumen de todos los pacientes del cuidador.
+        """
+        try:
+            user = self.get_user_from_request(request)
+            serializer = PatientAdherenceRequestSerializer(data=request.data)
+            
+            if not serializer.is_valid():
+                return Response({
+                    'success': False,
+                    'errors': serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            patient_id = serializer.validated_data.get('patient_id')
+            days = serializer.validated_data['days']
+            permissions = self.get_permission_context(request, user)
+            # Las métricas por ventana se leen del resumen diario (O(días) filas)
+            analytics = AdherenceAnalytics(use_rollup=True)
+            
+            if patient_id is None:
+                patients = analytics.by_patient(permissions.patient_ids, days)
+                return Response({
+                    'success': True,
+                    'days': days,
+                    'patients': [
+                        {'patient_id': patient_id, **metrics}
+                        for patient_id, metrics in sorted(patients.items())
+                    ]
+                }, status=status.HTTP_200_OK)
+            
+            if not permissions.can_view_patient_data(patient_id):
+                return Response({
+                    'success': False,
+                    'error': 'No tienes permisos para ver los datos de este paciente'
+                }, status=status.HTTP_403_FORBIDDEN)
+            
+            return Response({
+                'success': True,
+                'patient_id': patient_id,
+                'days': days,
+                **analytics.patient_report(patient_id, days)
+            }, status=status.HTTP_200_OK)
+            
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            traceback.print_exc()
+            return Response({
+                'success': False,
+                'error': 'Error interno del servidor'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class UserServiceMethodViewV2(APIView, PermissionMixin):
     """Vista genérica para ejecutar métodos del servicio de usuario"""
     
@@ -296,9 +344,10 @@ class UserServiceMethodViewV2(APIView, PermissionMixin):
                 
                 # Ejecutar el método usando la factory
                 result = UserServiceFactory.execute_user_method(
-                    user_id=user.id,
-                    method_name=method_name,
+                    user,
+                    method_name,
                     *args,
+                    permission_context=self.get_permission_context(request, user),
                     **kwargs
                 )
                 
@@ -341,10 +390,67 @@ class UserServiceMethodViewV2(APIView, PermissionMixin):
 
 
 class AdminAllUsersSchedulesView(APIView, PermissionMixin):
-    """Vista administrativa para obtener todos los usuarios y sus schedules - Solo para doctores"""
+    """
+    Vista administrativa para obtener todos los usuarios y sus schedules - Solo para doctores.
+    Paginada por keyset sobre (created_at, id): ?cursor=...&page_size=...
+    Con ?stream=ndjson responde en streaming, una línea JSON por usuario
+    (la primera línea contiene las estadísticas).
+    """
+    STREAM_CHUNK_SIZE = 500
+    
+    def get_users_queryset(self, today):
+        """Usuarios con sus schedules (y medicamento) precargados y contadores anotados"""
+        from api.models import User, Schedule
+        
+        queryset = User.objects.prefetch_related(
+            Prefetch(
+                'schedule_set',
+                queryset=Schedule.objects.select_related('medication').order_by('-created_at')
+            )
+        )
+        return UserAdminSerializer.annotate_schedule_counters(queryset, today)
+    
+    def get_statistics(self, user):
+        """Estadísticas globales en una sola consulta agregada"""
+        from api.models import User
+        
+        aggregates = {
+            'total_users': Count('id', distinct=True),
+            'total_schedules': Count('schedule', distinct=True),
+        }
+        for user_type, _ in User.USER_TYPE_CHOICES:
+            aggregates[f'type_{user_type}'] = Count(
+                'id', filter=Q(user_type=user_type), distinct=True
+            )
+        totals = User.objects.aggregate(**aggregates)
+        
+        users_by_type = {
+            user_type: totals[f'type_{user_type}']
+            for user_type, _ in User.USER_TYPE_CHOICES
+            if totals[f'type_{user_type}']
+        }
+        
+        return {
+            'total_users': totals['total_users'],
+            'total_schedules': totals['total_schedules'],
+            'users_by_type': users_by_type,
+            'requested_by_doctor_id': user.id,
+            'requested_by_doctor_name': user.name,
+            'requested_by_doctor_email': user.email
+        }
+    
+    def stream_users(self, statistics, context):
+        """Generador NDJSON: estadísticas y luego usuarios por bloques"""
+        pagination = KeysetPagination()
+        users = pagination.order_queryset(self.get_users_queryset(context['today']))
+        
+        yield json.dumps({'statistics': statistics}, cls=JSONEncoder) + '\n'
+        for user_obj in users.iterator(chunk_size=self.STREAM_CHUNK_SIZE):
+            user_data = UserAdminSerializer(user_obj, context=context).data
+            yield json.dumps({'user': user_data}, cls=JSONEncoder) + '\n'
     
     def get(self, request):
-        """Obtener todos los usuarios y sus schedules - Solo doctores"""
+        """Obtener usuarios y sus schedules paginados - Solo doctores"""
         try:
             user = self.get_user_from_request(request)
             
@@ -355,49 +461,42 @@ class AdminAllUsersSchedulesView(APIView, PermissionMixin):
                     'error': 'Solo los doctores pueden acceder a esta información'
                 }, status=status.HTTP_403_FORBIDDEN)
             
-            from api.models import User
+            statistics_data = self.get_statistics(user)
             
-            # Obtener todos los usuarios con optimización de consultas
-            all_users = User.objects.all().prefetch_related(
-                'schedule_set__medication'
-            ).order_by('created_at')
+            # "Hoy" se evalúa una sola vez por request
+            context = {'request': request, 'today': timezone.now().date()}
+            
+            if request.query_params.get('stream') == 'ndjson':
+                return StreamingHttpResponse(
+                    self.stream_users(statistics_data, context),
+                    content_type='application/x-ndjson'
+                )
+            
+            # Página de usuarios por keyset
+            pagination = KeysetPagination()
+            users_page, next_cursor = pagination.paginate_queryset(
+                self.get_users_queryset(context['today']), request
+            )
             
             # Serializar usuarios (el serializer maneja toda la lógica)
-            users_serializer = UserAdminSerializer(all_users, many=True)
-            users_data = users_serializer.data
-            
-            # Calcular estadísticas simples
-            total_users = len(users_data)
-            total_schedules = sum(user['total_schedules'] for user in users_data)
-            
-            # Contar usuarios por tipo
-            users_by_type = {}
-            for user_data in users_data:
-                user_type = user_data['user_type']
-                users_by_type[user_type] = users_by_type.get(user_type, 0) + 1
-            
-            # Crear datos de estadísticas
-            statistics_data = {
-                'total_users': total_users,
-                'total_schedules': total_schedules,
-                'users_by_type': users_by_type,
-                'requested_by_doctor_id': user.id,
-                'requested_by_doctor_name': user.name,
-                'requested_by_doctor_email': user.email
-            }
+            users_data = UserAdminSerializer(users_page, many=True, context=context).data
+            
+            total_users = statistics_data['total_users']
+            total_schedules = statistics_data['total_schedules']
             
             # Datos de respuesta final
             response_data = {
                 'success': True,
                 'users': users_data,
                 'statistics': statistics_data,
+                'pagination': {
+                    'next_cursor': next_cursor,
+                    'has_more': next_cursor is not None,
+                    'page_size': pagination.get_page_size(request),
+                },
                 'message': f'Se encontraron {total_users} usuarios con {total_schedules} schedules en total'
             }
             
-            # Serializar respuesta completa
-            # response_serializer = AdminAllUsersSchedulesResponseSerializer(data=response_data)
-            # response_serializer.is_valid(raise_exception=True)
-            
             return Response(response_data, status=status.HTTP_200_OK)
             
         except ValueError as e:
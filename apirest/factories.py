@@ -2,8 +2,10 @@
 Advanced Factory Pattern for Django REST Framework
 Versión mejorada con métodos específicos por tipo de usuario
 """
+import inspect
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional, Any
+from functools import lru_cache
+from typing import List, Dict, Optional, Any, Union
 from django.db import transaction
 from django.core.exceptions import PermissionDenied
 
@@ -11,6 +13,11 @@ from api.models import (
     User, UserCreationService, Medication, Schedule, Intake,
     DoctorPatientRelation, FamilyPatientRelation
 )
+from api.permissions import PermissionContext
+
+
+# Los servicios aceptan el usuario ya cargado (ej: get_acting_user(request)) o su id
+UserRef = Union[User, int]
 
 
 class UserServiceInterface(ABC):
@@ -22,42 +29,72 @@ class UserServiceInterface(ABC):
         pass
     
     @abstractmethod
-    def remove_caregiver(self, user_id: int, patient_id: int, caregiver_id: int) -> Dict[str, Any]:
+    def remove_caregiver(self, user: UserRef, patient_id: int, caregiver_id: int) -> Dict[str, Any]:
         """Remover un cuidador (implementación específica por tipo)"""
         pass
     
     @abstractmethod
-    def assign_caregiver(self, user_id: int, caregiver_id: int, caregiver_type: str, **kwargs) -> Dict[str, Any]:
+    def assign_caregiver(self, user: UserRef, caregiver_id: int, caregiver_type: str, **kwargs) -> Dict[str, Any]:
         """Asignar un cuidador (implementación específica por tipo)"""
         pass
     
     @abstractmethod
-    def can_view_patient_data(self, user_id: int, patient_id: int) -> bool:
+    def can_view_patient_data(self, user: UserRef, patient_id: int, *,
+                              permission_context: Optional[PermissionContext] = None) -> bool:
         """Verificar si puede ver datos del paciente"""
         pass
     
     @abstractmethod
-    def can_manage_schedules(self, user_id: int, patient_id: int) -> bool:
+    def can_manage_schedules(self, user: UserRef, patient_id: int, *,
+                             permission_context: Optional[PermissionContext] = None) -> bool:
         """Verificar si puede gestionar schedules"""
         pass
     
     @abstractmethod
-    def get_user_permissions(self, user_id: int) -> Dict[str, Any]:
+    def get_user_permissions(self, user: UserRef) -> Dict[str, Any]:
         """Obtener permisos y capacidades específicas del usuario"""
         pass
     
     # Métodos opcionales que pueden ser implementados según el tipo de usuario
-    def get_my_caregivers(self, user_id: int) -> Dict[str, List]:
+    def get_my_caregivers(self, user: UserRef) -> Dict[str, List]:
         """Obtener cuidadores (solo para pacientes)"""
         raise NotImplementedError("Este método no está disponible para este tipo de usuario")
     
-    def get_my_patients(self, user_id: int) -> List[User]:
+    def get_my_patients(self, user: UserRef) -> List[User]:
         """Obtener pacientes (solo para doctores y familiares)"""
         raise NotImplementedError("Este método no está disponible para este tipo de usuario")
     
-    def get_patient_schedules(self, user_id: int, patient_id: int) -> List[Schedule]:
+    def get_patient_schedules(self, user: UserRef, patient_id: int, *,
+                              permission_context: Optional[PermissionContext] = None) -> List[Schedule]:
         """Obtener schedules de un paciente (para cuidadores)"""
         raise NotImplementedError("Este método no está disponible para este tipo de usuario")
+    
+    @staticmethod
+    def user_pk(user: UserRef):
+        return user.pk if isinstance(user, User) else user
+    
+    def get_user(self, user: UserRef, user_type: str) -> User:
+        """
+        Usuario del tipo esperado: se reutiliza la instancia recibida o se
+        consulta por id. Lanza User.DoesNotExist si no existe o el tipo no coincide.
+        """
+        if isinstance(user, User):
+            if user.user_type != user_type:
+                raise User.DoesNotExist(f"El usuario no es de tipo '{user_type}'")
+            return user
+        return User.objects.get(id=user, user_type=user_type)
+    
+    def get_permission_context(self, user: UserRef, user_type: str,
+                               permission_context: Optional[PermissionContext] = None) -> PermissionContext:
+        """
+        Reutilizar el PermissionContext del request si corresponde al mismo usuario;
+        si no, crear uno para el usuario. Lanza User.DoesNotExist si no existe.
+        """
+        if (isinstance(permission_context, PermissionContext)
+                and str(permission_context.user.pk) == str(self.user_pk(user))
+                and permission_context.user.user_type == user_type):
+            return permission_context
+        return PermissionContext(self.get_user(user, user_type))
 
 
 class PatientService(UserServiceInterface):
@@ -73,49 +110,52 @@ class PatientService(UserServiceInterface):
             **kwargs
         )
     
-    def remove_caregiver(self, user_id: int, patient_id: int, caregiver_id: int) -> Dict[str, Any]:
+    def remove_caregiver(self, user: UserRef, patient_id: int, caregiver_id: int) -> Dict[str, Any]:
         """Los pacientes no pueden remover cuidadores directamente"""
         raise PermissionDenied("Los pacientes no pueden remover cuidadores por sí mismos")
     
-    def assign_caregiver(self, user_id: int, caregiver_id: int, caregiver_type: str, **kwargs) -> Dict[str, Any]:
+    def assign_caregiver(self, user: UserRef, caregiver_id: int, caregiver_type: str, **kwargs) -> Dict[str, Any]:
         """Los pacientes no pueden asignar cuidadores directamente"""
         raise PermissionDenied("Los pacientes no pueden asignar cuidadores por sí mismos")
     
-    def can_view_patient_data(self, user_id: int, patient_id: int) -> bool:
+    def can_view_patient_data(self, user: UserRef, patient_id: int, *,
+                              permission_context: Optional[PermissionContext] = None) -> bool:
         """Los pacientes solo pueden ver sus propios datos"""
-        return str(user_id) == str(patient_id)
+        return str(self.user_pk(user)) == str(patient_id)
     
-    def can_manage_schedules(self, user_id: int, patient_id: int) -> bool:
+    def can_manage_schedules(self, user: UserRef, patient_id: int, *,
+                             permission_context: Optional[PermissionContext] = None) -> bool:
         """Los pacientes pueden gestionar sus propios schedules"""
-        return str(user_id) == str(patient_id)
+        return str(self.user_pk(user)) == str(patient_id)
     
-    def get_my_caregivers(self, user_id: int) -> Dict[str, List]:
+    def get_my_caregivers(self, user: UserRef) -> Dict[str, List]:
         """Obtener todos los cuidadores del paciente"""
         try:
-            user = User.objects.get(id=user_id, user_type='patient')
+            user = self.get_user(user, 'patient')
             return user.get_my_caregivers()
         except User.DoesNotExist:
             raise ValueError("Paciente no encontrado")
     
-    def get_my_patients(self, user_id: int) -> List[User]:
+    def get_my_patients(self, user: UserRef) -> List[User]:
         """Los pacientes no tienen pacientes asignados"""
         raise NotImplementedError("Los pacientes no pueden ver otros pacientes")
     
-    def get_patient_schedules(self, user_id: int, patient_id: int) -> List[Schedule]:
+    def get_patient_schedules(self, user: UserRef, patient_id: int, *,
+                              permission_context: Optional[PermissionContext] = None) -> List[Schedule]:
         """Los pacientes pueden ver solo sus propios schedules"""
-        if not self.can_view_patient_data(user_id, patient_id):
+        if not self.can_view_patient_data(user, patient_id):
             raise PermissionDenied("No tienes permisos para ver estos schedules")
         
         try:
-            user = User.objects.get(id=user_id, user_type='patient')
+            user = self.get_user(user, 'patient')
             return user.get_my_schedules()
         except User.DoesNotExist:
             raise ValueError("Paciente no encontrado")
     
-    def get_user_permissions(self, user_id: int) -> Dict[str, Any]:
+    def get_user_permissions(self, user: UserRef) -> Dict[str, Any]:
         """Obtener permisos específicos del paciente"""
         try:
-            user = User.objects.get(id=user_id, user_type='patient')
+            user = self.get_user(user, 'patient')
             caregivers = user.get_my_caregivers()
             
             return {
@@ -147,14 +187,15 @@ class DoctorService(UserServiceInterface):
             **kwargs
         )
     
-    def remove_caregiver(self, user_id: int, patient_id: int, caregiver_id: int) -> Dict[str, Any]:
+    def remove_caregiver(self, user: UserRef, patient_id: int, caregiver_id: int, *,
+                         permission_context: Optional[PermissionContext] = None) -> Dict[str, Any]:
         """Doctores pueden remover otros cuidadores"""
         try:
-            doctor = User.objects.get(id=user_id, user_type='doctor')
+            context = self.get_permission_context(user, 'doctor', permission_context)
             caregiver = User.objects.get(id=caregiver_id)
             
             # Verificar que el doctor tenga permisos sobre el paciente
-            if not doctor.can_view_patient_data(patient_id):
+            if not context.can_view_patient_data(patient_id):
                 raise PermissionDenied("No tienes permisos sobre este paciente")
             
             # Determinar el tipo de cuidador automáticamente
@@ -186,16 +227,17 @@ class DoctorService(UserServiceInterface):
         except User.DoesNotExist:
             raise ValueError("Usuario no encontrado")
     
-    def assign_caregiver(self, user_id: int, caregiver_id: int, caregiver_type: str, **kwargs) -> Dict[str, Any]:
+    def assign_caregiver(self, user: UserRef, caregiver_id: int, caregiver_type: str, *,
+                         permission_context: Optional[PermissionContext] = None, **kwargs) -> Dict[str, Any]:
         """Doctores pueden asignar otros cuidadores"""
-        doctor = User.objects.get(id=user_id, user_type='doctor')
+        context = self.get_permission_context(user, 'doctor', permission_context)
         patient_id = kwargs.get('patient_id')
         
         if not patient_id:
             raise ValueError("patient_id es requerido para asignar cuidadores")
         
         # Verificar permisos sobre el paciente
-        if not doctor.can_view_patient_data(patient_id):
+        if not context.can_view_patient_data(patient_id):
             raise PermissionDenied("No tienes permisos sobre este paciente")
         
         if caregiver_type == 'family':
@@ -226,45 +268,49 @@ class DoctorService(UserServiceInterface):
         else:
             raise ValueError(f"Tipo de cuidador '{caregiver_type}' no válido")
     
-    def can_view_patient_data(self, user_id: int, patient_id: int) -> bool:
+    def can_view_patient_data(self, user: UserRef, patient_id: int, *,
+                              permission_context: Optional[PermissionContext] = None) -> bool:
         """Verificar si el doctor puede ver datos del paciente"""
         try:
-            doctor = User.objects.get(id=user_id, user_type='doctor')
-            return doctor.can_view_patient_data(patient_id)
+            context = self.get_permission_context(user, 'doctor', permission_context)
+            return context.can_view_patient_data(patient_id)
         except User.DoesNotExist:
             return False
     
-    def can_manage_schedules(self, user_id: int, patient_id: int) -> bool:
+    def can_manage_schedules(self, user: UserRef, patient_id: int, *,
+                             permission_context: Optional[PermissionContext] = None) -> bool:
         """Los doctores pueden gestionar schedules de sus pacientes"""
-        return self.can_view_patient_data(user_id, patient_id)
+        return self.can_view_patient_data(user, patient_id, permission_context=permission_context)
     
-    def get_my_caregivers(self, user_id: int) -> Dict[str, List]:
+    def get_my_caregivers(self, user: UserRef) -> Dict[str, List]:
         """Los doctores no tienen cuidadores"""
         raise NotImplementedError("Los doctores no tienen cuidadores asignados")
     
-    def get_my_patients(self, user_id: int) -> List[User]:
+    def get_my_patients(self, user: UserRef) -> List[User]:
         """Obtener todos los pacientes del doctor"""
         try:
-            doctor = User.objects.get(id=user_id, user_type='doctor')
+            doctor = self.get_user(user, 'doctor')
             return doctor.get_my_patients()
         except User.DoesNotExist:
             raise ValueError("Doctor no encontrado")
     
-    def get_patient_schedules(self, user_id: int, patient_id: int) -> List[Schedule]:
+    def get_patient_schedules(self, user: UserRef, patient_id: int, *,
+                              permission_context: Optional[PermissionContext] = None) -> List[Schedule]:
         """Obtener schedules de un paciente específico"""
-        if not self.can_view_patient_data(user_id, patient_id):
-            raise PermissionDenied("No tienes permisos para ver este paciente")
-        
         try:
-            doctor = User.objects.get(id=user_id, user_type='doctor')
-            return doctor.get_patient_schedules(patient_id)
+            context = self.get_permission_context(user, 'doctor', permission_context)
         except User.DoesNotExist:
-            raise ValueError("Doctor no encontrado")
+            raise PermissionDenied("No tienes permisos para ver este paciente")
+        
+        if not context.can_view_patient_data(patient_id):
+            raise PermissionDenied("No tienes permisos para ver este paciente")
+        
+        return Schedule.objects.filter(user_id=patient_id).select_related('medication')
     
-    def get_user_permissions(self, user_id: int) -> Dict[str, Any]:
+    def get_user_permissions(self, user: UserRef) -> Dict[str, Any]:
         """Obtener permisos específicos del doctor"""
         try:
-            doctor = User.objects.get(id=user_id, user_type='doctor')
+            doctor = self.get_user(user, 'doctor')
             patients = doctor.get_my_patients()
             
             return {
@@ -303,57 +349,61 @@ class FamilyService(UserServiceInterface):
             **kwargs
         )
     
-    def remove_caregiver(self, user_id: int, patient_id: int, caregiver_id: int) -> Dict[str, Any]:
+    def remove_caregiver(self, user: UserRef, patient_id: int, caregiver_id: int) -> Dict[str, Any]:
         """Los familiares tienen permisos limitados para remover cuidadores"""
         raise PermissionDenied("Los familiares no pueden remover cuidadores")
     
-    def assign_caregiver(self, user_id: int, caregiver_id: int, caregiver_type: str, **kwargs) -> Dict[str, Any]:
+    def assign_caregiver(self, user: UserRef, caregiver_id: int, caregiver_type: str, **kwargs) -> Dict[str, Any]:
         """Los familiares no pueden asignar cuidadores"""
         raise PermissionDenied("Los familiares no pueden asignar cuidadores")
     
-    def can_view_patient_data(self, user_id: int, patient_id: int) -> bool:
+    def can_view_patient_data(self, user: UserRef, patient_id: int, *,
+                              permission_context: Optional[PermissionContext] = None) -> bool:
         """Verificar si el familiar puede ver datos del paciente"""
         try:
-            family = User.objects.get(id=user_id, user_type='family')
-            return family.can_view_patient_data(patient_id)
+            context = self.get_permission_context(user, 'family', permission_context)
+            return context.can_view_patient_data(patient_id)
         except User.DoesNotExist:
             return False
     
-    def can_manage_schedules(self, user_id: int, patient_id: int) -> bool:
+    def can_manage_schedules(self, user: UserRef, patient_id: int, *,
+                             permission_context: Optional[PermissionContext] = None) -> bool:
         """Los familiares pueden gestionar schedules según su relación"""
         try:
-            family = User.objects.get(id=user_id, user_type='family')
-            return family.can_manage_schedules(patient_id)
+            context = self.get_permission_context(user, 'family', permission_context)
+            return context.can_manage_schedules(patient_id)
         except User.DoesNotExist:
             return False
     
-    def get_my_caregivers(self, user_id: int) -> Dict[str, List]:
+    def get_my_caregivers(self, user: UserRef) -> Dict[str, List]:
         """Los familiares no tienen cuidadores"""
         raise NotImplementedError("Los familiares no tienen cuidadores asignados")
     
-    def get_my_patients(self, user_id: int) -> List[User]:
+    def get_my_patients(self, user: UserRef) -> List[User]:
         """Obtener todos los pacientes del familiar"""
         try:
-            family = User.objects.get(id=user_id, user_type='family')
+            family = self.get_user(user, 'family')
             return family.get_my_patients()
         except User.DoesNotExist:
             raise ValueError("Familiar no encontrado")
     
-    def get_patient_schedules(self, user_id: int, patient_id: int) -> List[Schedule]:
+    def get_patient_schedules(self, user: UserRef, patient_id: int, *,
+                              permission_context: Optional[PermissionContext] = None) -> List[Schedule]:
         """Obtener schedules de un paciente específico"""
-        if not self.can_view_patient_data(user_id, patient_id):
-            raise PermissionDenied("No tienes permisos para ver este paciente")
-        
         try:
-            family = User.objects.get(id=user_id, user_type='family')
-            return family.get_patient_schedules(patient_id)
+            context = self.get_permission_context(user, 'family', permission_context)
         except User.DoesNotExist:
-            raise ValueError("Familiar no encontrado")
+            raise PermissionDenied("No tienes permisos para ver este paciente")
+        
+        if not context.can_view_patient_data(patient_id):
+            raise PermissionDenied("No tienes permisos para ver este paciente")
+        
+        return Schedule.objects.filter(user_id=patient_id).select_related('medication')
     
-    def get_user_permissions(self, user_id: int) -> Dict[str, Any]:
+    def get_user_permissions(self, user: UserRef) -> Dict[str, Any]:
         """Obtener permisos específicos del familiar"""
         try:
-            family = User.objects.get(id=user_id, user_type='family')
+            family = self.get_user(user, 'family')
             patients = family.get_my_patients()
             
             # Obtener relaciones específicas para saber permisos detallados
@@ -393,6 +443,43 @@ class FamilyService(UserServiceInterface):
             raise ValueError("Usuario no encontrado")
 
 
+class BoundUserService:
+    """
+    Servicio ligado a un usuario ya cargado y a su PermissionContext.
+    Los métodos del servicio se llaman sin el usuario: se pasa la instancia
+    ligada y el contexto compartido, sin volver a consultar el usuario ni sus relaciones.
+    """
+    
+    def __init__(self, service: UserServiceInterface, user: User,
+                 permission_context: Optional[PermissionContext] = None):
+        self.service = service
+        self.user = user
+        self.permission_context = permission_context or PermissionContext(user)
+    
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _accepts_permission_context(method) -> bool:
+        return 'permission_context' in inspect.signature(method).parameters
+    
+    def get_method(self, name: str):
+        """Método público del servicio con el usuario y el contexto ya ligados"""
+        method = getattr(self.service, name, None)
+        if name.startswith('_') or not callable(method):
+            raise AttributeError(f"El método '{name}' no está disponible para este tipo de usuario")
+        
+        accepts_context = self._accepts_permission_context(getattr(type(self.service), name))
+        
+        def bound_method(*args, **kwargs):
+            if accepts_context:
+                kwargs['permission_context'] = self.permission_context
+            return method(self.user, *args, **kwargs)
+        
+        return bound_method
+    
+    def __getattr__(self, name):
+        return self.get_method(name)
+
+
 class UserServiceFactory:
     """Factory principal que retorna el servicio específico según el tipo de usuario"""
     
@@ -411,14 +498,36 @@ class UserServiceFactory:
         return service
     
     @classmethod
-    def get_service_by_user_id(cls, user_id: int) -> UserServiceInterface:
-        """Obtener el servicio basado en el ID del usuario"""
+    def get_service_by_user_id(cls, user: UserRef,
+                               permission_context: Optional[PermissionContext] = None) -> UserServiceInterface:
+        """
+        Obtener el servicio basado en el usuario (instancia o ID).
+        Si el ID corresponde al usuario del PermissionContext se usa su tipo sin consultar.
+        """
+        return cls.get_service(cls.resolve_user(user, permission_context).user_type)
+    
+    @classmethod
+    def resolve_user(cls, user: UserRef,
+                     permission_context: Optional[PermissionContext] = None) -> User:
+        """Usuario ya cargado (instancia o el del PermissionContext) o consultado por su ID"""
+        if isinstance(user, User):
+            return user
+        if isinstance(permission_context, PermissionContext) and str(permission_context.user.pk) == str(user):
+            return permission_context.user
         try:
-            user = User.objects.get(id=user_id)
-            return cls.get_service(user.user_type)
-        except User.DoesNotExist:
+            return User.objects.get(id=user)
+        except (User.DoesNotExist, ValueError):
             raise ValueError("Usuario no encontrado")
     
+    @classmethod
+    def for_user(cls, user: UserRef,
+                 permission_context: Optional[PermissionContext] = None) -> BoundUserService:
+        """Servicio ligado al usuario (y al PermissionContext del request, si se entrega)"""
+        user = cls.resolve_user(user, permission_context)
+        if not isinstance(permission_context, PermissionContext) or permission_context.user.pk != user.pk:
+            permission_context = None
+        return BoundUserService(cls.get_service(user.user_type), user, permission_context)
+    
     @classmethod
     def register_service(cls, user_type: str, service: UserServiceInterface):
         """Registrar un nuevo servicio dinámicamente"""
@@ -431,12 +540,11 @@ class UserServiceFactory:
         return service.create_user(email, password, name, **kwargs)
     
     @classmethod
-    def execute_user_method(cls, user_id: int, method_name: str, *args, **kwargs):
-        """Ejecutar un método específico del servicio de usuario"""
-        service = cls.get_service_by_user_id(user_id)
-        method = getattr(service, method_name, None)
-        
-        if not method:
-            raise AttributeError(f"El método '{method_name}' no está disponible para este tipo de usuario")
-        
-        return method(user_id, *args, **kwargs)
+    def execute_user_method(cls, user: UserRef, method_name: str, *args,
+                            permission_context: Optional[PermissionContext] = None, **kwargs):
+        """
+        Ejecutar un método específico del servicio de usuario.
+        El usuario se carga a lo sumo una vez y se reutiliza en el método.
+        """
+        service = cls.for_user(user, permission_context)
+        return service.get_method(method_name)(*args, **kwargs)
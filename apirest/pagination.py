@@ -0,0 +1,114 @@
+"""
+Paginación por keyset (cursor) para listados grandes
+"""
+import base64
+import binascii
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+
+class KeysetPagination:
+    """
+    Paginación por keyset sobre (campo de orden, id).
+    El cursor es opaco para el cliente: base64 de '<valor>|<id>'.
+    A diferencia de OFFSET, el costo de cada página no crece con la posición.
+    """
+
+    ordering_field = 'created_at'
+    page_size = 20
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self, ordering_field=None, page_size=None):
+        self.ordering_field = ordering_field or self.ordering_field
+        self.page_size = page_size or self.page_size
+
+    def get_params(self, request):
+        """Query params de DRF o, en vistas de Django, request.GET"""
+        return getattr(request, 'query_params', request.GET)
+
+    def get_page_size(self, request):
+        """Tamaño de página solicitado, acotado a max_page_size"""
+        value = self.get_params(request).get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise ValueError(f"{self.page_size_query_param} debe ser un entero")
+        if page_size <= 0:
+            raise ValueError(f"{self.page_size_query_param} debe ser mayor que cero")
+        return min(page_size, self.max_page_size)
+
+    def parse_value(self, raw):
+        """Convertir el valor del cursor al tipo del campo de orden"""
+        return parse_datetime(raw)
+
+    def format_value(self, value):
+        return value.isoformat()
+
+    def encode_cursor(self, obj):
+        value = getattr(obj, self.ordering_field)
+        raw = f"{'' if value is None else self.format_value(value)}|{obj.pk}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """Retorna (valor, id); valor es None para filas sin valor de orden"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+            value, pk = raw.rsplit('|', 1)
+            pk = int(pk)
+        except (ValueError, binascii.Error, UnicodeDecodeError):
+            raise ValueError("Cursor inválido")
+
+        if not value:
+            return None, pk
+        parsed = self.parse_value(value)
+        if parsed is None:
+            raise ValueError("Cursor inválido")
+        return parsed, pk
+
+    def order_queryset(self, queryset):
+        # Las filas sin valor de orden van primero en todos los motores
+        return queryset.order_by(F(self.ordering_field).asc(nulls_first=True), 'pk')
+
+    def filter_after(self, queryset, cursor):
+        """Filas estrictamente posteriores al cursor según (campo, id)"""
+        value, pk = self.decode_cursor(cursor)
+        field = self.ordering_field
+        if value is None:
+            condition = Q(**{f'{field}__isnull': True, 'pk__gt': pk}) | Q(**{f'{field}__isnull': False})
+        else:
+            condition = Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+        return queryset.filter(condition)
+
+    def paginate_queryset(self, queryset, request):
+        """
+        Retorna (filas de la página, siguiente cursor o None).
+        Se lee una fila extra para saber si hay más páginas.
+        """
+        page_size = self.get_page_size(request)
+        queryset = self.order_queryset(queryset)
+
+        cursor = self.get_params(request).get(self.cursor_query_param)
+        if cursor:
+            queryset = self.filter_after(queryset, cursor)
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = self.encode_cursor(rows[-1]) if has_more else None
+
+        return rows, next_cursor
+
+
+class TextKeysetPagination(KeysetPagination):
+    """Keyset sobre un campo de texto (p. ej. un nombre normalizado con Lower)"""
+
+    def parse_value(self, raw):
+        return raw
+
+    def format_value(self, value):
+        return value
@@ -5,6 +5,7 @@ from .factory_serializers import (
     CaregiverRemovalSerializer,
     UserPermissionsSerializer,
     PatientScheduleRequestSerializer,
+    PatientAdherenceRequestSerializer,
     UserServiceMethodSerializer
 )
 from .admin_serializers import (
@@ -20,6 +21,7 @@ __all__ = [
     'CaregiverRemovalSerializer',
     'UserPermissionsSerializer',
     'PatientScheduleRequestSerializer',
+    'PatientAdherenceRequestSerializer',
     'UserServiceMethodSerializer',
     'ScheduleAdminSerializer',
     'UserAdminSerializer',
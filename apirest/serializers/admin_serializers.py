@@ -1,8 +1,16 @@
+from django.db.models import Count, Q
 from rest_framework import serializers
 from api.models import User, Schedule, Medication
 from django.utils import timezone
 
 
+def get_today(context):
+    """Fecha de 'hoy' evaluada una sola vez por request (se guarda en el contexto)"""
+    if 'today' not in context:
+        context['today'] = timezone.now().date()
+    return context['today']
+
+
 class ScheduleAdminSerializer(serializers.ModelSerializer):
     """Serializer para schedules en vista administrativa"""
     medication_name = serializers.SerializerMethodField()
@@ -20,7 +28,7 @@ class ScheduleAdminSerializer(serializers.ModelSerializer):
     
     def get_is_active(self, obj):
         if obj.end_date:
-            return obj.end_date >= timezone.now().date()
+            return obj.end_date >= get_today(self.context)
         return True
 
 
@@ -37,16 +45,48 @@ class UserAdminSerializer(serializers.ModelSerializer):
             'is_active', 'auth0_id', 'schedules', 'total_schedules', 'active_schedules'
         ]
     
+    @staticmethod
+    def annotate_schedule_counters(queryset, today):
+        """
+        Contadores de schedules calculados en la base de datos con una
+        sola consulta agrupada (en lugar de contar en Python por usuario)
+        """
+        return queryset.annotate(
+            total_schedules_count=Count('schedule'),
+            active_schedules_count=Count(
+                'schedule',
+                filter=Q(schedule__end_date__isnull=True) | Q(schedule__end_date__gte=today)
+            ),
+        )
+    
+    @staticmethod
+    def prefetched_schedules(obj):
+        """Schedules precargados con prefetch_related, o None si no se precargaron"""
+        return getattr(obj, '_prefetched_objects_cache', {}).get('schedule_set')
+    
     def get_schedules(self, obj):
-        schedules = obj.schedule_set.all().order_by('-created_at')
-        return ScheduleAdminSerializer(schedules, many=True).data
+        schedules = obj.schedule_set.all()
+        # Con prefetch el orden ya viene de la vista; ordenar aquí lo descartaría
+        if self.prefetched_schedules(obj) is None:
+            schedules = schedules.order_by('-created_at')
+        return ScheduleAdminSerializer(schedules, many=True, context=self.context).data
     
     def get_total_schedules(self, obj):
+        if hasattr(obj, 'total_schedules_count'):
+            return obj.total_schedules_count
+        prefetched = self.prefetched_schedules(obj)
+        if prefetched is not None:
+            return len(prefetched)
         return obj.schedule_set.count()
     
     def get_active_schedules(self, obj):
-        active_count = 0
-        for schedule in obj.schedule_set.all():
-            if not schedule.end_date or schedule.end_date >= timezone.now().date():
-                active_count += 1
-        return active_count
+        if hasattr(obj, 'active_schedules_count'):
+            return obj.active_schedules_count
+        today = get_today(self.context)
+        # Sin anotación se cuenta sobre el prefetch: filtrar el related manager haría una consulta por usuario
+        prefetched = self.prefetched_schedules(obj)
+        if prefetched is not None:
+            return sum(1 for schedule in prefetched if schedule.end_date is None or schedule.end_date >= today)
+        return obj.schedule_set.filter(
+            Q(end_date__isnull=True) | Q(end_date__gte=today)
+        ).count()
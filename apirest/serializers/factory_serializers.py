@@ -148,8 +148,22 @@ class PatientScheduleRequestSerializer(serializers.Serializer):
             raise serializers.ValidationError("Paciente no encontrado")
 
 
+class PatientAdherenceRequestSerializer(serializers.Serializer):
+    """Serializer para solicitar métricas de adherencia"""
+    patient_id = serializers.IntegerField(
+        required=False,
+        help_text="ID del paciente; si se omite, resumen de todos los pacientes del cuidador"
+    )
+    days = serializers.IntegerField(
+        required=False, default=30, min_value=1, max_value=365,
+        help_text="Días de la ventana para medicamentos, retrasos y rachas"
+    )
+
+
 class UserServiceMethodSerializer(serializers.Serializer):
     """Serializer genérico para ejecutar métodos del servicio de usuario"""
+    RESERVED_KWARGS = ('user', 'permission_context')
+    
     method_name = serializers.CharField(help_text="Nombre del método a ejecutar")
     args = serializers.ListField(
         required=False, 
@@ -179,3 +193,12 @@ class UserServiceMethodSerializer(serializers.Serializer):
             )
         
         return value
+    
+    def validate_kwargs(self, value):
+        """El usuario y su PermissionContext los entrega el servidor, no el cliente"""
+        reserved = sorted(set(value) & set(self.RESERVED_KWARGS))
+        if reserved:
+            raise serializers.ValidationError(
+                f"Argumentos reservados no permitidos: {reserved}"
+            )
+        return value
@@ -1,3 +1,4 @@
+from django.db.models import Count, Prefetch
 from rest_framework import serializers
 from api.models import User, DoctorPatientRelation, FamilyPatientRelation
 from .user_serializers import UserBasicInfoSerializer
@@ -42,12 +43,35 @@ class PatientListSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at']
     
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Plan de prefetch para listar pacientes con consultas constantes:
+        relaciones activas con Prefetch + conteo de schedules anotado.
+        """
+        return queryset.annotate(
+            schedule_count=Count('schedule', distinct=True)
+        ).prefetch_related(
+            Prefetch(
+                'patient_doctor_relations',
+                queryset=DoctorPatientRelation.objects.filter(is_active=True).select_related('doctor'),
+                to_attr='active_doctor_relations'
+            ),
+            Prefetch(
+                'patient_family_relations',
+                queryset=FamilyPatientRelation.objects.filter(is_active=True).select_related('family_member'),
+                to_attr='active_family_relations'
+            ),
+        )
+    
     def get_doctors(self, obj):
         """Obtener doctores asignados al paciente"""
-        doctor_relations = DoctorPatientRelation.objects.filter(
-            patient=obj, 
-            is_active=True
-        ).select_related('doctor')
+        doctor_relations = getattr(obj, 'active_doctor_relations', None)
+        if doctor_relations is None:
+            doctor_relations = DoctorPatientRelation.objects.filter(
+                patient=obj, 
+                is_active=True
+            ).select_related('doctor')
         
         return [
             {
@@ -61,10 +85,12 @@ class PatientListSerializer(serializers.ModelSerializer):
     
     def get_family_members(self, obj):
         """Obtener familiares asignados al paciente"""
-        family_relations = FamilyPatientRelation.objects.filter(
-            patient=obj,
-            is_active=True
-        ).select_related('family_member')
+        family_relations = getattr(obj, 'active_family_relations', None)
+        if family_relations is None:
+            family_relations = FamilyPatientRelation.objects.filter(
+                patient=obj,
+                is_active=True
+            ).select_related('family_member')
         
         return [
             {
@@ -79,7 +105,9 @@ class PatientListSerializer(serializers.ModelSerializer):
         ]
     
     def get_total_schedules(self, obj):
-        """Obtener total de schedules activos del paciente"""
+        """Obtener total de schedules del paciente"""
+        if hasattr(obj, 'schedule_count'):
+            return obj.schedule_count
         from api.models import Schedule
         return Schedule.objects.filter(user=obj).count()
     
@@ -101,7 +129,7 @@ class PatientDetailSerializer(PatientListSerializer):
     def get_recent_schedules(self, obj):
         """Obtener los últimos 5 schedules del paciente"""
         from api.models import Schedule
-        schedules = Schedule.objects.filter(user=obj).order_by('-created_at')[:5]
+        schedules = Schedule.objects.filter(user=obj).select_related('medication').order_by('-created_at')[:5]
         
         return [
             {
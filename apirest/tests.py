@@ -1,3 +1,297 @@
+import json
+from datetime import date, timedelta
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.access_cache import access_cache
+from api.adherence import DailyAdherenceRollup
+from api.models import UserCreationService, Medication, Schedule, Intake, User
+from api.permissions import PermissionContext
+from api.testing import make_user
+from .factories import UserServiceFactory
+from .serializers.admin_serializers import UserAdminSerializer
+
+
+class CaregiverPatientsViewTests(TestCase):
+    """El listado DRF de pacientes usa un plan de prefetch con consultas constantes"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor', 'v2_doctor@example.com', name='Doctor V2')
+        self.medication = Medication.objects.create(name='Aspirina', form='tablet')
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+        self.created = 0
+
+    def add_patients(self, count):
+        for index in range(count):
+            patient = make_user('patient', f'v2_paciente{self.created}@example.com', name=f'Paciente {index}')
+            family = make_user('family', f'v2_familia{self.created}@example.com', name=f'Familiar {index}')
+            self.created += 1
+            UserCreationService.assign_doctor_to_patient(self.doctor.id, patient.id)
+            UserCreationService.assign_family_to_patient(family.id, patient.id, 'spouse')
+            for day in (1, 2):
+                Schedule.objects.create(
+                    user=patient, medication=self.medication, start_date=date(2025, 1, day),
+                    pattern='daily', dose_amount='1'
+                )
+
+    def get_patients(self):
+        return self.client.get(
+            reverse('apirest:caregiver-patients'), HTTP_USER_ID=str(self.doctor.id)
+        )
+
+    def test_query_count_is_constant(self):
+        self.add_patients(1)
+        with CaptureQueriesContext(connection) as small_panel:
+            self.get_patients()
+
+        self.add_patients(10)
+        with CaptureQueriesContext(connection) as large_panel:
+            response = self.get_patients()
+
+        patients = response.json()['patients']
+        self.assertEqual(len(patients), 11)
+        self.assertEqual(patients[0]['total_schedules'], 2)
+        self.assertEqual(len(patients[0]['doctors']), 1)
+        self.assertEqual(patients[0]['family_members'][0]['relationship'], 'spouse')
+        self.assertEqual(len(large_panel.captured_queries), len(small_panel.captured_queries))
+
+
+class AdminAllUsersSchedulesViewTests(TestCase):
+    """Paginación por keyset y streaming NDJSON del listado administrativo"""
+
+    def setUp(self):
+        self.doctor = make_user('doctor', 'admin_doctor@example.com', name='Doctor Admin')
+        self.medication = Medication.objects.create(name='Aspirina', form='tablet')
+        for index in range(4):
+            patient = make_user('patient', f'admin_paciente{index}@example.com', name=f'Paciente {index}')
+            Schedule.objects.create(
+                user=patient, medication=self.medication, start_date=date(2025, 1, 1),
+                pattern='daily', dose_amount='1'
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def get_users(self, **params):
+        return self.client.get(
+            reverse('apirest:admin-method'), params, HTTP_USER_ID=str(self.doctor.id)
+        )
+
+    def test_keyset_pagination_walks_all_users(self):
+        seen = []
+        params = {'page_size': 2}
+        while True:
+            body = self.get_users(**params).json()
+            seen.extend(user['id'] for user in body['users'])
+            self.assertEqual(body['statistics']['total_users'], 5)
+            self.assertEqual(body['statistics']['total_schedules'], 4)
+            self.assertEqual(body['statistics']['users_by_type'], {'patient': 4, 'doctor': 1})
+            if not body['pagination']['has_more']:
+                break
+            params['cursor'] = body['pagination']['next_cursor']
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_invalid_cursor(self):
+        response = self.get_users(cursor='no-es-un-cursor')
+        self.assertEqual(response.status_code, 400)
+
+    def test_ndjson_stream(self):
+        response = self.get_users(stream='ndjson')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[0]['statistics']['total_users'], 5)
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(sum(line['user']['total_schedules'] for line in lines[1:]), 4)
+
+    def test_schedule_counters_are_annotated(self):
+        patient = make_user('patient', 'admin_vencido@example.com', name='Paciente Vencido')
+        for end_date in (date(2020, 1, 31), None):
+            Schedule.objects.create(
+                user=patient, medication=self.medication, start_date=date(2020, 1, 1),
+                end_date=end_date, pattern='daily', dose_amount='1'
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            body = self.get_users(page_size=50).json()
+
+        counters = {user['email']: (user['total_schedules'], user['active_schedules']) for user in body['users']}
+        self.assertEqual(counters['admin_vencido@example.com'], (2, 1))
+        self.assertEqual(counters['admin_paciente0@example.com'], (1, 1))
+        # estadísticas + página anotada + prefetch de schedules
+        self.assertEqual(len(queries.captured_queries), 3)
+
+    def test_schedule_counters_use_prefetch_without_annotation(self):
+        patient = make_user('patient', 'admin_prefetch@example.com', name='Paciente Prefetch')
+        for end_date in (date(2020, 1, 31), None):
+            Schedule.objects.create(
+                user=patient, medication=self.medication, start_date=date(2020, 1, 1),
+                end_date=end_date, pattern='daily', dose_amount='1'
+            )
+        users = User.objects.filter(user_type='patient').prefetch_related('schedule_set__medication')
+
+        with CaptureQueriesContext(connection) as queries:
+            data = UserAdminSerializer(users, many=True, context={}).data
+
+        counters = {user['email']: (user['total_schedules'], user['active_schedules']) for user in data}
+        self.assertEqual(counters['admin_prefetch@example.com'], (2, 1))
+        # usuarios + schedules + medicamentos, sin importar cuántos usuarios haya
+        self.assertEqual(len(queries.captured_queries), 3)
+
+
+class ActingUserTests(TestCase):
+    """Los servicios reutilizan el usuario ya resuelto por el request"""
+
+    def setUp(self):
+        access_cache.clear()
+        self.doctor = make_user('doctor', 'actuante_doctor@example.com', name='Doctor')
+        self.patient = make_user('patient', 'actuante_paciente@example.com', name='Paciente')
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.patient.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def test_services_accept_loaded_user(self):
+        with CaptureQueriesContext(connection) as queries:
+            patients = UserServiceFactory.execute_user_method(self.doctor, 'get_my_patients')
+
+        self.assertEqual(patients, [self.patient])
+        # Solo las relaciones del doctor con sus pacientes
+        self.assertEqual(len(queries.captured_queries), 1)
+
+    def test_patient_schedules_without_user_lookup(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('apirest:patient-schedules'), {'patient_id': self.patient.id}, format='json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['can_manage'])
+        # validación del paciente + relaciones (compartidas por ambas verificaciones) + schedules
+        self.assertEqual(len(queries.captured_queries), 3)
+
+
+class BoundUserServiceTests(TestCase):
+    """El servicio ligado reutiliza el usuario y sus relaciones ya cargadas"""
+
+    def setUp(self):
+        access_cache.clear()
+        self.doctor = make_user('doctor', 'ligado_doctor@example.com', name='Doctor')
+        self.patient = make_user('patient', 'ligado_paciente@example.com', name='Paciente')
+        self.family = make_user('family', 'ligado_familia@example.com', name='Familiar')
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.patient.id)
+        Schedule.objects.create(
+            user=self.patient, medication=Medication.objects.create(name='Metformina', form='tablet'),
+            start_date=date(2025, 1, 1), pattern='daily', dose_amount='1'
+        )
+
+    def test_permission_checks_share_relations(self):
+        service = UserServiceFactory.for_user(self.doctor)
+
+        with CaptureQueriesContext(connection) as queries:
+            schedules = list(service.get_patient_schedules(self.patient.id))
+            can_manage = service.can_manage_schedules(self.patient.id)
+            service.assign_caregiver(self.family.id, 'family', patient_id=self.patient.id)
+
+        self.assertEqual(len(schedules), 1)
+        self.assertTrue(can_manage)
+        # Antes: doctor + relación por cada verificación; ahora las relaciones se cargan una vez
+        relation_lookups = [
+            query for query in queries.captured_queries
+            if 'FROM "DoctorPatientRelations"' in query['sql']
+        ]
+        self.assertEqual(len(relation_lookups), 1)
+
+    def test_execute_by_id_loads_user_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            patients = UserServiceFactory.execute_user_method(self.doctor.id, 'get_my_patients')
+
+        self.assertEqual(patients, [self.patient])
+        # usuario + relaciones del doctor
+        self.assertEqual(len(queries.captured_queries), 2)
+
+    def test_service_by_id_uses_context_user(self):
+        context = PermissionContext(self.doctor)
+        with CaptureQueriesContext(connection) as queries:
+            service = UserServiceFactory.get_service_by_user_id(self.doctor.id, context)
+            bound = UserServiceFactory.for_user(str(self.doctor.id), context)
+
+        self.assertEqual(type(service).__name__, 'DoctorService')
+        self.assertIs(bound.user, self.doctor)
+        self.assertEqual(len(queries.captured_queries), 0)
+
+    def test_reserved_kwargs_are_rejected(self):
+        client = APIClient()
+        client.force_authenticate(self.doctor)
+        for reserved in ('permission_context', 'user'):
+            response = client.post(reverse('apirest:user-method'), {
+                'method_name': 'can_view_patient_data',
+                'args': [self.patient.id],
+                'kwargs': {reserved: 1},
+            }, format='json')
+
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('kwargs', response.json()['errors'])
+
+    def test_private_methods_not_exposed(self):
+        with self.assertRaises(AttributeError):
+            UserServiceFactory.execute_user_method(self.doctor, '_accepts_permission_context')
+        with self.assertRaises(AttributeError):
+            UserServiceFactory.execute_user_method(self.doctor, 'get_my_caregivers_typo')
+
+
+class PatientAdherenceViewTests(TestCase):
+    """Endpoint de adherencia junto a patient-schedules"""
+
+    def setUp(self):
+        access_cache.clear()
+        self.doctor = make_user('doctor', 'adherencia_doctor@example.com', name='Doctor')
+        self.patient = make_user('patient', 'adherencia_vista@example.com', name='Paciente')
+        self.stranger = make_user('patient', 'adherencia_ajeno@example.com', name='Ajeno')
+        UserCreationService.assign_doctor_to_patient(self.doctor.id, self.patient.id)
+        schedule = Schedule.objects.create(
+            user=self.patient, medication=Medication.objects.create(name='Metformina', form='tablet'),
+            start_date=date(2025, 1, 1), pattern='daily', dose_amount='1'
+        )
+        now = timezone.now()
+        Intake.objects.bulk_create([
+            Intake(
+                schedule=schedule, planned_at=now - timedelta(days=day), status=status,
+                taken_at=now - timedelta(days=day) + timedelta(minutes=20) if status == 'taken' else None
+            )
+            for day, status in ((1, 'taken'), (2, 'taken'), (3, 'missed'), (4, 'taken'))
+        ])
+        DailyAdherenceRollup.rebuild()
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor)
+
+    def post(self, data):
+        return self.client.post(reverse('apirest:patient-adherence'), data, format='json')
+
+    def test_patient_report(self):
+        response = self.post({'patient_id': self.patient.id, 'days': 7})
+
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['windows']['7']['adherence'], 0.75)
+        self.assertEqual(body['medications'][0]['medication_name'], 'Metformina')
+        self.assertEqual(body['lateness']['buckets']['15-30'], 3)
+        self.assertEqual(body['streaks'], {'current': 2, 'longest': 2})
+
+    def test_caregiver_summary(self):
+        response = self.post({})
+
+        patients = response.json()['patients']
+        self.assertEqual([row['patient_id'] for row in patients], [self.patient.id])
+        self.assertEqual(patients[0]['planned'], 4)
+
+    def test_requires_access_to_patient(self):
+        response = self.post({'patient_id': self.stranger.id})
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 403)
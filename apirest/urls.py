@@ -9,6 +9,7 @@ from .advanced_views import (
     UserPermissionsViewV2,
     CaregiverManagementViewV2,
     PatientSchedulesViewV2,
+    PatientAdherenceViewV2,
     UserServiceMethodViewV2,
     AdminAllUsersSchedulesView
 
@@ -22,6 +23,7 @@ urlpatterns = [
     path('users/permissions/', UserPermissionsViewV2.as_view(), name='user-permissions'),
     path('caregivers/manage/', CaregiverManagementViewV2.as_view(), name='caregiver-management'),
     path('patient/schedules/', PatientSchedulesViewV2.as_view(), name='patient-schedules'),
+    path('patient/adherence/', PatientAdherenceViewV2.as_view(), name='patient-adherence'),
     path('users/execute-method/', UserServiceMethodViewV2.as_view(), name='user-method'),
     path('admin/patients/', AdminAllUsersSchedulesView.as_view(), name='admin-method'),
     
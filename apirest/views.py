@@ -7,6 +7,7 @@ from rest_framework.generics import ListAPIView
 from django.db import transaction
 
 from api.models import User, UserCreationService
+from api.permissions import PermissionMixin
 from .serializers import (
     UserRegistrationSerializer, 
     UserSerializer, 
@@ -14,21 +15,6 @@ from .serializers import (
 )
 
 
-class PermissionMixin:
-    """Mixin para validar permisos de usuario con DRF"""
-    
-    def get_user_from_request(self, request):
-        """Obtener usuario autenticado desde header"""
-        user_id = request.META.get('HTTP_USER_ID')
-        if not user_id:
-            raise ValueError("User-ID header requerido")
-        
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            raise ValueError("Usuario no encontrado")
-
-
 class UserRegistrationView(APIView):
     """Vista DRF para registro de usuarios usando Factory Method"""
     permission_classes = [AllowAny]
@@ -90,8 +76,10 @@ class CaregiverPatientsView(APIView, PermissionMixin):
                     'error': 'Solo doctores y familiares pueden acceder a esta información'
                 }, status=status.HTTP_403_FORBIDDEN)
             
-            # Obtener pacientes según el tipo de usuario
-            patients = user.get_my_patients()
+            # Obtener pacientes según el tipo de usuario con el plan de prefetch
+            patients = list(PatientListSerializer.setup_eager_loading(
+                user.get_my_patients_queryset()
+            ))
             
             # Serializar los datos
             serializer = PatientListSerializer(patients, many=True)
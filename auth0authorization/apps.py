@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class Auth0AuthorizationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'auth0authorization'
+
+    def ready(self):
+        from . import signals  # noqa: F401
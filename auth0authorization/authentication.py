@@ -1,14 +1,48 @@
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework import exceptions
 from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.blacklist.exceptions import MissingToken
 from rest_framework_jwt.compat import gettext_lazy as _
 
+from .token_cache import VerifiedTokenCache
+
+
+token_cache = VerifiedTokenCache(maxsize=getattr(settings, 'JWT_VERIFIED_TOKEN_CACHE_SIZE', 1024))
+
 
 class CustomJSONWebTokenAuthentication(JSONWebTokenAuthentication):
     """
     Overrides Rest Framework authentication logic.
+    Verified tokens are cached until their 'exp' so repeated requests with the
+    same token skip the signature check.
+    A cache hit does NOT skip the user lookup: the user is re-loaded by its
+    primary key (one query plus its groups) on every request, so deactivations
+    made without signals take effect on the next request.
     """
 
+    def authenticate(self, request):
+        try:
+            token = self.get_token_from_request(request)
+        except MissingToken:
+            return None
+        if token is None:
+            return None
+
+        # With the blacklist app every token must be checked against the database
+        if not apps.is_installed('rest_framework_jwt.blacklist'):
+            cached = token_cache.get(token)
+            user = self.get_active_user(pk=cached.user_id) if cached is not None else None
+            if user is not None:
+                return user, token
+
+        self._verified_payload = None
+        result = super().authenticate(request)
+        if result is not None and result[0] is not None and self._verified_payload is not None:
+            token_cache.set(token, self._verified_payload, result[0].pk)
+        return result
+
     def authenticate_credentials(self, payload):
         """
         Returns an active user that matches the payload's auth_id
@@ -20,12 +54,25 @@ class CustomJSONWebTokenAuthentication(JSONWebTokenAuthentication):
             msg = _('Invalid payload.')
             raise exceptions.AuthenticationFailed(msg)
 
+        user = self.get_active_user(auth0_id=auth_id)
+        if user is None:
+            return None
+
+        self._verified_payload = payload
+        return user
+
+    @staticmethod
+    def get_active_user(**lookup):
+        """
+        Returns the user matching the lookup, or None if it does not exist.
+        Raises AuthenticationFailed if the account is disabled.
+        """
+        UserModel = get_user_model()
         try:
-            UserModel = get_user_model()
             # Prefetch groups to optimize resolver_requires_role and resolver_requires_roles decorator.
             # This is done so that we don't have to query user.groups each time
             # the decorator is executed.
-            user = UserModel.objects.prefetch_related('groups').get(auth0_id=auth_id)
+            user = UserModel.objects.prefetch_related('groups').get(**lookup)
         except UserModel.DoesNotExist:
             return None
 
@@ -33,4 +80,4 @@ class CustomJSONWebTokenAuthentication(JSONWebTokenAuthentication):
             msg = _('User account is disabled.')
             raise exceptions.AuthenticationFailed(msg)
 
-        return user
\ No newline at end of file
+        return user
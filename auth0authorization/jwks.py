@@ -0,0 +1,103 @@
+"""
+Cache en proceso de las llaves públicas JWKS de Auth0
+Las llaves se parsean una sola vez y se guardan por 'kid' con un TTL.
+"""
+import json
+import threading
+import time
+
+import jwt
+import requests
+
+
+class JWKSKeyStore:
+    """
+    Llaves públicas RSA indexadas por 'kid'.
+
+    - Se refrescan al vencer el TTL o al encontrar un 'kid' desconocido.
+    - Solo un hilo descarga el JWKS a la vez (single-flight); los demás
+      esperan y usan el resultado.
+    - No se intenta más de una descarga cada min_refresh_interval segundos,
+      ni por 'kid' desconocidos ni si la fuente falla (se usan las llaves conocidas).
+    - La fuente puede ser una URL http(s) o un archivo JWKS local.
+    """
+
+    def __init__(self, source, ttl=600, min_refresh_interval=30, timeout=5, seed_file=None):
+        self.source = source
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+        self.fetch_count = 0
+        if seed_file:
+            self.load_file(seed_file)
+
+    @staticmethod
+    def parse_jwks(jwks):
+        """{kid: llave pública} a partir de un documento JWKS"""
+        keys = {}
+        for jwk in jwks.get('keys', []):
+            if jwk.get('kty') != 'RSA' or 'kid' not in jwk:
+                continue
+            keys[jwk['kid']] = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+        return keys
+
+    def load_jwks(self, jwks):
+        """Reemplazar las llaves con las de un documento JWKS"""
+        keys = self.parse_jwks(jwks)
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def load_file(self, path):
+        """Pre-cargar las llaves desde un archivo JWKS local"""
+        with open(path) as jwks_file:
+            self.load_jwks(json.load(jwks_file))
+
+    def fetch(self):
+        """Descargar el documento JWKS de la fuente configurada"""
+        self.fetch_count += 1
+        if self.source.startswith(('http://', 'https://')):
+            response = requests.get(self.source, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        with open(self.source) as jwks_file:
+            return json.load(jwks_file)
+
+    def is_expired(self):
+        return self._fetched_at is None or time.monotonic() - self._fetched_at >= self.ttl
+
+    def _refresh(self, kid):
+        with self._lock:
+            now = time.monotonic()
+            # Otro hilo pudo haber refrescado mientras se esperaba el lock
+            if kid in self._keys and not self.is_expired():
+                return
+            if self._last_attempt is not None and now - self._last_attempt < self.min_refresh_interval:
+                return
+
+            self._last_attempt = now
+            try:
+                keys = self.parse_jwks(self.fetch())
+            except (requests.RequestException, OSError, ValueError):
+                # Si la fuente no responde se siguen usando las llaves conocidas
+                if not self._keys:
+                    raise
+                return
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def get_key(self, kid):
+        """Llave pública para el 'kid' dado, o None si no existe en el JWKS"""
+        if kid not in self._keys or self.is_expired():
+            self._refresh(kid)
+        return self._keys.get(kid)
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_attempt = None
@@ -0,0 +1,16 @@
+"""
+Invalidación del cache de tokens verificados
+Al guardar o borrar un usuario se descartan sus tokens cacheados, así el
+siguiente request vuelve a verificar la firma y el payload completo.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import token_cache
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def evict_cached_tokens(sender, instance, **kwargs):
+    """Descartar los tokens del usuario (ej: al desactivarlo o cambiar su auth0_id)"""
+    token_cache.evict_user(instance.pk)
@@ -1,3 +1,208 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import exceptions
+from rest_framework.test import APIRequestFactory
+
+from api.testing import make_user
+from . import utils
+from .authentication import CustomJSONWebTokenAuthentication, token_cache
+from .jwks import JWKSKeyStore
+
+
+def make_signing_key(kid):
+    """Llave RSA de prueba y su JWK público"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+    return private_key, jwk
+
+
+def make_token(private_key, kid, **claims):
+    payload = {
+        'sub': 'auth0|prueba',
+        'aud': settings.JWT_AUDIENCE,
+        'iss': settings.JWT_AUTH['JWT_ISSUER'],
+        'exp': int(time.time()) + 3600,
+    }
+    payload.update(claims)
+    return jwt.encode(payload, private_key, algorithm='RS256', headers={'kid': kid})
+
+
+class JWKSKeyStoreTests(SimpleTestCase):
+    """Las llaves se leen de un archivo JWKS local en lugar del endpoint de Auth0"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.key_a, cls.jwk_a = make_signing_key('llave-a')
+        cls.key_b, cls.jwk_b = make_signing_key('llave-b')
+
+    def setUp(self):
+        handle, self.jwks_path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.write_jwks(self.jwk_a)
+
+    def tearDown(self):
+        os.remove(self.jwks_path)
+
+    def write_jwks(self, *jwks):
+        with open(self.jwks_path, 'w') as jwks_file:
+            json.dump({'keys': list(jwks)}, jwks_file)
+
+    def test_seeded_store_decodes_without_fetching(self):
+        store = JWKSKeyStore('https://auth.invalid/.well-known/jwks.json', seed_file=self.jwks_path)
+        token = make_token(self.key_a, 'llave-a')
+
+        with mock.patch.object(utils, 'jwks_store', store):
+            payload = utils.jwt_decode_token(token)
+
+        self.assertEqual(payload['sub'], 'auth0|prueba')
+        self.assertEqual(store.fetch_count, 0)
+
+    def test_unknown_kid_refreshes_once(self):
+        store = JWKSKeyStore(self.jwks_path, min_refresh_interval=0)
+        self.assertIsNotNone(store.get_key('llave-a'))
+
+        # Rotación de llaves en Auth0
+        self.write_jwks(self.jwk_a, self.jwk_b)
+        self.assertIsNotNone(store.get_key('llave-b'))
+        self.assertIsNotNone(store.get_key('llave-b'))
+        self.assertEqual(store.fetch_count, 2)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        store = JWKSKeyStore(self.jwks_path, min_refresh_interval=60)
+        store.get_key('llave-a')
+        for _ in range(5):
+            self.assertIsNone(store.get_key('desconocida'))
+        self.assertEqual(store.fetch_count, 1)
+
+    def test_expired_keys_are_refreshed(self):
+        store = JWKSKeyStore(self.jwks_path, ttl=0, min_refresh_interval=0)
+        store.get_key('llave-a')
+        store.get_key('llave-a')
+        self.assertEqual(store.fetch_count, 2)
+
+    def test_failed_refresh_keeps_known_keys(self):
+        store = JWKSKeyStore(self.jwks_path, ttl=0, min_refresh_interval=0)
+        store.get_key('llave-a')
+        os.rename(self.jwks_path, self.jwks_path + '.bak')
+        try:
+            self.assertIsNotNone(store.get_key('llave-a'))
+        finally:
+            os.rename(self.jwks_path + '.bak', self.jwks_path)
+
+    def test_concurrent_misses_fetch_once(self):
+        class SlowStore(JWKSKeyStore):
+            def fetch(self):
+                time.sleep(0.05)
+                return super().fetch()
+
+        store = SlowStore(self.jwks_path)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(store.get_key('llave-a')))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(key is not None for key in results))
+        self.assertEqual(store.fetch_count, 1)
+
+    def test_unknown_kid_rejected(self):
+        store = JWKSKeyStore(self.jwks_path)
+        token = make_token(self.key_b, 'llave-b')
+
+        with mock.patch.object(utils, 'jwks_store', store):
+            with self.assertRaisesMessage(Exception, 'Public key not found.'):
+                utils.jwt_decode_token(token)
+
+
+class VerifiedTokenCacheTests(TestCase):
+    """Un token repetido no se vuelve a verificar ni a buscar su usuario"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_key, jwk = make_signing_key('llave-a')
+        cls.store = JWKSKeyStore('https://auth.invalid/.well-known/jwks.json')
+        cls.store.load_jwks({'keys': [jwk]})
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = make_user('patient', 'token_paciente@example.com', name='Paciente', auth0_id='auth0|prueba')
+        patcher = mock.patch.object(utils, 'jwks_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return CustomJSONWebTokenAuthentication().authenticate(request)
+
+    def test_warm_token_skips_verification(self):
+        token = make_token(self.private_key, 'llave-a')
+        user, _ = self.authenticate(token)
+        self.assertEqual(user, self.user)
+
+        with mock.patch.object(utils.jwt, 'decode', wraps=jwt.decode) as decode:
+            with CaptureQueriesContext(connection) as queries:
+                user, _ = self.authenticate(token)
+
+        self.assertEqual(user.pk, self.user.pk)
+        decode.assert_not_called()
+        # Solo se relee el usuario (y sus grupos) por id
+        self.assertEqual(len(queries.captured_queries), 2)
+        self.assertEqual((token_cache.hits, token_cache.misses), (1, 1))
+
+    def test_deactivated_user_is_evicted(self):
+        token = make_token(self.private_key, 'llave-a')
+        self.authenticate(token)
+
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_deactivation_without_signals_is_not_served_from_cache(self):
+        token = make_token(self.private_key, 'llave-a')
+        self.authenticate(token)
+
+        type(self.user).objects.filter(pk=self.user.pk).update(is_active=False)
+
+        self.assertEqual(len(token_cache), 1)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_expired_entries_are_dropped(self):
+        token = make_token(self.private_key, 'llave-a', exp=int(time.time()) + 60)
+        self.authenticate(token)
+        self.assertEqual(len(token_cache), 1)
+
+        with mock.patch('auth0authorization.token_cache.time.time', return_value=time.time() + 120):
+            self.assertIsNone(token_cache.get(token))
+        self.assertEqual(len(token_cache), 0)
+
+    def test_cache_is_bounded(self):
+        cache = type(token_cache)(maxsize=2)
+        exp = int(time.time()) + 60
+        for index in range(3):
+            cache.set(f'token-{index}', {'exp': exp}, self.user.pk)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('token-0'))
+        self.assertIsNotNone(cache.get('token-2'))
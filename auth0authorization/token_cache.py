@@ -0,0 +1,75 @@
+"""
+Cache LRU de tokens ya verificados
+Evita repetir la verificación RS256 cuando un cliente reutiliza el mismo token
+en muchos requests. Solo se guarda el payload y el id del usuario: el usuario
+se vuelve a leer de la base en cada request para no servir un estado viejo
+(ej: desactivado con un update() que no dispara señales).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+VerifiedToken = namedtuple('VerifiedToken', ['payload', 'user_id', 'expires_at'])
+
+
+class VerifiedTokenCache:
+    """
+    LRU acotado de tokens verificados, indexado por el SHA-256 del token.
+    Cada entrada vive hasta el 'exp' del token; los tokens sin 'exp' no se guardan.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(token):
+        if isinstance(token, str):
+            token = token.encode()
+        return hashlib.sha256(token).hexdigest()
+
+    def get(self, token):
+        """Entrada vigente del token o None"""
+        key = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def set(self, token, payload, user_id):
+        expires_at = payload.get('exp')
+        if not isinstance(expires_at, (int, float)) or expires_at <= time.time():
+            return
+        key = self.digest(token)
+        with self._lock:
+            self._entries[key] = VerifiedToken(payload, user_id, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict_user(self, user_id):
+        """Descartar los tokens de un usuario (ej: al desactivarlo)"""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry.user_id == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
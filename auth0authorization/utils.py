@@ -1,22 +1,24 @@
-import json
 import jwt
-import requests
 from django.contrib.auth import authenticate
 
 from config import settings
+from .jwks import JWKSKeyStore
+
+jwks_store = JWKSKeyStore(
+    settings.JWKS_URL,
+    ttl=settings.JWKS_CACHE_TTL,
+    seed_file=settings.JWKS_FILE,
+)
+
 
 def jwt_decode_token(token):
     header = jwt.get_unverified_header(token)
-    jwks = requests.get('https://{}/.well-known/jwks.json'.format('dev-s6xqi0ox0fk82mwr.us.auth0.com')).json()
-    public_key = None
-    for jwk in jwks['keys']:
-        if jwk['kid'] == header['kid']:
-            public_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+    public_key = jwks_store.get_key(header.get('kid'))
 
     if public_key is None:
         raise Exception('Public key not found.')
 
-    issuer = 'https://{}/'.format('dev-s6xqi0ox0fk82mwr.us.auth0.com')
+    issuer = settings.JWT_AUTH['JWT_ISSUER']
     return jwt.decode(token, public_key, audience=settings.JWT_AUDIENCE, issuer=issuer, algorithms=['RS256'])
 
 JWT_ISSUER = settings.JWT_AUTH['JWT_ISSUER']
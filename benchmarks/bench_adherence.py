@@ -0,0 +1,170 @@
+"""
+Analítica de adherencia sobre un historial grande de Intakes.
+
+Se siembran ADHERENCE_BENCH_ROWS intakes (10M por defecto) con SQL masivo:
+generate_series en PostgreSQL o un CTE recursivo en SQLite. Con la base de
+datos de pruebas en SQLite la siembra de 10M filas tarda varios minutos;
+para una corrida rápida: ADHERENCE_BENCH_ROWS=200000 pytest benchmarks/bench_adherence.py
+
+Compara las ventanas calculadas sobre los intakes con las leídas del resumen
+DailyAdherence, y las rutas NumPy y Python de las distribuciones de retraso y rachas.
+"""
+import os
+import random
+from datetime import date
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from api import adherence
+from api.adherence import AdherenceAnalytics, DailyAdherenceRollup
+from api.models import Medication, Schedule, User
+
+ROWS = int(os.getenv('ADHERENCE_BENCH_ROWS', 10_000_000))
+INTAKES_PER_SCHEDULE = 2000
+SCHEDULES_PER_PATIENT = 2
+HOURS_BETWEEN_INTAKES = 6
+PANEL_SIZE = 100
+
+
+def seed_intakes(first_schedule, schedules, rows, now):
+    """
+    Intake n -> schedule first_schedule + n % schedules, cada HOURS_BETWEEN_INTAKES
+    horas hacia atrás desde now. 80% taken (0-44 min de retraso), 10% missed, 10% skipped.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                '''INSERT INTO "Intakes" (schedule_id, planned_at, status, taken_at, created_at)
+                   SELECT %s + (g %% %s),
+                          %s - (g / %s) * %s * interval '1 hour',
+                          CASE WHEN g %% 10 < 8 THEN 'taken' WHEN g %% 10 = 8 THEN 'missed' ELSE 'skipped' END,
+                          CASE WHEN g %% 10 < 8
+                               THEN %s - (g / %s) * %s * interval '1 hour' + (g %% 45) * interval '1 minute' END,
+                          %s
+                   FROM generate_series(0, %s - 1) g''',
+                [first_schedule, schedules, now, schedules, HOURS_BETWEEN_INTAKES,
+                 now, schedules, HOURS_BETWEEN_INTAKES, now, rows]
+            )
+            cursor.execute('ANALYZE "Intakes"')
+            return
+
+        base = now.strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute(
+            '''INSERT INTO "Intakes" (schedule_id, planned_at, status, taken_at, created_at)
+               WITH RECURSIVE g(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM g WHERE n + 1 < %s)
+               SELECT %s + (n %% %s),
+                      datetime(%s, '-' || ((n / %s) * %s) || ' hours'),
+                      CASE WHEN n %% 10 < 8 THEN 'taken' WHEN n %% 10 = 8 THEN 'missed' ELSE 'skipped' END,
+                      CASE WHEN n %% 10 < 8
+                           THEN datetime(%s, '-' || ((n / %s) * %s) || ' hours', '+' || (n %% 45) || ' minutes') END,
+                      %s
+               FROM g''',
+            [rows, first_schedule, schedules, base, schedules, HOURS_BETWEEN_INTAKES,
+             base, schedules, HOURS_BETWEEN_INTAKES, base]
+        )
+        cursor.execute('ANALYZE')
+
+
+@pytest.fixture(scope='module')
+def history(django_db_setup, django_db_blocker):
+    """Pacientes, schedules e intakes sembrados una vez para todo el módulo"""
+    now = timezone.now().replace(microsecond=0)
+    schedules_count = max(ROWS // INTAKES_PER_SCHEDULE, SCHEDULES_PER_PATIENT)
+    patients_count = max(schedules_count // SCHEDULES_PER_PATIENT, 1)
+
+    with django_db_blocker.unblock():
+        patients = User.objects.bulk_create([
+            User(email=f'bench_adherencia{index}@example.com', name=f'Paciente {index}', user_type='patient')
+            for index in range(patients_count)
+        ])
+        medications = Medication.objects.bulk_create([
+            Medication(name=f'Medicamento {index}', form='tablet') for index in range(SCHEDULES_PER_PATIENT)
+        ])
+        schedules = Schedule.objects.bulk_create([
+            Schedule(
+                user=patients[index % patients_count],
+                medication=medications[index // patients_count % SCHEDULES_PER_PATIENT],
+                start_date=date(2020, 1, 1), pattern='every 6h', dose_amount='1'
+            )
+            for index in range(schedules_count)
+        ])
+        seed_intakes(schedules[0].id, schedules_count, ROWS, now)
+
+        yield {'now': now, 'patients': patients}
+
+        # Se limpia en cascada al borrar los usuarios
+        Medication.objects.filter(id__in=[medication.id for medication in medications]).delete()
+        User.objects.filter(id__in=[patient.id for patient in patients]).delete()
+
+
+@pytest.fixture
+def analytics(history):
+    return AdherenceAnalytics(now=history['now'])
+
+
+@pytest.mark.django_db
+def test_panel_by_patient_30_days(benchmark, history, analytics):
+    panel = [patient.id for patient in history['patients'][:PANEL_SIZE]]
+    metrics = benchmark(analytics.by_patient, panel, 30)
+    assert len(metrics) == len(panel)
+
+
+@pytest.fixture(scope='module')
+def rollup(history, django_db_blocker):
+    """Resumen DailyAdherence reconstruido desde el historial sembrado"""
+    with django_db_blocker.unblock():
+        DailyAdherenceRollup.rebuild()
+    return AdherenceAnalytics(now=history['now'], use_rollup=True)
+
+
+@pytest.mark.django_db
+def test_panel_by_patient_30_days_rollup(benchmark, history, rollup):
+    panel = [patient.id for patient in history['patients'][:PANEL_SIZE]]
+    metrics = benchmark(rollup.by_patient, panel, 30)
+    assert len(metrics) == len(panel)
+
+
+@pytest.mark.django_db
+def test_sliding_windows_rollup(benchmark, history, rollup):
+    windows = benchmark(rollup.sliding_windows, history['patients'][0].id)
+    assert windows[90]['planned'] > 0
+
+
+@pytest.mark.django_db
+def test_sliding_windows(benchmark, history, analytics):
+    patient_id = history['patients'][0].id
+    windows = benchmark(analytics.sliding_windows, patient_id)
+    assert windows[90]['planned'] >= windows[7]['planned'] > 0
+
+
+@pytest.mark.django_db
+def test_patient_report_90_days(benchmark, history, analytics):
+    patient_id = history['patients'][0].id
+    report = benchmark(analytics.patient_report, patient_id, 90)
+    assert report['lateness']['count'] > 0
+
+
+# Rutas en memoria: 1M de retrasos y rachas sin acceso a la base de datos
+LATENESS = [random.gauss(10, 30) for _ in range(1_000_000)]
+FLAGS = [random.random() < 0.85 for _ in range(1_000_000)]
+numpy_required = pytest.mark.skipif(adherence.np is None, reason='NumPy no está instalado')
+
+
+def test_lateness_distribution_python(benchmark):
+    benchmark(AdherenceAnalytics(use_numpy=False).lateness_distribution, LATENESS)
+
+
+@numpy_required
+def test_lateness_distribution_numpy(benchmark):
+    benchmark(AdherenceAnalytics(use_numpy=True).lateness_distribution, LATENESS)
+
+
+def test_streaks_python(benchmark):
+    benchmark(AdherenceAnalytics(use_numpy=False).streaks, FLAGS)
+
+
+@numpy_required
+def test_streaks_numpy(benchmark):
+    benchmark(AdherenceAnalytics(use_numpy=True).streaks, FLAGS)
@@ -0,0 +1,139 @@
+"""
+Carga concurrente sobre las vistas de lectura sync y async bajo un servidor ASGI local.
+
+Levanta uvicorn en un hilo con config.asgi contra la base de datos de pruebas y
+lanza ASYNC_BENCH_REQUESTS requests repartidos en ASYNC_BENCH_CONCURRENCY
+conexiones keep-alive abiertas a la vez. Cada ronda reporta requests/s en extra_info.
+
+Ejecución: pytest benchmarks/bench_async.py
+Requiere uvicorn (no forma parte de requirements.txt).
+"""
+import asyncio
+import os
+import socket
+import threading
+import time
+from datetime import date
+
+import pytest
+
+uvicorn = pytest.importorskip('uvicorn')
+
+from api.access_cache import access_cache  # noqa: E402
+from api.models import Medication, Schedule, User, UserCreationService  # noqa: E402
+
+REQUESTS = int(os.getenv('ASYNC_BENCH_REQUESTS', 2000))
+CONCURRENCY = int(os.getenv('ASYNC_BENCH_CONCURRENCY', 500))
+PATIENTS = 50
+SCHEDULES_PER_PATIENT = 10
+
+# (vista sync, vista async, usuario que la consulta)
+ENDPOINTS = {
+    'patient_schedules': ('/api/patient/schedules/', '/api/async/patient/schedules/', 'patient'),
+    'patient_caregivers': ('/api/patient/caregivers/', '/api/async/patient/caregivers/', 'patient'),
+    'caregiver_patients': ('/api/caregiver/patients/', '/api/async/caregiver/patients/', 'doctor'),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def server(django_db_setup, django_db_blocker):
+    """Datos sembrados y uvicorn sirviendo la app ASGI durante todo el módulo"""
+    from config.asgi import application
+
+    with django_db_blocker.unblock():
+        doctor = UserCreationService.create_user(
+            user_type='doctor', email='bench_async_doctor@example.com', password=None, name='Doctor'
+        )
+        patients = User.objects.bulk_create([
+            User(email=f'bench_async{index}@example.com', name=f'Paciente {index}', user_type='patient')
+            for index in range(PATIENTS)
+        ])
+        for patient in patients:
+            UserCreationService.assign_doctor_to_patient(doctor.id, patient.id, specialty='General')
+        medications = Medication.objects.bulk_create([
+            Medication(name=f'Async {index}', form='tablet') for index in range(SCHEDULES_PER_PATIENT)
+        ])
+        Schedule.objects.bulk_create([
+            Schedule(user=patient, medication=medication, start_date=date(2025, 1, 1),
+                     pattern='daily', dose_amount='1')
+            for patient in patients for medication in medications
+        ])
+
+        port = free_port()
+        uvicorn_server = uvicorn.Server(uvicorn.Config(
+            application, host='127.0.0.1', port=port, log_level='warning', lifespan='off',
+            timeout_keep_alive=60, backlog=CONCURRENCY * 2
+        ))
+        thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+        thread.start()
+        while not uvicorn_server.started:
+            time.sleep(0.05)
+
+        yield {'url': f'http://127.0.0.1:{port}', 'users': {'patient': patients[0], 'doctor': doctor}}
+
+        uvicorn_server.should_exit = True
+        thread.join()
+        access_cache.clear()
+        Medication.objects.filter(id__in=[medication.id for medication in medications]).delete()
+        User.objects.filter(id__in=[doctor.id] + [patient.id for patient in patients]).delete()
+
+
+async def connection_worker(host, port, path, user_id, requests):
+    """
+    Una conexión keep-alive que envía requests GET seguidos.
+    Cliente HTTP/1.1 mínimo sobre asyncio: el costo del lado del cliente no
+    debe dominar la medición del servidor (corre en el mismo proceso).
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    request = (
+        f'GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-ID: {user_id}\r\n\r\n'
+    ).encode()
+    ok = 0
+    try:
+        for _ in range(requests):
+            writer.write(request)
+            status_line = await reader.readline()
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            ok += status_line.split()[1] == b'200'
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return ok
+
+
+async def load(url, path, user_id, requests, concurrency):
+    """requests GET repartidos en concurrency conexiones; retorna las respuestas 200"""
+    host, port = url.removeprefix('http://').split(':')
+    per_connection, remainder = divmod(requests, concurrency)
+    results = await asyncio.gather(*(
+        connection_worker(host, int(port), path, user_id, per_connection + (index < remainder))
+        for index in range(concurrency)
+    ))
+    return sum(results)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+@pytest.mark.parametrize('endpoint', list(ENDPOINTS))
+def test_concurrent_reads(benchmark, server, endpoint, mode):
+    sync_path, async_path, user_type = ENDPOINTS[endpoint]
+    path = sync_path if mode == 'sync' else async_path
+    user = server['users'][user_type]
+
+    ok = benchmark.pedantic(
+        lambda: asyncio.run(load(server['url'], path, user.id, REQUESTS, CONCURRENCY)), rounds=3, iterations=1
+    )
+
+    assert ok == REQUESTS
+    benchmark.extra_info['requests_per_second'] = round(REQUESTS / benchmark.stats.stats.mean)
@@ -0,0 +1,51 @@
+"""
+Autenticación JWT en frío (verificación RS256 + búsqueda del usuario) frente
+a en caliente (token ya verificado en el cache LRU; solo se relee el usuario).
+
+Ejecución: pytest benchmarks/bench_auth.py
+"""
+from unittest import mock
+
+import pytest
+from rest_framework.test import APIRequestFactory
+
+from api.models import UserCreationService
+from auth0authorization import utils
+from auth0authorization.authentication import CustomJSONWebTokenAuthentication, token_cache
+from auth0authorization.jwks import JWKSKeyStore
+from auth0authorization.tests import make_signing_key, make_token
+
+
+@pytest.fixture
+def signed_request(db):
+    private_key, jwk = make_signing_key('benchmark')
+    store = JWKSKeyStore('https://auth.invalid/.well-known/jwks.json')
+    store.load_jwks({'keys': [jwk]})
+    UserCreationService.create_user(
+        user_type='patient', email='benchmark@example.com', password=None,
+        name='Benchmark', auth0_id='auth0|prueba'
+    )
+    token = make_token(private_key, 'benchmark')
+    request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    token_cache.clear()
+    with mock.patch.object(utils, 'jwks_store', store):
+        yield request
+    token_cache.clear()
+
+
+def test_authenticate_cold(benchmark, signed_request):
+    def authenticate():
+        token_cache.clear()
+        return CustomJSONWebTokenAuthentication().authenticate(signed_request)
+
+    user, _ = benchmark(authenticate)
+    assert user.email == 'benchmark@example.com'
+
+
+def test_authenticate_warm(benchmark, signed_request):
+    CustomJSONWebTokenAuthentication().authenticate(signed_request)
+
+    user, _ = benchmark(CustomJSONWebTokenAuthentication().authenticate, signed_request)
+    assert user.email == 'benchmark@example.com'
+    assert token_cache.misses == 1
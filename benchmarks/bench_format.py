@@ -0,0 +1,64 @@
+"""
+Formateo de listas de contactos y reportes: funciones escalares de utils.format
+aplicadas fila por fila frente a las versiones por lote (format_*s).
+
+Ejecución: pytest benchmarks/bench_format.py
+Las filas se configuran con FORMAT_BENCH_ROWS (100k por defecto).
+"""
+import os
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from utils import format as format_module
+from utils.format import Format
+
+ROWS = int(os.getenv('FORMAT_BENCH_ROWS', 100_000))
+
+random.seed(42)
+PHONES = [
+    random.choice(('{}', '+57 {}', 'whatsapp:+57{}', '({}) ')).format(
+        f'3{random.randint(0, 99):02d}-{random.randint(0, 999):03d}-{random.randint(0, 9999):04d}'
+    )
+    for _ in range(ROWS)
+]
+DATES = [
+    (date(2024, 1, 1) + timedelta(days=random.randint(0, 730))).isoformat() + random.choice(('', ' 08:30:00'))
+    for _ in range(ROWS)
+]
+AMOUNTS = [random.uniform(0, 50_000_000) for _ in range(ROWS)]
+
+numpy_required = pytest.mark.skipif(format_module.np is None, reason='NumPy no está instalado')
+
+
+def test_phone_numbers_scalar(benchmark):
+    benchmark(lambda: [Format.format_phone_number(phone) for phone in PHONES])
+
+
+def test_phone_numbers_batch(benchmark):
+    result = benchmark(Format.format_phone_numbers, PHONES)
+    assert result == [Format.format_phone_number(phone) for phone in PHONES]
+
+
+def test_dates_scalar(benchmark):
+    benchmark(lambda: [Format.format_date(value) for value in DATES])
+
+
+def test_dates_batch(benchmark):
+    result = benchmark(Format.format_dates, DATES)
+    assert result == [Format.format_date(value) for value in DATES]
+
+
+def test_numbers_scalar(benchmark):
+    benchmark(lambda: [Format.format_number(amount) for amount in AMOUNTS])
+
+
+def test_numbers_batch_python(benchmark):
+    benchmark(Format.format_numbers, AMOUNTS, use_numpy=False)
+
+
+@numpy_required
+def test_numbers_batch_numpy(benchmark):
+    result = benchmark(Format.format_numbers, AMOUNTS, use_numpy=True)
+    assert result == [Format.format_number(amount) for amount in AMOUNTS]
@@ -0,0 +1,103 @@
+"""
+Despacho de recordatorios a ritmo de ~1M por día.
+
+- Rueda de tiempo en memoria: 1M de recordatorios repartidos en un día y
+  avance segundo a segundo.
+- Despachador contra la base de datos de pruebas: una hora simulada con
+  REMINDERS_BENCH_PER_DAY / 24 intakes (41.667 por defecto), un ciclo por
+  segundo. extra_info reporta las consultas hechas en la hora.
+
+Ejecución: pytest benchmarks/bench_reminders.py
+"""
+import os
+import random
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+import pytest
+from django.db import connection
+
+from api.models import Intake, JobCheckpoint, Medication, Schedule, User
+from api.reminders import ReminderDispatcher, ReminderSender, TimingWheel
+
+PER_DAY = int(os.getenv('REMINDERS_BENCH_PER_DAY', 1_000_000))
+PER_HOUR = PER_DAY // 24
+PATIENTS = 1000
+START = datetime(2025, 1, 2, 8, 0, tzinfo=dt_timezone.utc)
+
+random.seed(7)
+DAY_TICKS = sorted(random.randrange(1, 86400) for _ in range(PER_DAY))
+
+
+class CountingSender(ReminderSender):
+    def __init__(self):
+        self.sent = 0
+
+    def send_many(self, reminders):
+        self.sent += len(reminders)
+
+
+def wheel_day():
+    wheel = TimingWheel(0)
+    for tick in DAY_TICKS:
+        wheel.add(tick, tick)
+    fired = 0
+    for tick in range(1, 86400):
+        fired += len(wheel.advance(tick))
+    return fired
+
+
+def test_wheel_one_day(benchmark):
+    fired = benchmark.pedantic(wheel_day, rounds=3)
+    assert fired == PER_DAY
+
+
+@pytest.fixture(scope='module')
+def hour_of_intakes(django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        patients = User.objects.bulk_create([
+            User(email=f'bench_recordatorio{index}@example.com', name=f'Paciente {index}', user_type='patient')
+            for index in range(PATIENTS)
+        ])
+        medication = Medication.objects.create(name='Recordatorio bench', form='tablet')
+        schedules = Schedule.objects.bulk_create([
+            Schedule(user=patient, medication=medication, start_date=date(2025, 1, 1),
+                     pattern='every 1h', dose_amount='1')
+            for patient in patients
+        ])
+        # Segundos distintos dentro de cada schedule: (schedule, planned_at) es único
+        seconds = [random.sample(range(1, 3600), PER_HOUR // PATIENTS + 1) for _ in range(PATIENTS)]
+        Intake.objects.bulk_create([
+            Intake(schedule=schedules[index % PATIENTS],
+                   planned_at=START + timedelta(seconds=seconds[index % PATIENTS][index // PATIENTS]))
+            for index in range(PER_HOUR)
+        ], batch_size=5000)
+
+        yield
+
+        JobCheckpoint.objects.filter(name=ReminderDispatcher.CHECKPOINT_NAME).delete()
+        medication.delete()
+        User.objects.filter(id__in=[patient.id for patient in patients]).delete()
+
+
+def dispatch_hour():
+    JobCheckpoint.objects.filter(name=ReminderDispatcher.CHECKPOINT_NAME).delete()
+    sender = CountingSender()
+    dispatcher = ReminderDispatcher(sender)
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_queries):
+        for second in range(3600):
+            dispatcher.step(START + timedelta(seconds=second))
+    return sender.sent, queries
+
+
+@pytest.mark.django_db
+def test_dispatcher_one_hour(benchmark, hour_of_intakes):
+    sent, queries = benchmark.pedantic(dispatch_hour, rounds=3)
+    assert sent == PER_HOUR
+    benchmark.extra_info['queries_per_hour'] = queries
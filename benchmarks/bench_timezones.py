@@ -0,0 +1,41 @@
+"""
+Conversión de horas locales a UTC: una zona construida y convertida por ocurrencia
+frente al lote de utils.timezones (zona cacheada y offset memoizado por día).
+
+Ejecución: pytest benchmarks/bench_timezones.py
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+
+from dateutil.tz import gettz
+
+from utils.timezones import get_zone, to_utc_many
+
+TZ_NAME = 'America/New_York'
+# Un año de dosis cada 15 minutos (~35k) repetido hasta ~1M de ocurrencias
+LOCAL_TIMES = [datetime(2025, 1, 1) + timedelta(minutes=15 * step) for step in range(4 * 24 * 365)] * 30
+
+
+def per_occurrence_dateutil():
+    return [local.replace(tzinfo=gettz(TZ_NAME)).astimezone(dt_timezone.utc) for local in LOCAL_TIMES]
+
+
+def per_occurrence_zoneinfo():
+    return [local.replace(tzinfo=ZoneInfo(TZ_NAME)).astimezone(dt_timezone.utc) for local in LOCAL_TIMES]
+
+
+def bulk():
+    return list(to_utc_many(LOCAL_TIMES, get_zone(TZ_NAME)))
+
+
+def test_per_occurrence_dateutil(benchmark):
+    benchmark.pedantic(per_occurrence_dateutil, rounds=3)
+
+
+def test_per_occurrence_zoneinfo(benchmark):
+    benchmark.pedantic(per_occurrence_zoneinfo, rounds=3)
+
+
+def test_bulk(benchmark):
+    result = benchmark.pedantic(bulk, rounds=3)
+    assert result[:1000] == per_occurrence_zoneinfo()[:1000]
@@ -95,6 +95,10 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt'
 ]
 
+# Lookups de pg_trgm (trigram_similar) para la búsqueda de medicamentos
+if DJANGO_ENV != 'local':
+    INSTALLED_APPS.append('django.contrib.postgres')
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -202,11 +206,40 @@ REST_FRAMEWORK = {
     'DATE_FORMAT': '%Y-%m-%d',
 }
 
+# Cache
+# Por defecto en memoria local; ACCESS_CACHE_BACKEND permite usar otro backend
+# (ej: django.core.cache.backends.redis.RedisCache) para compartirlo entre procesos.
+# Con memoria local la invalidación del cache de accesos solo alcanza al proceso
+# que hizo el cambio: fuera de local los demás workers pueden conservar un acceso
+# revocado hasta ACCESS_CACHE_TIMEOUT, que por eso baja a 30 segundos.
+LOCMEM_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+ACCESS_CACHE_BACKEND = os.getenv('ACCESS_CACHE_BACKEND', LOCMEM_CACHE_BACKEND)
+ACCESS_CACHE_SHARED = ACCESS_CACHE_BACKEND != LOCMEM_CACHE_BACKEND or DJANGO_ENV == 'local'
+CACHES = {
+    'default': {
+        'BACKEND': LOCMEM_CACHE_BACKEND,
+        'LOCATION': 'appmedic-default',
+    },
+    'access': {
+        'BACKEND': ACCESS_CACHE_BACKEND,
+        'LOCATION': os.getenv('ACCESS_CACHE_LOCATION', 'appmedic-access'),
+        'TIMEOUT': int(os.getenv('ACCESS_CACHE_TIMEOUT', 300 if ACCESS_CACHE_SHARED else 30)),
+    },
+}
+ACCESS_CACHE_ALIAS = 'access'
+
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
     'django.contrib.auth.backends.RemoteUserBackend',
 ]
 JWT_AUDIENCE = os.getenv('JWT_AUDIENCE', 'localhost/auth/')
+AUTH0_DOMAIN = os.getenv('AUTH0_DOMAIN', 'dev-s6xqi0ox0fk82mwr.us.auth0.com')
+# Llaves públicas de Auth0: URL (o archivo local), TTL del cache y archivo para pre-cargarlas
+JWKS_URL = os.getenv('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_CACHE_TTL = int(os.getenv('JWKS_CACHE_TTL', 600))
+JWKS_FILE = os.getenv('JWKS_FILE')
+# Tokens ya verificados que se conservan en memoria hasta su 'exp'
+JWT_VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv('JWT_VERIFIED_TOKEN_CACHE_SIZE', 1024))
 JWT_AUTH = {
     'JWT_PAYLOAD_GET_USERNAME_HANDLER':
         'auth0authorization.utils.jwt_get_username_from_payload_handler',
@@ -214,7 +247,7 @@ JWT_AUTH = {
         'auth0authorization.utils.jwt_decode_token',
     'JWT_ALGORITHM': 'RS256',
     'JWT_AUDIENCE': JWT_AUDIENCE,
-    'JWT_ISSUER': 'https://dev-s6xqi0ox0fk82mwr.us.auth0.com/',
+    'JWT_ISSUER': f'https://{AUTH0_DOMAIN}/',
     'JWT_AUTH_HEADER_PREFIX': 'Bearer',
 }
 
@@ -1,3 +1,34 @@
+import re
+from datetime import date, datetime
+
+from django.utils.dateparse import parse_datetime
+
+from utils.timezones import UTC, get_zone
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional
+    np = None
+
+# Versiones por lote (format_*s): tablas y regex compiladas una sola vez.
+# Cubren la forma canónica de la entrada; lo demás pasa por la función escalar.
+
+# Bytes ASCII que se descartan al limpiar un teléfono: todo menos dígitos, + y el
+# salto de línea que separa los números del lote
+PHONE_DELETE_BYTES = bytes(
+    code for code in range(128) if not chr(code).isdigit() and chr(code) not in '+\n'
+)
+PHONE_COMMON_EXTENSIONS = ("1", "52", "54", "56", "58", "591", "593", "594", "595", "598")
+PHONE_RE = re.compile(r'[0-9]{8,15}')
+# Colombia: extensión de 2 dígitos + móvil de 10 dígitos que empieza con 3
+PHONE_CO_RE = re.compile(r'[0-9]{2}3[0-9]{9}')
+
+DATE_RE = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2})(?: (?:[01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9])?')
+
+# Enteros que caben sin pérdida en int64
+INT64_LIMIT = 2 ** 63
+
+
 class Format:
     @staticmethod
     def format_datetime(fecha):
@@ -20,11 +51,9 @@ class Format:
             try:
                 # Intentar formato con hora: '2025-07-17 00:00:00'
                 if ' ' in fecha:
-                    from datetime import datetime
                     fecha = datetime.strptime(fecha, '%Y-%m-%d %H:%M:%S')
                 else:
                     # Intentar formato solo fecha: '2025-07-17'
-                    from datetime import datetime
                     fecha = datetime.strptime(fecha, '%Y-%m-%d')
             except ValueError:
                 return None
@@ -32,6 +61,40 @@ class Format:
         # Formatear a string legible
         return fecha.strftime('%d-%m-%Y')
 
+    @staticmethod
+    def format_dates(fechas):
+        """
+        Versión por lotes de format_date: lista con el mismo resultado por elemento.
+        Los strings 'YYYY-MM-DD' y 'YYYY-MM-DD HH:MM:SS' se validan con una regex
+        compilada y cada fecha distinta se formatea una sola vez; cualquier otra
+        forma (ej. '2025-7-1') pasa por format_date.
+        """
+        formateadas = {}
+        resultado = []
+        for fecha in fechas:
+            if isinstance(fecha, str):
+                match = DATE_RE.fullmatch(fecha)
+                if match is None:
+                    resultado.append(Format.format_date(fecha))
+                    continue
+                dia = match.group(1, 2, 3)
+                if dia not in formateadas:
+                    anio, mes, dia_mes = map(int, dia)
+                    try:
+                        date(anio, mes, dia_mes)
+                        valida = anio >= 1000
+                    except ValueError:
+                        formateadas[dia] = None
+                    else:
+                        # strftime('%Y') no rellena años de menos de 4 dígitos
+                        formateadas[dia] = f'{dia[2]}-{dia[1]}-{dia[0]}' if valida else Format.format_date(fecha)
+                resultado.append(formateadas[dia])
+            elif isinstance(fecha, date) and fecha.year >= 1000:
+                resultado.append(f'{fecha.day:02d}-{fecha.month:02d}-{fecha.year}')
+            else:
+                resultado.append(Format.format_date(fecha))
+        return resultado
+
     @staticmethod
     def month_to_text(month):
         """
@@ -152,6 +215,62 @@ class Format:
         
         return numero_final
 
+    @staticmethod
+    def format_phone_numbers(numeros, extension_pais="57"):
+        """
+        Versión por lotes de format_phone_number para importar o exportar
+        listas de contactos: lista con el mismo resultado por elemento.
+        Los números se limpian todos juntos con un solo bytes.translate y se
+        validan con una regex compilada; los que tienen caracteres no ASCII
+        pasan por format_phone_number.
+        
+        Ejemplo:
+            ["312-345-6789", "12345"] -> ["573123456789", None]
+        """
+        if not extension_pais.isascii():
+            return [Format.format_phone_number(numero, extension_pais) for numero in numeros]
+
+        recortados = [str(numero).strip() if numero else "" for numero in numeros]
+        ascii_only = [numero if numero.isascii() else "" for numero in recortados]
+        lote = "\n".join(ascii_only)
+        if lote.count("\n") == len(ascii_only) - 1:
+            limpios = lote.encode("ascii").translate(None, PHONE_DELETE_BYTES).decode("ascii").split("\n")
+        else:
+            # Algún número trae saltos de línea internos: limpiar uno por uno
+            limpios = [
+                numero.encode("ascii").translate(None, PHONE_DELETE_BYTES).decode("ascii").replace("\n", "")
+                for numero in ascii_only
+            ]
+
+        valido = PHONE_CO_RE if extension_pais == "57" else PHONE_RE
+        resultado = []
+        for numero, numero_limpio in zip(recortados, limpios):
+            if not numero.isascii():
+                resultado.append(Format.format_phone_number(numero, extension_pais))
+                continue
+            if not numero_limpio:
+                resultado.append(None)
+                continue
+
+            # Solo se conserva el primer +
+            plus = numero_limpio.find("+")
+            if plus >= 0:
+                numero_limpio = numero_limpio[:plus + 1] + numero_limpio[plus + 1:].replace("+", "")
+
+            if numero_limpio[0] == "+":
+                numero_limpio = numero_limpio[1:]
+                if numero_limpio.startswith(extension_pais) or numero_limpio.startswith(PHONE_COMMON_EXTENSIONS):
+                    numero_final = numero_limpio
+                else:
+                    numero_final = extension_pais + numero_limpio
+            elif numero_limpio.startswith(extension_pais):
+                numero_final = numero_limpio
+            else:
+                numero_final = extension_pais + numero_limpio
+
+            resultado.append(numero_final if valido.fullmatch(numero_final) else None)
+        return resultado
+
     @staticmethod
     def quitar_extension_telefono(numero, extension_pais="57"):
         """
@@ -226,28 +345,20 @@ class Format:
             fecha_bogota(1755016999) -> datetime desde timestamp Unix en Bogotá
             fecha_bogota("1755016999") -> datetime desde timestamp Unix en Bogotá
         """
-        from datetime import datetime
-        from dateutil.tz import gettz
-        from django.utils.dateparse import parse_datetime
-        from django.utils import timezone
-        
-        bogota_tz = gettz('America/Bogota')
+        bogota_tz = get_zone('America/Bogota')
         
         # Si no se proporciona timestamp, usar hora actual
         if timestamp_str is None:
-            return datetime.now().astimezone(bogota_tz)
+            return datetime.now(bogota_tz)
         
         try:
             # Si es un número (timestamp Unix)
             if isinstance(timestamp_str, (int, float)):
-                dt = datetime.fromtimestamp(timestamp_str, tz=timezone.utc)
-                return dt.astimezone(bogota_tz)
+                return datetime.fromtimestamp(timestamp_str, tz=bogota_tz)
             
             # Si es string, verificar si es timestamp Unix
             if isinstance(timestamp_str, str) and timestamp_str.isdigit():
-                timestamp_unix = int(timestamp_str)
-                dt = datetime.fromtimestamp(timestamp_unix, tz=timezone.utc)
-                return dt.astimezone(bogota_tz)
+                return datetime.fromtimestamp(int(timestamp_str), tz=bogota_tz)
             
             # Si es string con formato ISO
             dt = parse_datetime(timestamp_str)
@@ -257,7 +368,7 @@ class Format:
             
             # Si no tiene zona horaria, asumir UTC
             if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=timezone.utc)
+                dt = dt.replace(tzinfo=UTC)
             
             # Convertir a zona horaria de Bogotá
             return dt.astimezone(bogota_tz)
@@ -265,7 +376,7 @@ class Format:
         except (ValueError, AttributeError, TypeError, OSError) as e:
             print(f"Error parsing timestamp '{timestamp_str}': {e}")
             # Fallback: hora actual de Bogotá
-            return datetime.now().astimezone(bogota_tz)
+            return datetime.now(bogota_tz)
         
     @staticmethod
     def format_number(numero, separador_miles="."):
@@ -317,6 +428,50 @@ class Format:
         except (ValueError, TypeError, OverflowError):
             return "0"
 
+    @staticmethod
+    def format_numbers(numeros, separador_miles=".", use_numpy=None):
+        """
+        Versión por lotes de format_number: lista con el mismo resultado por elemento.
+        Un arreglo numérico de NumPy, o una secuencia solo de int y float, se
+        redondea de forma vectorizada (np.rint redondea al par, igual que round);
+        un arreglo se formatea como su tolist(). Lo demás se procesa valor por valor.
+        
+        Args:
+            numeros (iterable): Números (float/str/int) a formatear
+            separador_miles (str): Separador de miles (por defecto ".")
+            use_numpy (bool, optional): Forzar o desactivar la ruta NumPy (por defecto si está instalado)
+        """
+        use_numpy = np is not None if use_numpy is None else use_numpy and np is not None
+        if use_numpy and isinstance(numeros, np.ndarray) and numeros.dtype.kind in 'biuf':
+            return Format._format_numbers_numpy(numeros.astype(np.float64), separador_miles)
+
+        numeros = list(numeros)
+        # np.int64 y similares no son int: format_number los descarta, aquí también
+        if use_numpy and numeros and all(isinstance(numero, (int, float)) for numero in numeros):
+            try:
+                valores = np.asarray(numeros, dtype=np.float64)
+            except OverflowError:
+                pass  # int que no cabe en un float: format_number retorna "0"
+            else:
+                return Format._format_numbers_numpy(valores, separador_miles)
+
+        return [Format.format_number(numero, separador_miles) for numero in numeros]
+
+    @staticmethod
+    def _format_numbers_numpy(valores, separador_miles):
+        """Formatear un arreglo float64: redondeo vectorizado y separadores por elemento"""
+        redondeados = np.rint(valores)
+        # NaN e infinitos no se pueden convertir a entero: "0" como en format_number
+        finitos = np.isfinite(redondeados)
+        exactos = finitos & (np.abs(redondeados) < INT64_LIMIT)
+        enteros = np.where(exactos, redondeados, 0).astype(np.int64).tolist()
+        for indice in np.flatnonzero(finitos & ~exactos).tolist():
+            enteros[indice] = int(redondeados[indice])
+
+        if separador_miles == ".":
+            return [f"{numero:,}".replace(",", ".") for numero in enteros]
+        return [f"{numero:,}" for numero in enteros]
+
 
     @staticmethod
     def clean_filename(text):
@@ -0,0 +1,81 @@
+"""
+Servicio de zonas horarias
+Los pacientes guardan un nombre IANA (User.tz) y los Intake se guardan en UTC.
+Las ZoneInfo se construyen una sola vez por nombre y las conversiones de hora
+local a UTC se hacen por lotes, reutilizando el offset de los días sin cambio
+de horario.
+
+Política ante cambios de horario (DST) al convertir una hora local a UTC:
+- Hueco (la hora no existe, ej. 02:30 al adelantar el reloj): se corre hacia
+  adelante la duración del hueco (02:30 -> 03:30).
+- Pliegue (la hora ocurre dos veces al atrasar el reloj): se usa la primera.
+"""
+from datetime import datetime, time, timezone as dt_timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+UTC = dt_timezone.utc
+DEFAULT_TZ = 'UTC'
+
+# Nombres distintos en uso (IANA tiene ~600); acota nombres inválidos repetidos
+ZONE_CACHE_SIZE = 1024
+# Días (zona, fecha) con su offset memoizado: ~10 años de 100 zonas
+DAY_OFFSET_CACHE_SIZE = 1 << 18
+
+
+@lru_cache(maxsize=ZONE_CACHE_SIZE)
+def get_zone(tz_name):
+    """ZoneInfo para un nombre IANA, construida una vez por nombre (UTC si no es válido)"""
+    try:
+        return ZoneInfo(tz_name or DEFAULT_TZ)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TZ)
+
+
+@lru_cache(maxsize=DAY_OFFSET_CACHE_SIZE)
+def day_offset(tz, day):
+    """
+    Offset UTC de un día local completo, o None si el día tiene un cambio de
+    horario (incluye los cambios a medianoche).
+    """
+    first = datetime.combine(day, time.min)
+    last = datetime.combine(day, time.max)
+    offsets = {
+        tz.utcoffset(first), tz.utcoffset(first.replace(fold=1)),
+        tz.utcoffset(last), tz.utcoffset(last.replace(fold=1)),
+    }
+    return offsets.pop() if len(offsets) == 1 else None
+
+
+def to_utc(local, tz):
+    """Hora local (naive) de la zona tz a UTC, con la política de huecos y pliegues"""
+    return local.replace(tzinfo=tz, fold=0).astimezone(UTC)
+
+
+def to_utc_many(local_datetimes, tz):
+    """
+    Convertir un lote de horas locales (naive) de una misma zona a UTC.
+    Es un generador: los días sin cambio de horario resuelven con un offset
+    memoizado; los días con cambio pasan por to_utc.
+    """
+    for local in local_datetimes:
+        offset = day_offset(tz, local.date())
+        if offset is None:
+            yield to_utc(local, tz)
+        else:
+            yield (local - offset).replace(tzinfo=UTC)
+
+
+def local_midnight(day, tz):
+    """Inicio del día local en UTC (la medianoche puede caer en un hueco)"""
+    return to_utc(datetime.combine(day, time(0, 0)), tz)
+
+
+def to_local(value, tz_name):
+    """Datetime aware en la zona horaria indicada"""
+    return value.astimezone(get_zone(tz_name))
+
+
+def local_date(value, tz_name):
+    """Fecha local de un datetime aware en la zona indicada"""
+    return value.astimezone(get_zone(tz_name)).date()